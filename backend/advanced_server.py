@@ -4,20 +4,106 @@ import socketserver
 import json
 import sqlite3
 import os
+import tempfile
+import time
 from datetime import datetime
 from http.server import BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs, unquote
 import traceback
 
-# Initialize SQLite database
-DB_FILE = 'psih_canvasdb.db'
+import table_stats
+import triggers
+import typed_storage
+from record_validation import RecordValidationError, TableValidator, get_validator
+import relations
+import metrics
+import migrations
+import scheduler
+import view_retention
+import canvas_ops
+import change_feed
+import jobs
+import record_export
+import record_import
+import record_patch
+import field_migrations
+import cascade_delete
+from canvas_runs import load_canvas, save_view
+import query_log
+from profiling import Profiler
 
-def init_db():
-    conn = sqlite3.connect(DB_FILE)
+# Initialize SQLite database (DB_FILE/PORT can be overridden, e.g. by the benchmark harness)
+DB_FILE = os.environ.get('DB_FILE', 'psih_canvasdb.db')
+IMPORT_BLOCK = 1024 * 1024  # bytes read from the socket at a time when spooling an import
+# Demo tables and canvas for an empty database, opt-in
+SEED_DEMO_DATA = os.environ.get('SEED_DEMO_DATA', '').lower() in ('1', 'true', 'yes')
+
+def connect_db():
+    """Connection for a request or a background thread; SQLite only enforces foreign keys
+    (ON DELETE CASCADE) on connections that turned them on"""
+    conn = metrics.connect_sqlite(DB_FILE, timeout=10.0)
+    conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
+# Runs canvases for triggers in background threads, each on its own connection
+trigger_engine = triggers.TriggerEngine(connect_db)
+canvas_scheduler = scheduler.Scheduler(connect_db)
+view_compactor = view_retention.ViewCompactor(connect_db)
+table_stats.start_refresher(connect_db)
+
+def ensure_column(c, table, column, ddl):
+    """Add a column that was introduced after the table was first created"""
+    c.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in c.fetchall()]:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+def get_typed_fields(c, table_id):
+    """Column specs of a table stored in typed mode, or None for plain JSON tables"""
+    c.execute('SELECT storage_mode FROM tables WHERE id = ?', (table_id,))
+    row = c.fetchone()
+    if not row or row[0] != typed_storage.STORAGE_TYPED:
+        return None
+    c.execute('SELECT name, field_type FROM fields WHERE table_id = ? ORDER BY id', (table_id,))
+    return typed_storage.field_specs({'name': r[0], 'field_type': r[1]} for r in c.fetchall())
+
+def get_table_validator(c, table_id):
+    """Cached record validator compiled from the table's current fields"""
+    c.execute('SELECT name, field_type, required, options, default_value FROM fields WHERE table_id = ? ORDER BY id',
+              (table_id,))
+    fields = [{'name': r[0], 'field_type': r[1], 'required': r[2], 'options': r[3], 'default_value': r[4]}
+              for r in c.fetchall()]
+    return get_validator(table_id, fields)
+
+def field_default(c, field_id):
+    """Validated default of a field as written into records, None if it has none"""
+    c.execute('SELECT name, field_type, options, default_value FROM fields WHERE id = ?', (field_id,))
+    r = c.fetchone()
+    if not r or r[3] is None:
+        return None
+    field = {'name': r[0], 'field_type': r[1], 'options': r[2], 'default_value': r[3]}
+    return TableValidator([field]).validate({}, check_required=False).get(r[0])
+
+def start_field_migration(table_id, op, name, **kwargs):
+    """Rewrite the table's records for a field change in a background job (see field_migrations.py)"""
+    turn = field_migrations.take_turn(table_id)
+
+    def run(job):
+        progress = field_migrations.run_migration(connect_db,
+                                                  table_id, turn, op, name, job, **kwargs)
+        change_feed.publish('table', 'update', id=table_id)
+        return progress
+
+    return jobs.submit('field_migration', run, table_id=table_id, op=op, field=name,
+                       new_name=kwargs.get('new_name')).to_dict()
+
+def create_schema(conn):
+    """Create/upgrade all tables (see migrations.py for when this runs)"""
     c = conn.cursor()
     
     # Enable foreign keys
     c.execute("PRAGMA foreign_keys = ON")
+    # New databases release the space of deleted views incrementally (see view_retention.py)
+    view_retention.enable_incremental_vacuum(conn)
     
     # Tables table
     c.execute('''CREATE TABLE IF NOT EXISTS tables
@@ -27,8 +113,12 @@ def init_db():
                   description TEXT,
                   icon TEXT DEFAULT 'table',
                   color TEXT DEFAULT '#3b82f6',
+                  storage_mode TEXT DEFAULT 'json',
                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                   updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    ensure_column(c, 'tables', 'storage_mode', "TEXT DEFAULT 'json'")
+    # Set by DELETE; the rows are purged in the background (see cascade_delete.py)
+    ensure_column(c, 'tables', 'deleted_at', 'TIMESTAMP')
     
     # Fields table
     c.execute('''CREATE TABLE IF NOT EXISTS fields
@@ -59,8 +149,19 @@ def init_db():
                   description TEXT,
                   nodes TEXT,
                   edges TEXT,
+                  view_seq INTEGER,
+                  version INTEGER NOT NULL DEFAULT 1,
+                  retention_keep INTEGER,
+                  retention_days REAL,
+                  retention_bytes INTEGER,
                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                   updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    ensure_column(c, 'canvases', 'view_seq', 'INTEGER')
+    ensure_column(c, 'canvases', 'version', 'INTEGER NOT NULL DEFAULT 1')
+    ensure_column(c, 'canvases', 'retention_keep', 'INTEGER')
+    ensure_column(c, 'canvases', 'retention_days', 'REAL')
+    ensure_column(c, 'canvases', 'retention_bytes', 'INTEGER')
+    ensure_column(c, 'canvases', 'deleted_at', 'TIMESTAMP')
     
     # Views table
     c.execute('''CREATE TABLE IF NOT EXISTS views
@@ -68,12 +169,74 @@ def init_db():
                   name TEXT NOT NULL,
                   canvas_id INTEGER,
                   data TEXT,
+                  profile TEXT,
+                  size_bytes INTEGER,
                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                   FOREIGN KEY (canvas_id) REFERENCES canvases(id) ON DELETE CASCADE)''')
+    ensure_column(c, 'views', 'profile', 'TEXT')
+    ensure_column(c, 'views', 'size_bytes', 'INTEGER')
+    # Covers the retention scans (see view_retention.py) without reading view data
+    c.execute('CREATE INDEX IF NOT EXISTS ix_views_retention ON views (canvas_id, id, created_at, size_bytes)')
+    # Keyset scans of one table's records (exports, see record_export.py)
+    c.execute('CREATE INDEX IF NOT EXISTS ix_records_table ON records (table_id, id)')
     
-    conn.commit()
+    # Table statistics (see table_stats.py)
+    c.execute('''CREATE TABLE IF NOT EXISTS table_stats
+                 (table_id INTEGER PRIMARY KEY,
+                  row_count INTEGER,
+                  sampled_rows INTEGER,
+                  sample_fraction REAL,
+                  last_record_id INTEGER,
+                  summary TEXT,
+                  state TEXT,
+                  analyzed_at TEXT,
+                  FOREIGN KEY (table_id) REFERENCES tables(id) ON DELETE CASCADE)''')
+    
+    # Triggers: canvases run on record changes (see triggers.py)
+    c.execute('''CREATE TABLE IF NOT EXISTS triggers
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  canvas_id INTEGER NOT NULL,
+                  table_name TEXT NOT NULL,
+                  events TEXT NOT NULL,
+                  mode TEXT DEFAULT 'delta',
+                  window_ms INTEGER DEFAULT 500,
+                  max_batch INTEGER DEFAULT 1000,
+                  enabled BOOLEAN DEFAULT 1,
+                  last_run_at TEXT,
+                  last_status TEXT,
+                  last_error TEXT,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  FOREIGN KEY (canvas_id) REFERENCES canvases(id) ON DELETE CASCADE)''')
     
-    # Insert demo data if tables are empty
+    # Schedules: canvases run on a cron schedule (see scheduler.py)
+    c.execute('''CREATE TABLE IF NOT EXISTS schedules
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  canvas_id INTEGER NOT NULL,
+                  cron TEXT NOT NULL,
+                  overlap TEXT DEFAULT 'skip',
+                  jitter_seconds INTEGER DEFAULT 30,
+                  keep_views INTEGER DEFAULT 10,
+                  enabled BOOLEAN DEFAULT 1,
+                  next_run_at REAL,
+                  running_since REAL,
+                  last_run_at TEXT,
+                  last_status TEXT,
+                  last_error TEXT,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  FOREIGN KEY (canvas_id) REFERENCES canvases(id) ON DELETE CASCADE)''')
+    c.execute('CREATE INDEX IF NOT EXISTS ix_schedules_next_run_at ON schedules (next_run_at)')
+    
+    # Change feed shared by all server processes (see change_feed.py)
+    c.execute('''CREATE TABLE IF NOT EXISTS change_events
+                 (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                  event TEXT NOT NULL,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    
+    conn.commit()
+
+def seed_demo_data(conn):
+    """Demo tables, records and a canvas for an empty database"""
+    c = conn.cursor()
     c.execute('SELECT COUNT(*) FROM tables')
     if c.fetchone()[0] == 0:
         # Insert demo tables
@@ -171,14 +334,67 @@ def init_db():
         
         conn.commit()
         print("✅ Demo data initialized")
-    
-    conn.close()
+
+def init_db():
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        if not migrations.is_current(conn, 'advanced'):
+            create_schema(conn)
+            migrations.mark_current(conn, 'advanced')
+        if SEED_DEMO_DATA:
+            seed_demo_data(conn)
+    finally:
+        conn.close()
+
+def route_template(path):
+    """Collapse ids and table names so each endpoint is a single metrics label"""
+    parts = path.split('/')
+    for i, part in enumerate(parts):
+        if part.isdigit():
+            parts[i] = '{id}'
+        elif i > 0 and parts[i - 1] in ('t', 'webhook') and part:
+            parts[i] = '{table}'
+        elif i > 0 and parts[i - 1] == 'jobs' and part:
+            parts[i] = '{id}'
+    return '/'.join(parts)
 
 class APIHandler(BaseHTTPRequestHandler):
     def log_message(self, format, *args):
         # Custom logging
         print(f"[{datetime.now().strftime('%H:%M:%S')}] {format % args}")
     
+    def log_request(self, code='-', size='-'):
+        self._status = code
+        super().log_request(code, size)
+    
+    def parse_request(self):
+        parsed = super().parse_request()
+        if parsed:
+            # Statements in the slow query log point back at the request that issued them
+            self._query_scope = query_log.push(route=f"{self.command} {urlparse(self.path).path}")
+        return parsed
+    
+    def handle_one_request(self):
+        self._status = None
+        self._query_scope = None
+        started = time.perf_counter()
+        try:
+            super().handle_one_request()
+        finally:
+            if self._query_scope is not None:
+                query_log.pop(self._query_scope)
+        if self._status is not None:
+            metrics.observe_request(self.command, route_template(urlparse(self.path).path),
+                                    int(self._status), time.perf_counter() - started)
+    
+    def send_metrics(self):
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
     def do_OPTIONS(self):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
@@ -186,8 +402,88 @@ class APIHandler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
         self.end_headers()
 
+    def handle_export(self):
+        """GET /api/t/{table}/export and /api/view/{id}/export: written to the socket batch by batch"""
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+        parts = parsed.path.split('/')
+        conn = connect_db()
+        c = conn.cursor()
+        
+        try:
+            fmt = record_export.check_format(query.get('format', [None])[0])
+            batch_size = int(query.get('batch_size', [record_export.BATCH_SIZE])[0])
+            if parts[2] == 't':
+                name = unquote(parts[3])
+                c.execute('SELECT id FROM tables WHERE name = ? AND deleted_at IS NULL', (name,))
+                table = c.fetchone()
+                if not table:
+                    raise LookupError("Table not found")
+                c.execute('SELECT name, field_type FROM fields WHERE table_id = ? ORDER BY id', (table[0],))
+                fields = [{'name': r[0], 'field_type': r[1]} for r in c.fetchall()]
+                columns = record_export.parse_fields(query.get('fields', [None])[0], record_export.table_columns(fields))
+                chunks = record_export.export_table(conn, table[0], fields, fmt, columns, batch_size)
+            else:
+                view_id = int(parts[3])
+                c.execute('SELECT name FROM views WHERE id = ?', (view_id,))
+                view = c.fetchone()
+                if not view:
+                    raise LookupError("View not found")
+                name = view[0] or f"view_{view_id}"
+                columns = record_export.parse_fields(query.get('fields', [None])[0])
+                chunks = record_export.export_view(conn, view_id, fmt, columns, batch_size)
+        except (LookupError, ValueError) as e:
+            conn.close()
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(json.dumps({"error": str(e)}).encode())
+            return
+        
+        try:
+            self.send_response(200)
+            self.send_header('Content-type', record_export.MEDIA_TYPES[fmt])
+            self.send_header('Content-Disposition', record_export.content_disposition(name, fmt))
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            for chunk in chunks:
+                self.wfile.write(chunk)
+        except Exception as e:
+            # Headers are gone already, so the client sees a truncated body
+            print(f"Export Error: {e}")
+            traceback.print_exc()
+        finally:
+            conn.close()
+    
+    def handle_changes(self):
+        """GET /api/changes: Server-Sent Events until the client goes away (see change_feed.py)"""
+        query = parse_qs(urlparse(self.path).query)
+        resume = self.headers.get('Last-Event-ID') or query.get('last_event_id', [None])[0]
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        try:
+            for text in change_feed.stream(resume):
+                self.wfile.write(text.encode())
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+    
     def do_GET(self):
-        conn = sqlite3.connect(DB_FILE, timeout=10.0)
+        if self.path == '/metrics':
+            return self.send_metrics()
+        path = urlparse(self.path).path
+        parts = path.split('/')
+        if path == '/api/changes':
+            return self.handle_changes()
+        if len(parts) == 5 and parts[2] in ('t', 'view') and parts[4] == 'export':
+            return self.handle_export()
+        
+        conn = connect_db()
         conn.row_factory = sqlite3.Row
         c = conn.cursor()
         
@@ -197,11 +493,10 @@ class APIHandler(BaseHTTPRequestHandler):
             self.send_header('Access-Control-Allow-Origin', '*')
             self.end_headers()
             
-            parsed_path = urlparse(self.path)
-            path = parsed_path.path
+            query = parse_qs(urlparse(self.path).query)
             
             if path == '/api/tables':
-                c.execute('SELECT * FROM tables ORDER BY created_at DESC')
+                c.execute('SELECT * FROM tables WHERE deleted_at IS NULL ORDER BY created_at DESC')
                 tables = []
                 for table in c.fetchall():
                     c.execute('SELECT * FROM fields WHERE table_id = ? ORDER BY id', (table['id'],))
@@ -218,6 +513,7 @@ class APIHandler(BaseHTTPRequestHandler):
                         'description': table['description'],
                         'icon': table['icon'],
                         'color': table['color'],
+                        'storage_mode': table['storage_mode'],
                         'created_at': table['created_at'],
                         'updated_at': table['updated_at'],
                         'fields': fields,
@@ -225,12 +521,48 @@ class APIHandler(BaseHTTPRequestHandler):
                     })
                 response = tables
                 
-            elif path.startswith('/api/t/'):
-                table_name = unquote(path.split('/')[-1])
-                c.execute('SELECT id FROM tables WHERE name = ?', (table_name,))
+            elif len(parts) == 5 and parts[2] == 'tables' and parts[4] == 'stats':
+                # Row count and per-field statistics: /api/tables/{table}/stats?refresh=1
+                table_name = unquote(parts[3])
+                c.execute('SELECT id FROM tables WHERE name = ? AND deleted_at IS NULL', (table_name,))
+                table = c.fetchone()
+                if table:
+                    refresh = query.get('refresh', ['0'])[0].lower() in ('1', 'true')
+                    stats = None if refresh else table_stats.get_stats(conn, table['id'])
+                    if stats is None:
+                        table_stats.analyze(conn, table['id'])
+                        conn.commit()
+                        stats = table_stats.get_stats(conn, table['id'])
+                    response = {'table': table_name, **stats}
+                else:
+                    response = {"error": "Table not found"}
+                    
+            elif len(parts) == 5 and parts[2] == 't' and parts[4] == 'search':
+                # Prefix search for relation dropdowns: /api/t/{table}/search?q=Jo&field=name&limit=20
+                table_name = unquote(parts[3])
+                c.execute('SELECT id FROM tables WHERE name = ? AND deleted_at IS NULL', (table_name,))
+                table = c.fetchone()
+                if table:
+                    c.execute('SELECT name, field_type FROM fields WHERE table_id = ? ORDER BY id', (table['id'],))
+                    field = query.get('field', [None])[0] or relations.label_field(c.fetchall())
+                    limit = int(query.get('limit', [relations.SEARCH_LIMIT])[0])
+                    response = relations.search_records(conn, table['id'], field, query.get('q', [''])[0], limit) if field else []
+                else:
+                    response = []
+                    
+            elif len(parts) == 4 and parts[2] == 't':
+                table_name = unquote(parts[3])
+                limit = int(query['limit'][0]) if 'limit' in query else None
+                offset = int(query.get('offset', [0])[0])
+                c.execute('SELECT id FROM tables WHERE name = ? AND deleted_at IS NULL', (table_name,))
                 table = c.fetchone()
+                # Always records.data, also for typed tables: the mirror only keeps declared fields as coerced values
                 if table:
-                    c.execute('SELECT * FROM records WHERE table_id = ? ORDER BY created_at DESC', (table['id'],))
+                    if limit is not None:
+                        c.execute('SELECT * FROM records WHERE table_id = ? ORDER BY created_at DESC, id DESC '
+                                  'LIMIT ? OFFSET ?', (table['id'], limit, offset))
+                    else:
+                        c.execute('SELECT * FROM records WHERE table_id = ? ORDER BY created_at DESC', (table['id'],))
                     records = []
                     for record in c.fetchall():
                         records.append({
@@ -243,9 +575,15 @@ class APIHandler(BaseHTTPRequestHandler):
                     response = records
                 else:
                     response = []
+                
+                expand = relations.parse_expand(query.get('expand', [''])[0])
+                if table and expand:
+                    # One IN (...) lookup per relation for the whole page
+                    c.execute('SELECT name, field_type, options FROM fields WHERE table_id = ?', (table['id'],))
+                    response = relations.expand_relations(conn, c.fetchall(), response, expand)
                     
             elif path == '/api/canvases':
-                c.execute('SELECT * FROM canvases ORDER BY created_at DESC')
+                c.execute('SELECT * FROM canvases WHERE deleted_at IS NULL ORDER BY created_at DESC')
                 canvases = []
                 for canvas in c.fetchall():
                     canvases.append({
@@ -254,14 +592,18 @@ class APIHandler(BaseHTTPRequestHandler):
                         'description': canvas['description'],
                         'nodes': json.loads(canvas['nodes']) if canvas['nodes'] else [],
                         'edges': json.loads(canvas['edges']) if canvas['edges'] else [],
+                        'version': canvas['version'],
+                        'retention_keep': canvas['retention_keep'],
+                        'retention_days': canvas['retention_days'],
+                        'retention_bytes': canvas['retention_bytes'],
                         'created_at': canvas['created_at'],
                         'updated_at': canvas['updated_at']
                     })
                 response = canvases
                 
-            elif path.startswith('/api/canvases/') and path != '/api/canvases/execute':
-                canvas_id = int(path.split('/')[-1])
-                c.execute('SELECT * FROM canvases WHERE id = ?', (canvas_id,))
+            elif len(parts) == 4 and parts[2] == 'canvases' and parts[3].isdigit():
+                canvas_id = int(parts[3])
+                c.execute('SELECT * FROM canvases WHERE id = ? AND deleted_at IS NULL', (canvas_id,))
                 canvas = c.fetchone()
                 if canvas:
                     response = {
@@ -270,6 +612,10 @@ class APIHandler(BaseHTTPRequestHandler):
                         'description': canvas['description'],
                         'nodes': json.loads(canvas['nodes']) if canvas['nodes'] else [],
                         'edges': json.loads(canvas['edges']) if canvas['edges'] else [],
+                        'version': canvas['version'],
+                        'retention_keep': canvas['retention_keep'],
+                        'retention_days': canvas['retention_days'],
+                        'retention_bytes': canvas['retention_bytes'],
                         'created_at': canvas['created_at'],
                         'updated_at': canvas['updated_at']
                     }
@@ -285,17 +631,20 @@ class APIHandler(BaseHTTPRequestHandler):
                         'name': view['name'],
                         'canvas_id': view['canvas_id'],
                         'data': json.loads(view['data']) if view['data'] else [],
+                        'profile': json.loads(view['profile']) if view['profile'] else None,
+                        'size_bytes': view['size_bytes'],
                         'created_at': view['created_at']
                     })
                 response = views
                 
             elif path == '/api/stats':
                 # New endpoint for dashboard stats
-                c.execute('SELECT COUNT(*) as count FROM tables')
+                c.execute('SELECT COUNT(*) as count FROM tables WHERE deleted_at IS NULL')
                 table_count = c.fetchone()['count']
-                c.execute('SELECT COUNT(*) as count FROM records')
+                c.execute('SELECT COUNT(*) as count FROM records '
+                          'WHERE table_id IN (SELECT id FROM tables WHERE deleted_at IS NULL)')
                 record_count = c.fetchone()['count']
-                c.execute('SELECT COUNT(*) as count FROM canvases')
+                c.execute('SELECT COUNT(*) as count FROM canvases WHERE deleted_at IS NULL')
                 canvas_count = c.fetchone()['count']
                 c.execute('SELECT COUNT(*) as count FROM views')
                 view_count = c.fetchone()['count']
@@ -306,6 +655,28 @@ class APIHandler(BaseHTTPRequestHandler):
                     'canvases': canvas_count,
                     'views': view_count
                 }
+            
+            elif path == '/api/triggers':
+                c.execute('SELECT * FROM triggers ORDER BY id')
+                response = [{**dict(row), 'events': json.loads(row['events']), 'enabled': bool(row['enabled'])}
+                            for row in c.fetchall()]
+                
+            elif path == '/api/schedules':
+                c.execute('SELECT * FROM schedules ORDER BY id')
+                response = [{**dict(row), 'enabled': bool(row['enabled'])} for row in c.fetchall()]
+                
+            elif path == '/api/jobs':
+                limit = int(query.get('limit', ['20'])[0])
+                response = [job.to_dict() for job in jobs.recent(limit)]
+                
+            elif len(parts) == 4 and parts[2] == 'jobs':
+                job = jobs.get(parts[3])
+                response = job.to_dict() if job else {"error": "Job not found"}
+                
+            elif path == '/api/slow-queries':
+                # Recently logged slow/sampled statements (SLOW_QUERY_* settings in query_log.py)
+                limit = int(query.get('limit', ['50'])[0])
+                response = query_log.recent(limit)
             else:
                 response = {"error": "Not found"}
             
@@ -319,12 +690,81 @@ class APIHandler(BaseHTTPRequestHandler):
         finally:
             conn.close()
 
+    def handle_import(self):
+        """POST /api/t/{table}/import?format=csv|ndjson&mapping={...}: the request body is the file"""
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+        table_name = unquote(parsed.path.split('/')[3])
+        length = int(self.headers.get('Content-Length', 0))
+        # Spool the body to disk block by block, so memory stays bounded whatever the file size
+        stream = tempfile.TemporaryFile()
+        remaining = length
+        while remaining > 0:
+            block = self.rfile.read(min(remaining, IMPORT_BLOCK))
+            if not block:
+                break
+            stream.write(block)
+            remaining -= len(block)
+        stream.seek(0)
+        started = False
+        conn = connect_db()
+        c = conn.cursor()
+        
+        try:
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            
+            c.execute('SELECT id FROM tables WHERE name = ? AND deleted_at IS NULL', (table_name,))
+            table = c.fetchone()
+            if table:
+                table_id = table[0]
+                c.execute('SELECT name, display_name FROM fields WHERE table_id = ? ORDER BY id', (table_id,))
+                fields = [{'name': r[0], 'display_name': r[1]} for r in c.fetchall()]
+                fmt = record_import.detect_format(query.get('format', [None])[0], None, self.headers.get('Content-Type'))
+                mapping = record_import.parse_mapping(query.get('mapping', [None])[0], fields)
+                chunk_size = int(query.get('chunk_size', [record_import.CHUNK_SIZE])[0])
+                
+                def run(job):
+                    job_conn = connect_db()
+                    try:
+                        job_cursor = job_conn.cursor()
+                        return record_import.import_records(
+                            job_conn, table_id, fields, get_table_validator(job_cursor, table_id), stream, fmt, job,
+                            mapping=mapping, typed_fields=get_typed_fields(job_cursor, table_id), chunk_size=chunk_size,
+                            on_insert=lambda ids: (trigger_engine.publish(table_name, 'insert', ids),
+                                                   change_feed.records_changed(table_name, 'insert', ids)))
+                    finally:
+                        job_conn.close()
+                        stream.close()
+                
+                response = jobs.submit('import', run, table=table_name, format=fmt, total_bytes=length).to_dict()
+                started = True
+            else:
+                response = {"error": "Table not found"}
+            
+            self.wfile.write(json.dumps(response).encode())
+            
+        except Exception as e:
+            print(f"POST Error: {e}")
+            response = {"error": str(e)}
+            self.wfile.write(json.dumps(response).encode())
+        finally:
+            conn.close()
+            if not started:
+                stream.close()
+    
     def do_POST(self):
+        path = urlparse(self.path).path
+        parts = path.split('/')
+        if len(parts) == 5 and parts[2] == 't' and parts[4] == 'import':
+            return self.handle_import()
         content_length = int(self.headers.get('Content-Length', 0))
         body = self.rfile.read(content_length).decode('utf-8') if content_length > 0 else '{}'
         data = json.loads(body) if body else {}
         
-        conn = sqlite3.connect(DB_FILE, timeout=10.0)
+        conn = connect_db()
         conn.row_factory = sqlite3.Row
         c = conn.cursor()
         
@@ -334,13 +774,17 @@ class APIHandler(BaseHTTPRequestHandler):
             self.send_header('Access-Control-Allow-Origin', '*')
             self.end_headers()
             
-            if self.path == '/api/tables':
+            if path == '/api/tables':
                 # Create new table
-                c.execute("INSERT INTO tables (name, display_name, description, icon, color) VALUES (?, ?, ?, ?, ?)",
+                storage_mode = data.get('storage_mode', typed_storage.STORAGE_JSON)
+                if storage_mode not in typed_storage.STORAGE_MODES:
+                    raise ValueError(f"Unknown storage mode: {storage_mode}")
+                c.execute("INSERT INTO tables (name, display_name, description, icon, color, storage_mode) VALUES (?, ?, ?, ?, ?, ?)",
                           (data.get('name'), data.get('display_name'), 
                            data.get('description', ''), 
                            data.get('icon', 'table'),
-                           data.get('color', '#3b82f6')))
+                           data.get('color', '#3b82f6'),
+                           storage_mode))
                 table_id = c.lastrowid
                 
                 # Insert fields
@@ -361,7 +805,10 @@ class APIHandler(BaseHTTPRequestHandler):
                         'required': field.get('required', False)
                     })
                 
+                if storage_mode == typed_storage.STORAGE_TYPED:
+                    typed_storage.create_typed_table(conn, table_id, typed_storage.field_specs(created_fields))
                 conn.commit()
+                change_feed.publish('table', 'insert', table=data.get('name'), id=table_id)
                 
                 response = {
                     'id': table_id,
@@ -370,48 +817,88 @@ class APIHandler(BaseHTTPRequestHandler):
                     'description': data.get('description', ''),
                     'icon': data.get('icon', 'table'),
                     'color': data.get('color', '#3b82f6'),
+                    'storage_mode': storage_mode,
                     'fields': created_fields,
                     'created_at': datetime.now().isoformat()
                 }
                 
-            elif self.path.startswith('/api/t/') and '/records' not in self.path:
-                # Create new record
-                table_name = unquote(self.path.split('/')[-1])
-                c.execute('SELECT id FROM tables WHERE name = ?', (table_name,))
+            elif len(parts) == 5 and parts[2] == 't' and parts[4] == 'bulk':
+                # Bulk insert - valid rows go in one transaction, invalid ones are reported per row
+                table_name = unquote(parts[3])
+                c.execute('SELECT id FROM tables WHERE name = ? AND deleted_at IS NULL', (table_name,))
+                table = c.fetchone()
+                if table:
+                    valid, errors = get_table_validator(c, table[0]).validate_many(data.get('records', []))
+                    typed_fields = get_typed_fields(c, table[0])
+                    ids = []
+                    records = []
+                    for _, record_data in valid:
+                        c.execute("INSERT INTO records (table_id, data) VALUES (?, ?)",
+                                  (table[0], json.dumps(record_data)))
+                        ids.append(c.lastrowid)
+                        records.append({'id': c.lastrowid, 'table_id': table[0], 'data': record_data})
+                        if typed_fields is not None:
+                            typed_storage.upsert_row(conn, table[0], typed_fields, c.lastrowid, record_data)
+                    conn.commit()
+                    table_stats.record_writes(conn, table[0], inserted=len(ids))
+                    if ids:
+                        trigger_engine.publish(table_name, 'insert', ids)
+                        change_feed.records_changed(table_name, 'insert', ids, records)
+                    response = {'inserted': len(ids), 'ids': ids, 'errors': errors}
+                else:
+                    response = {"error": "Table not found"}
+                    
+            elif len(parts) == 4 and parts[2] == 't':
+                # Create new record; required fields are checked as in main.py, except for the grid's blank rows
+                table_name = unquote(parts[3])
+                c.execute('SELECT id FROM tables WHERE name = ? AND deleted_at IS NULL', (table_name,))
                 table = c.fetchone()
                 if table:
+                    record_data = get_table_validator(c, table[0]).validate(data.get('data', {}),
+                                                                            check_required=not data.get('blank'))
                     c.execute("INSERT INTO records (table_id, data) VALUES (?, ?)",
-                              (table[0], json.dumps(data.get('data', {}))))
+                              (table[0], json.dumps(record_data)))
                     record_id = c.lastrowid
+                    typed_fields = get_typed_fields(c, table[0])
+                    if typed_fields is not None:
+                        typed_storage.upsert_row(conn, table[0], typed_fields, record_id, record_data)
                     conn.commit()
+                    table_stats.record_writes(conn, table[0], inserted=1)
+                    trigger_engine.publish(table_name, 'insert', [record_id])
                     response = {
                         'id': record_id,
                         'table_id': table[0],
-                        'data': data.get('data', {}),
+                        'data': record_data,
                         'created_at': datetime.now().isoformat()
                     }
+                    change_feed.records_changed(table_name, 'insert', [record_id], [response])
                 else:
                     response = {"error": "Table not found"}
                     
-            elif self.path == '/api/canvases':
+            elif path == '/api/canvases':
                 # Create new canvas
                 c.execute("INSERT INTO canvases (name, description, nodes, edges) VALUES (?, ?, ?, ?)",
                           (data.get('name'), data.get('description', ''),
                            json.dumps(data.get('nodes', [])), json.dumps(data.get('edges', []))))
                 canvas_id = c.lastrowid
                 conn.commit()
+                change_feed.publish('canvas', 'insert', id=canvas_id)
                 response = {
                     'id': canvas_id,
                     'name': data.get('name'),
                     'description': data.get('description', ''),
                     'nodes': data.get('nodes', []),
                     'edges': data.get('edges', []),
+                    'version': 1,
                     'created_at': datetime.now().isoformat()
                 }
                 
-            elif self.path.startswith('/api/tables/') and '/fields' in self.path:
+            elif len(parts) == 5 and parts[2] == 'tables' and parts[4] == 'fields':
                 # Add field to table
-                table_id = int(self.path.split('/')[3])
+                table_id = int(parts[3])
+                c.execute('SELECT 1 FROM tables WHERE id = ? AND deleted_at IS NULL', (table_id,))
+                if not c.fetchone():
+                    raise LookupError("Table not found")
                 
                 # Prepare options - include relation_table if it's a relation field
                 options = data.get('options')
@@ -423,7 +910,15 @@ class APIHandler(BaseHTTPRequestHandler):
                            data.get('field_type', 'text'), data.get('required', False),
                            data.get('default_value'), json.dumps(options) if options else None))
                 field_id = c.lastrowid
+                default = field_default(c, field_id)
+                typed_fields = get_typed_fields(c, table_id)
+                added = typed_storage.sync_schema(conn, table_id, typed_fields) if typed_fields is not None else []
                 conn.commit()
+                change_feed.publish('table', 'update', id=table_id)
+                # Existing records get the default (and the new mirror column its values) in the background
+                migrations_started = []
+                if default is not None or added:
+                    migrations_started.append(start_field_migration(table_id, 'backfill', data.get('name'), default=default))
                 response = {
                     'id': field_id,
                     'table_id': table_id,
@@ -432,21 +927,37 @@ class APIHandler(BaseHTTPRequestHandler):
                     'field_type': data.get('field_type', 'text'),
                     'required': data.get('required', False),
                     'relation_table': data.get('relation_table'),
-                    'created_at': datetime.now().isoformat()
+                    'default_value': data.get('default_value'),
+                    'created_at': datetime.now().isoformat(),
+                    'jobs': migrations_started
                 }
                 
-            elif self.path.startswith('/api/webhook/'):
+            elif len(parts) == 4 and parts[2] == 'webhook':
                 # Webhook endpoint - принимает данные и добавляет в таблицу
-                table_name = unquote(self.path.split('/')[-1])
-                c.execute('SELECT id FROM tables WHERE name = ?', (table_name,))
+                table_name = unquote(parts[3])
+                c.execute('SELECT id FROM tables WHERE name = ? AND deleted_at IS NULL', (table_name,))
                 table = c.fetchone()
                 
                 if table:
-                    # Добавляем запись в таблицу
+                    # Проверяем данные по схеме таблицы и добавляем запись
+                    try:
+                        record_data = get_table_validator(c, table[0]).validate(data)
+                    except RecordValidationError:
+                        metrics.WEBHOOK_RECORDS.inc(table_name, 'invalid')
+                        raise
                     c.execute("INSERT INTO records (table_id, data) VALUES (?, ?)",
-                              (table[0], json.dumps(data)))
+                              (table[0], json.dumps(record_data)))
                     record_id = c.lastrowid
+                    typed_fields = get_typed_fields(c, table[0])
+                    if typed_fields is not None:
+                        typed_storage.upsert_row(conn, table[0], typed_fields, record_id, record_data)
                     conn.commit()
+                    metrics.WEBHOOK_RECORDS.inc(table_name, 'ok')
+                    table_stats.record_writes(conn, table[0], inserted=1)
+                    # Triggers on the table run the canvas over the new record (see WEBHOOKS.md)
+                    trigger_engine.publish(table_name, 'insert', [record_id])
+                    change_feed.records_changed(table_name, 'insert', [record_id],
+                                                [{'id': record_id, 'table_id': table[0], 'data': record_data}])
                     
                     response = {
                         'success': True,
@@ -456,26 +967,76 @@ class APIHandler(BaseHTTPRequestHandler):
                 else:
                     response = {"error": "Table not found"}
                 
-            elif self.path == '/api/canvases/execute':
+            elif path == '/api/triggers':
+                settings = triggers.validate(data)
+                c.execute('SELECT id FROM canvases WHERE id = ? AND deleted_at IS NULL', (settings['canvas_id'],))
+                canvas = c.fetchone()
+                c.execute('SELECT id FROM tables WHERE name = ? AND deleted_at IS NULL', (settings['table_name'],))
+                table = c.fetchone()
+                if not canvas:
+                    response = {"error": "Canvas not found"}
+                elif not table:
+                    response = {"error": "Table not found"}
+                else:
+                    c.execute("INSERT INTO triggers (canvas_id, table_name, events, mode, window_ms, max_batch, enabled) "
+                              "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (settings['canvas_id'], settings['table_name'], json.dumps(settings['events']),
+                               settings['mode'], settings['window_ms'], settings['max_batch'], settings['enabled']))
+                    conn.commit()
+                    trigger_engine.invalidate()
+                    response = {'id': c.lastrowid, **settings, 'created_at': datetime.now().isoformat()}
+                
+            elif path == '/api/schedules':
+                settings = scheduler.validate(data)
+                c.execute('SELECT id FROM canvases WHERE id = ? AND deleted_at IS NULL', (settings['canvas_id'],))
+                if not c.fetchone():
+                    response = {"error": "Canvas not found"}
+                else:
+                    c.execute("INSERT INTO schedules (canvas_id, cron, overlap, jitter_seconds, keep_views, enabled) "
+                              "VALUES (?, ?, ?, ?, ?, ?)",
+                              (settings['canvas_id'], settings['cron'], settings['overlap'],
+                               settings['jitter_seconds'], settings['keep_views'], settings['enabled']))
+                    schedule_id = c.lastrowid
+                    scheduler.arm(conn, schedule_id)
+                    conn.commit()
+                    c.execute('SELECT * FROM schedules WHERE id = ?', (schedule_id,))
+                    response = {**dict(c.fetchone()), 'enabled': settings['enabled']}
+                
+            elif path == '/api/views/compact':
+                # Apply view retention now; full_vacuum=1 also converts an old database to incremental vacuum
+                query = parse_qs(urlparse(self.path).query)
+                full_vacuum = query.get('full_vacuum', ['0'])[0].lower() in ('1', 'true', 'yes')
+                response = view_retention.compact(conn, full_vacuum=full_vacuum)
+                
+            elif path == '/api/canvases/execute':
+                # Run the canvas like main.py does and save the result as a view; ?profile=1 adds per-node timings
+                from canvas_executor import CanvasExecutor  # not needed until the first run
                 canvas_id = data.get('canvas_id')
-                # Simple execution - just save as view
-                result_data = [
-                    {"id": 1, "variant_id": 1, "stock": 50, "available": 45},
-                    {"id": 2, "variant_id": 2, "stock": 30, "available": 30}
-                ]
-                c.execute("INSERT INTO views (name, canvas_id, data) VALUES (?, ?, ?)",
-                          (f"Execution_{datetime.now().strftime('%Y%m%d_%H%M%S')}", 
-                           canvas_id,
-                           json.dumps(result_data)))
-                view_id = c.lastrowid
-                conn.commit()
-                response = {
-                    'id': view_id,
-                    'name': f"View_{canvas_id}",
-                    'canvas_id': canvas_id,
-                    'data': result_data,
-                    'created_at': datetime.now().isoformat()
-                }
+                canvas = load_canvas(conn, canvas_id)
+                if canvas is None:
+                    response = {"error": "Canvas not found"}
+                else:
+                    query = parse_qs(urlparse(self.path).query)
+                    profile = query.get('profile', ['0'])[0].lower() in ('1', 'true', 'yes')
+                    profiler = Profiler(enabled=profile)
+                    with query_log.scope(canvas=canvas_id):
+                        result_data = CanvasExecutor(conn, profiler).execute(*canvas)
+                    profile_data = profiler.to_dict() if profile else None
+                    view_id = save_view(conn, canvas_id, data.get('view_name'), result_data)
+                    if profile_data is not None:
+                        c.execute('UPDATE views SET profile = ? WHERE id = ?', (json.dumps(profile_data), view_id))
+                    conn.commit()
+                    c.execute('SELECT name, created_at FROM views WHERE id = ?', (view_id,))
+                    view = c.fetchone()
+                    change_feed.publish('view', 'insert', id=view_id, name=view['name'], canvas_id=canvas_id)
+                    response = {
+                        'id': view_id,
+                        'name': view['name'],
+                        'canvas_id': canvas_id,
+                        'data': result_data,
+                        'profile': profile_data,
+                        'created_at': view['created_at']
+                    }
             else:
                 response = {"error": "Not found"}
             
@@ -485,6 +1046,12 @@ class APIHandler(BaseHTTPRequestHandler):
             print(f"Integrity Error: {e}")
             response = {"error": "A table with this name already exists"}
             self.wfile.write(json.dumps(response).encode())
+        except RecordValidationError as e:
+            response = {"error": str(e), "errors": e.errors}
+            self.wfile.write(json.dumps(response).encode())
+        except (triggers.TriggerError, scheduler.ScheduleError, LookupError) as e:
+            response = {"error": str(e)}
+            self.wfile.write(json.dumps(response).encode())
         except Exception as e:
             print(f"POST Error: {e}")
             traceback.print_exc()
@@ -494,7 +1061,8 @@ class APIHandler(BaseHTTPRequestHandler):
             conn.close()
     
     def do_DELETE(self):
-        conn = sqlite3.connect(DB_FILE, timeout=10.0)
+        parts = urlparse(self.path).path.split('/')
+        conn = connect_db()
         c = conn.cursor()
         
         try:
@@ -503,36 +1071,84 @@ class APIHandler(BaseHTTPRequestHandler):
             self.send_header('Access-Control-Allow-Origin', '*')
             self.end_headers()
             
-            if self.path.startswith('/api/tables/'):
-                table_id = int(self.path.split('/')[-1])
-                c.execute("DELETE FROM tables WHERE id = ?", (table_id,))
+            if len(parts) == 4 and parts[2] == 'tables':
+                table_id = int(parts[3])
+                # Marked deleted now; records, mirror and fields are purged in batches by a job
+                table_name = cascade_delete.mark_table_deleted(conn, table_id)
                 conn.commit()
-                response = {"success": True, "message": "Table deleted"}
+                if table_name is None:
+                    response = {"error": "Table not found"}
+                else:
+                    trigger_engine.invalidate()
+                    change_feed.publish('table', 'delete', id=table_id, table=table_name)
+                    job = cascade_delete.start_purge(connect_db, 'table', table_id)
+                    response = {"success": True, "message": "Table deleted", "job": job.to_dict()}
                 
-            elif '/records/' in self.path:
-                parts = self.path.split('/')
+            elif len(parts) == 6 and parts[2] == 't' and parts[4] == 'records':
                 table_name = unquote(parts[3])
                 record_id = int(parts[5])
-                c.execute('SELECT id FROM tables WHERE name = ?', (table_name,))
+                c.execute('SELECT id FROM tables WHERE name = ? AND deleted_at IS NULL', (table_name,))
                 table = c.fetchone()
                 if table:
                     c.execute("DELETE FROM records WHERE id = ? AND table_id = ?", (record_id, table[0]))
+                    if get_typed_fields(c, table[0]) is not None:
+                        typed_storage.delete_row(conn, table[0], record_id)
                     conn.commit()
+                    table_stats.record_writes(conn, table[0], changed=1)
+                    trigger_engine.publish(table_name, 'delete', [record_id])
+                    change_feed.records_changed(table_name, 'delete', [record_id])
                     response = {"success": True, "message": "Record deleted"}
                 else:
                     response = {"error": "Table not found"}
                     
-            elif self.path.startswith('/api/fields/'):
-                field_id = int(self.path.split('/')[-1])
+            elif len(parts) == 4 and parts[2] == 'fields':
+                field_id = int(parts[3])
+                c.execute('SELECT table_id, name FROM fields WHERE id = ?', (field_id,))
+                field = c.fetchone()
                 c.execute("DELETE FROM fields WHERE id = ?", (field_id,))
+                typed_fields = get_typed_fields(c, field[0]) if field else None
+                if typed_fields is not None:
+                    typed_storage.sync_schema(conn, field[0], typed_fields)
                 conn.commit()
-                response = {"success": True, "message": "Field deleted"}
+                migrations_started = []
+                if field:
+                    change_feed.publish('table', 'update', id=field[0])
+                    # The key is removed from existing records in the background
+                    c.execute('SELECT 1 FROM fields WHERE table_id = ? AND name = ?', field)
+                    if not c.fetchone():
+                        migrations_started.append(start_field_migration(field[0], 'drop', field[1]))
+                response = {"success": True, "message": "Field deleted", "jobs": migrations_started}
                 
-            elif self.path.startswith('/api/canvases/'):
-                canvas_id = int(self.path.split('/')[-1])
-                c.execute("DELETE FROM canvases WHERE id = ?", (canvas_id,))
+            elif len(parts) == 4 and parts[2] == 'triggers':
+                trigger_id = int(parts[3])
+                c.execute("DELETE FROM triggers WHERE id = ?", (trigger_id,))
                 conn.commit()
-                response = {"success": True, "message": "Canvas deleted"}
+                trigger_engine.invalidate()
+                response = {"success": True, "message": "Trigger deleted"}
+                
+            elif len(parts) == 4 and parts[2] == 'schedules':
+                schedule_id = int(parts[3])
+                c.execute("DELETE FROM schedules WHERE id = ?", (schedule_id,))
+                conn.commit()
+                response = {"success": True, "message": "Schedule deleted"}
+                
+            elif len(parts) == 4 and parts[2] == 'jobs':
+                job = jobs.get(parts[3])
+                if job:
+                    job.cancel()
+                response = job.to_dict() if job else {"error": "Job not found"}
+                
+            elif len(parts) == 4 and parts[2] == 'canvases':
+                canvas_id = int(parts[3])
+                # Marked deleted now; its views are purged in batches by a job
+                if not cascade_delete.mark_canvas_deleted(conn, canvas_id):
+                    response = {"error": "Canvas not found"}
+                else:
+                    conn.commit()
+                    trigger_engine.invalidate()
+                    change_feed.publish('canvas', 'delete', id=canvas_id)
+                    job = cascade_delete.start_purge(connect_db, 'canvas', canvas_id)
+                    response = {"success": True, "message": "Canvas deleted", "job": job.to_dict()}
                 
             else:
                 response = {"error": "Not found"}
@@ -551,7 +1167,8 @@ class APIHandler(BaseHTTPRequestHandler):
         body = self.rfile.read(content_length).decode('utf-8') if content_length > 0 else '{}'
         data = json.loads(body) if body else {}
         
-        conn = sqlite3.connect(DB_FILE, timeout=10.0)
+        parts = urlparse(self.path).path.split('/')
+        conn = connect_db()
         c = conn.cursor()
         
         try:
@@ -560,30 +1177,116 @@ class APIHandler(BaseHTTPRequestHandler):
             self.send_header('Access-Control-Allow-Origin', '*')
             self.end_headers()
             
-            if self.path.startswith('/api/canvases/') and self.path.endswith('/save'):
-                canvas_id = int(self.path.split('/')[-2])
-                c.execute("UPDATE canvases SET nodes = ?, edges = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            if len(parts) == 5 and parts[2] == 'canvases' and parts[4] == 'save':
+                canvas_id = int(parts[3])
+                c.execute("UPDATE canvases SET nodes = ?, edges = ?, version = version + 1, "
+                          "updated_at = CURRENT_TIMESTAMP WHERE id = ?",
                           (json.dumps(data.get('nodes', [])), json.dumps(data.get('edges', [])), canvas_id))
                 conn.commit()
+                change_feed.publish('canvas', 'update', id=canvas_id)
                 response = {"success": True, "message": "Canvas saved"}
                 
-            elif self.path.startswith('/api/fields/'):
-                field_id = int(self.path.split('/')[-1])
-                c.execute("UPDATE fields SET display_name = ? WHERE id = ?",
-                          (data.get('display_name'), field_id))
+            elif len(parts) == 5 and parts[2] == 'canvases' and parts[4] == 'ops':
+                # Incremental save: node/edge operations on top of the client's version (see canvas_ops.py)
+                canvas_id = int(parts[3])
+                try:
+                    version = canvas_ops.save_ops(conn, canvas_id, data.get('version'), data.get('ops') or [])
+                except canvas_ops.VersionConflict as e:
+                    response = {"error": str(e), "version": e.version}
+                else:
+                    if version is None:
+                        response = {"error": "Canvas not found"}
+                    else:
+                        conn.commit()
+                        change_feed.publish('canvas', 'update', id=canvas_id, version=version)
+                        response = {"id": canvas_id, "version": version}
+                
+            elif len(parts) == 5 and parts[2] == 'canvases' and parts[4] == 'retention':
+                # null = server default, 0 = unlimited (see view_retention.py)
+                canvas_id = int(parts[3])
+                c.execute("UPDATE canvases SET retention_keep = ?, retention_days = ?, retention_bytes = ?, "
+                          "updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                          (data.get('retention_keep'), data.get('retention_days'), data.get('retention_bytes'),
+                           canvas_id))
+                conn.commit()
+                change_feed.publish('canvas', 'update', id=canvas_id)
+                response = {"success": True, "message": "Retention updated"}
+                
+            elif len(parts) == 5 and parts[2] == 'tables' and parts[4] == 'storage':
+                # Switch storage mode; typed mode materializes the mirror from existing records
+                table_id = int(parts[3])
+                storage_mode = data.get('storage_mode')
+                if storage_mode not in typed_storage.STORAGE_MODES:
+                    raise ValueError(f"Unknown storage mode: {storage_mode}")
+                c.execute("UPDATE tables SET storage_mode = ?, updated_at = CURRENT_TIMESTAMP "
+                          "WHERE id = ? AND deleted_at IS NULL", (storage_mode, table_id))
+                if not c.rowcount:
+                    raise LookupError("Table not found")
+                typed_fields = get_typed_fields(c, table_id)
+                if typed_fields is not None:
+                    typed_storage.create_typed_table(conn, table_id, typed_fields)
+                else:
+                    typed_storage.drop_typed_table(conn, table_id)
                 conn.commit()
-                response = {"success": True, "message": "Field updated"}
+                change_feed.publish('table', 'update', id=table_id)
+                response = {"success": True, "storage_mode": storage_mode}
                 
-            elif '/records/' in self.path:
-                parts = self.path.split('/')
+            elif len(parts) == 4 and parts[2] == 'fields':
+                field_id = int(parts[3])
+                c.execute('SELECT table_id, name, default_value FROM fields WHERE id = ?', (field_id,))
+                field = c.fetchone()
+                if not field:
+                    raise ValueError("Field not found")
+                table_id, name, old_default = field
+                # Only the sent keys change; a rename or a new default rewrites the records in the background
+                new_name = name
+                if 'name' in data and data['name'] != name:
+                    c.execute('SELECT name FROM fields WHERE table_id = ? AND id != ?', (table_id, field_id))
+                    new_name = field_migrations.check_name(data['name'], {r[0] for r in c.fetchall()})
+                    c.execute("UPDATE fields SET name = ? WHERE id = ?", (new_name, field_id))
+                    if get_typed_fields(c, table_id) is not None:
+                        typed_storage.rename_column(conn, table_id, name, new_name)
+                if 'display_name' in data:
+                    c.execute("UPDATE fields SET display_name = ? WHERE id = ?", (data['display_name'], field_id))
+                if 'default_value' in data:
+                    c.execute("UPDATE fields SET default_value = ? WHERE id = ?", (data['default_value'], field_id))
+                default = field_default(c, field_id)
+                conn.commit()
+                change_feed.publish('table', 'update', id=table_id)
+                migrations_started = []
+                if new_name != name:
+                    migrations_started.append(start_field_migration(table_id, 'rename', name, new_name=new_name))
+                if 'default_value' in data and default is not None and data['default_value'] != old_default:
+                    migrations_started.append(start_field_migration(table_id, 'backfill', new_name, default=default))
+                response = {"success": True, "message": "Field updated", "name": new_name, "jobs": migrations_started}
+                
+            elif len(parts) == 6 and parts[2] == 't' and parts[4] == 'records':
                 table_name = unquote(parts[3])
                 record_id = int(parts[5])
-                c.execute('SELECT id FROM tables WHERE name = ?', (table_name,))
+                c.execute('SELECT id FROM tables WHERE name = ? AND deleted_at IS NULL', (table_name,))
                 table = c.fetchone()
                 if table:
-                    c.execute("UPDATE records SET data = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ? AND table_id = ?",
-                              (json.dumps(data.get('data', {})), record_id, table[0]))
+                    typed_fields = get_typed_fields(c, table[0])
+                    if record_patch.is_merge_patch(self.headers.get('Content-Type')):
+                        # Only the sent fields change, in one UPDATE (see record_patch.py)
+                        patch = get_table_validator(c, table[0]).validate(data.get('data', {}), partial=True)
+                        updated = record_patch.merge_record(c, table[0], record_id, patch, typed_fields)
+                        c.execute('SELECT data FROM records WHERE id = ?', (record_id,))
+                        row = c.fetchone()
+                        record_data = json.loads(row[0]) if row else {}
+                    else:
+                        record_data = get_table_validator(c, table[0]).validate(data.get('data', {}))
+                        c.execute("UPDATE records SET data = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ? AND table_id = ?",
+                                  (json.dumps(record_data), record_id, table[0]))
+                        updated = c.rowcount
+                        if typed_fields is not None and updated:
+                            typed_storage.upsert_row(conn, table[0], typed_fields, record_id, record_data)
                     conn.commit()
+                    table_stats.record_writes(conn, table[0], changed=updated)
+                    if updated:
+                        trigger_engine.publish(table_name, 'update', [record_id])
+                        change_feed.records_changed(table_name, 'update', [record_id],
+                                                    [{'id': record_id, 'table_id': table[0], 'data': record_data}])
                     response = {"success": True, "message": "Record updated"}
                 else:
                     response = {"error": "Table not found"}
@@ -593,6 +1296,9 @@ class APIHandler(BaseHTTPRequestHandler):
             
             self.wfile.write(json.dumps(response).encode())
             
+        except RecordValidationError as e:
+            response = {"error": str(e), "errors": e.errors}
+            self.wfile.write(json.dumps(response).encode())
         except Exception as e:
             print(f"PATCH Error: {e}")
             response = {"error": str(e)}
@@ -602,12 +1308,18 @@ class APIHandler(BaseHTTPRequestHandler):
 
 if __name__ == "__main__":
     init_db()
-    PORT = 8000
+    PORT = int(os.environ.get('PORT', 8000))
     
     # Allow socket reuse
     socketserver.TCPServer.allow_reuse_address = True
+    # A thread per connection: change feed clients keep theirs open
+    socketserver.ThreadingTCPServer.daemon_threads = True
     
-    with socketserver.TCPServer(("", PORT), APIHandler) as httpd:
+    change_feed.share(connect_db)
+    canvas_scheduler.start()
+    view_compactor.start()
+    cascade_delete.resume(connect_db)
+    with socketserver.ThreadingTCPServer(("", PORT), APIHandler) as httpd:
         print(f"🚀 Advanced API Server with SQLite DB")
         print(f"✅ Running at http://localhost:{PORT}")
         print(f"📁 Database: {os.path.abspath(DB_FILE)}")
@@ -0,0 +1,122 @@
+"""Group-by aggregation for aggregateNode.
+
+Node data looks like:
+    {"groupBy": ["warehouse"],
+     "aggregates": [{"op": "sum", "field": "stock", "as": "total_stock"}, {"op": "count"}]}
+
+HashAggregator consumes rows one at a time and keeps a single accumulator per
+group, so memory grows with the number of groups rather than the input size.
+"""
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+from typed_storage import coerce_value, read_value
+
+AGGREGATE_OPS = ('count', 'sum', 'min', 'max', 'avg')
+
+
+class Aggregate(NamedTuple):
+    op: str
+    field: Optional[str]
+    alias: str
+
+
+class AggregateSpec(NamedTuple):
+    group_by: List[str]
+    aggregates: List[Aggregate]
+
+    def make_row(self, values: Iterable[Any]) -> Dict[str, Any]:
+        """Output row from group key values followed by aggregate values"""
+        values = list(values)
+        row = dict(zip(self.group_by, values))
+        for agg, value in zip(self.aggregates, values[len(self.group_by):]):
+            # Integral sums/averages come back from SQL as floats; report them like the input
+            row[agg.alias] = value if agg.op == 'count' else read_value('number', value)
+        return row
+
+
+def parse_aggregate_spec(data: Dict[str, Any]) -> Optional[AggregateSpec]:
+    """Read aggregateNode data, or None if the node is not configured"""
+    group_by = data.get('groupBy') or []
+    if isinstance(group_by, str):
+        group_by = [name.strip() for name in group_by.split(',') if name.strip()]
+
+    aggregates = []
+    for item in data.get('aggregates') or []:
+        op = (item.get('op') or '').lower()
+        field = item.get('field') or None
+        if op not in AGGREGATE_OPS or (op != 'count' and not field):
+            continue
+        alias = item.get('as') or (f"{op}_{field}" if field else op)
+        aggregates.append(Aggregate(op, field, alias))
+
+    if not group_by and not aggregates:
+        return None
+    return AggregateSpec(list(group_by), aggregates)
+
+
+def _sort_key(value: Any):
+    # Keep min/max total over mixed JSON values: numbers before strings
+    return (0, value) if isinstance(value, (int, float)) and not isinstance(value, bool) else (1, str(value))
+
+
+class HashAggregator:
+    """Streaming hash aggregation over dict rows"""
+
+    def __init__(self, spec: AggregateSpec):
+        self.spec = spec
+        self.groups: Dict[tuple, List[Any]] = {}
+
+    def _new_state(self) -> List[Any]:
+        # count -> int, sum -> number|None, min/max -> value|None, avg -> [sum, count]
+        return [0 if a.op == 'count' else [0, 0] if a.op == 'avg' else None for a in self.spec.aggregates]
+
+    def add(self, row: Dict[str, Any]):
+        key = tuple(row.get(name) for name in self.spec.group_by)
+        state = self.groups.get(key)
+        if state is None:
+            state = self.groups[key] = self._new_state()
+
+        for i, agg in enumerate(self.spec.aggregates):
+            if agg.op == 'count':
+                if agg.field is None or row.get(agg.field) is not None:
+                    state[i] += 1
+                continue
+            value = row.get(agg.field)
+            if value is None:
+                continue
+            if agg.op in ('sum', 'avg'):
+                number = coerce_value('number', value)
+                if number is None:
+                    continue
+                if agg.op == 'sum':
+                    state[i] = number if state[i] is None else state[i] + number
+                else:
+                    state[i][0] += number
+                    state[i][1] += 1
+            elif agg.op == 'min':
+                if state[i] is None or _sort_key(value) < _sort_key(state[i]):
+                    state[i] = value
+            elif agg.op == 'max':
+                if state[i] is None or _sort_key(value) > _sort_key(state[i]):
+                    state[i] = value
+
+    def consume(self, rows: Iterable[Dict[str, Any]]) -> 'HashAggregator':
+        for row in rows:
+            self.add(row)
+        return self
+
+    def results(self) -> List[Dict[str, Any]]:
+        # Like SQL, aggregating nothing without group keys still yields one row
+        if not self.groups and not self.spec.group_by:
+            self.groups[()] = self._new_state()
+
+        results = []
+        for key, state in self.groups.items():
+            values = [(value[0] / value[1] if value[1] else None) if agg.op == 'avg' else value
+                      for agg, value in zip(self.spec.aggregates, state)]
+            results.append(self.spec.make_row(list(key) + values))
+        return results
+
+
+def aggregate_rows(spec: AggregateSpec, rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return HashAggregator(spec).consume(rows).results()
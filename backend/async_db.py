@@ -0,0 +1,111 @@
+"""Optional async database mode for main.py (DB_MODE=async).
+
+The async engine uses aiosqlite for SQLite and asyncpg for Postgres, so
+DATABASE_URL stays the same in both modes. Route handlers are still written
+once, as sync functions taking `db: Session = Depends(get_db)`: with
+DatabaseRoute as the app's route class, each of them is exposed as an
+`async def` endpoint that runs the very same handler through
+AsyncSession.run_sync. SQL then runs on the event loop instead of occupying
+a threadpool slot, and since the handler code, queries and response models
+are shared, responses are identical in both modes (for A/B runs).
+
+The response model is validated inside run_sync too, because lazy ORM
+attributes (e.g. Table.fields) can only load while the session's greenlet
+is active. Background work (triggers, schedules, view compaction) keeps
+using the sync engine.
+"""
+import functools
+import inspect
+import os
+import threading
+from typing import Any, Callable, Optional
+
+from fastapi import Depends
+from fastapi.routing import APIRoute
+from fastapi.utils import create_response_field
+from pydantic import ValidationError
+from starlette.responses import Response
+
+from database import DATABASE_URL, get_db
+
+DB_MODE = os.getenv("DB_MODE", "sync").lower()
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg', 'postgres': 'postgresql+asyncpg'}
+
+_lock = threading.Lock()
+_engine = None
+_sessionmaker = None
+
+
+def enabled() -> bool:
+    return DB_MODE == 'async'
+
+
+def async_url(url: str) -> str:
+    """DATABASE_URL with the matching async driver, e.g. sqlite:///x.db -> sqlite+aiosqlite:///x.db"""
+    scheme, sep, rest = url.partition('://')
+    if '+' in scheme:
+        return url
+    return ASYNC_DRIVERS.get(scheme, scheme) + sep + rest
+
+
+def engine():
+    """The async engine, created on first use"""
+    global _engine, _sessionmaker
+    with _lock:
+        if _engine is None:
+            from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+            from sqlalchemy.orm import sessionmaker
+
+            _engine = create_async_engine(async_url(DATABASE_URL))
+            # async_io tells CanvasExecutor to deliver webhooks on the event loop too
+            _sessionmaker = sessionmaker(_engine, class_=AsyncSession, autoflush=False,
+                                         info={'async_io': True})
+    return _engine
+
+
+async def get_async_db():
+    engine()
+    async with _sessionmaker() as db:
+        yield db
+
+
+def _db_parameter(endpoint: Callable) -> Optional[str]:
+    for name, param in inspect.signature(endpoint).parameters.items():
+        if getattr(param.default, 'dependency', None) is get_db:
+            return name
+    return None
+
+
+def async_endpoint(endpoint: Callable, response_model: Any = None) -> Callable:
+    """`async def` version of a sync handler that takes a get_db session"""
+    db_name = _db_parameter(endpoint)
+    if db_name is None:
+        return endpoint
+    field = create_response_field(name=f"response_{endpoint.__name__}", type_=response_model) \
+        if response_model is not None else None
+
+    def call(session, kwargs):
+        result = endpoint(**{**kwargs, db_name: session})
+        if field is None or isinstance(result, Response):
+            return result
+        value, errors = field.validate(result, {}, loc=('response',))
+        if errors:
+            raise ValidationError(errors if isinstance(errors, list) else [errors], field.type_)
+        return value
+
+    @functools.wraps(endpoint)
+    async def wrapper(**kwargs):
+        return await kwargs[db_name].run_sync(call, kwargs)
+
+    signature = inspect.signature(endpoint)
+    wrapper.__signature__ = signature.replace(parameters=[
+        param.replace(default=Depends(get_async_db)) if name == db_name else param
+        for name, param in signature.parameters.items()])
+    return wrapper
+
+
+class DatabaseRoute(APIRoute):
+    """Route class for DB_MODE=async: handlers using get_db become async endpoints"""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, async_endpoint(endpoint, kwargs.get('response_model')), **kwargs)
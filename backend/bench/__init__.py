@@ -0,0 +1,10 @@
+"""Benchmarks for CanvasExecutor and the record API.
+
+Run from the backend directory:
+
+    python -m bench --records 100000 --targets executor,main,advanced --out bench.json
+
+datagen builds a synthetic database shaped like the demo data, workloads
+defines the canonical canvases and API workloads, and harness runs them and
+reports throughput, p50/p99 latency and peak RSS as JSON.
+"""
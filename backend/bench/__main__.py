@@ -0,0 +1,78 @@
+"""Command line entry point: python -m bench --records 100000 --out bench.json"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+from bench import datagen, harness
+
+TARGETS = ('executor', 'main', 'advanced', 'startup')
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m bench', description=__doc__)
+    parser.add_argument('--records', type=int, default=10000, help='approximate number of records to generate')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db', help='database file to generate (default: a temporary file)')
+    parser.add_argument('--keep-db', action='store_true', help='do not delete the generated database')
+    parser.add_argument('--targets', default=','.join(TARGETS), help='comma separated: ' + ', '.join(TARGETS))
+    parser.add_argument('--workloads', help='comma separated API workloads to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='executions per canvas for the executor target, restarts per server for startup')
+    parser.add_argument('--out', help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    targets = [t.strip() for t in args.targets.split(',') if t.strip()]
+    unknown = set(targets) - set(TARGETS)
+    if unknown:
+        parser.error(f"unknown targets: {', '.join(sorted(unknown))}")
+    workloads = [w.strip() for w in args.workloads.split(',')] if args.workloads else None
+
+    db_file = args.db or os.path.join(tempfile.mkdtemp(prefix='psih-bench-'), 'bench.db')
+    if os.path.exists(db_file):
+        parser.error(f"{db_file} already exists")
+
+    started_at = datetime.now(timezone.utc).isoformat()
+    try:
+        dataset = datagen.generate(db_file, args.records, args.seed)
+        print(f"Generated {dataset['records']} records in {dataset['seconds']}s", file=sys.stderr)
+
+        results = []
+        for target in targets:
+            print(f"Running {target}...", file=sys.stderr)
+            if target == 'executor':
+                results.extend(harness.run_executor(db_file, args.repeat))
+            elif target == 'startup':
+                results.extend(harness.run_startup(db_file, args.repeat))
+            else:
+                with harness.Server(target, db_file) as server:
+                    results.extend(harness.run_api(server, dataset, workloads))
+    finally:
+        if not args.keep_db and os.path.exists(db_file):
+            os.remove(db_file)
+
+    report = {
+        'meta': {
+            'started_at': started_at,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'records': args.records,
+            'seed': args.seed,
+        },
+        'dataset': dataset,
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
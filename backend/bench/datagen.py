@@ -0,0 +1,142 @@
+"""Synthetic datasets for benchmarks.
+
+The generated database uses the same schema as the servers (created by
+advanced_server.create_schema, without the demo data init_db may seed) plus
+bench_* tables shaped like demo_data.py: products -> variants -> inventory,
+and customers. Rows are generated lazily and written with executemany in
+batches, so 10M records do not need to fit in memory.
+"""
+import json
+import random
+import sqlite3
+import time
+from itertools import islice
+from typing import Any, Dict, Iterator, List
+
+import advanced_server
+import migrations
+from bench.workloads import canvases
+
+BATCH_SIZE = 10000
+
+# Share of the requested record count that goes to each table
+SHARES = {'bench_products': 0.02, 'bench_variants': 0.18, 'bench_inventory': 0.70, 'bench_customers': 0.10}
+
+COLORS = ['Red', 'Blue', 'Black', 'White', 'Green', 'Grey']
+SIZES = ['XS', 'S', 'M', 'L', 'XL', '32', '34', '42']
+STATUSES = ['pending', 'in_progress', 'completed']
+
+TABLES = {
+    'bench_products': [('name', 'text', 1), ('base_sku', 'text', 1)],
+    'bench_variants': [('product_id', 'number', 1), ('color', 'text', 1), ('size', 'text', 1),
+                       ('sku', 'text', 1), ('price_rub', 'number', 1)],
+    'bench_inventory': [('variant_id', 'number', 1), ('stock', 'number', 1), ('reserved', 'number', 1),
+                        ('available', 'number', 1)],
+    'bench_customers': [('name', 'text', 1), ('email', 'text', 1), ('phone', 'text', 0)],
+}
+
+
+def table_sizes(records: int) -> Dict[str, int]:
+    return {name: max(1, int(records * share)) for name, share in SHARES.items()}
+
+
+def _products(rng: random.Random, count: int) -> Iterator[Dict[str, Any]]:
+    for i in range(count):
+        yield {'name': f"Product {i}", 'base_sku': f"P{i:07d}"}
+
+
+def _variants(rng: random.Random, count: int, product_ids: range) -> Iterator[Dict[str, Any]]:
+    for i in range(count):
+        color, size = rng.choice(COLORS), rng.choice(SIZES)
+        yield {'product_id': rng.choice(product_ids), 'color': color, 'size': size,
+               'sku': f"V{i:08d}-{color[:3].upper()}-{size}", 'price_rub': rng.randrange(500, 20000, 50)}
+
+
+def _inventory(rng: random.Random, count: int, variant_ids: range) -> Iterator[Dict[str, Any]]:
+    for _ in range(count):
+        stock = rng.randint(0, 500) if rng.random() > 0.1 else 0
+        reserved = rng.randint(0, stock) if stock else 0
+        yield {'variant_id': rng.choice(variant_ids), 'stock': stock, 'reserved': reserved,
+               'available': stock - reserved}
+
+
+def _customers(rng: random.Random, count: int) -> Iterator[Dict[str, Any]]:
+    for i in range(count):
+        yield {'name': f"Customer {i}", 'email': f"customer{i}@example.com",
+               'phone': f"+7{rng.randint(9000000000, 9999999999)}" if rng.random() > 0.2 else None}
+
+
+def _create_table(c, name: str, fields: List[tuple]) -> int:
+    c.execute("INSERT INTO tables (name, display_name, description) VALUES (?, ?, ?)",
+              (name, name.replace('_', ' ').title(), 'Synthetic benchmark data'))
+    table_id = c.lastrowid
+    c.executemany("INSERT INTO fields (table_id, name, display_name, field_type, required) VALUES (?, ?, ?, ?, ?)",
+                  [(table_id, field, field.replace('_', ' ').title(), field_type, required)
+                   for field, field_type, required in fields])
+    return table_id
+
+
+def _insert_records(conn, table_id: int, rows: Iterator[Dict[str, Any]]) -> range:
+    """Insert rows in batches and return the (contiguous) range of new record ids"""
+    first = None
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, BATCH_SIZE))
+        if not batch:
+            break
+        c = conn.cursor()
+        if first is None:
+            c.execute("INSERT INTO records (table_id, data) VALUES (?, ?)", (table_id, json.dumps(batch.pop(0))))
+            first = c.lastrowid
+        c.executemany("INSERT INTO records (table_id, data) VALUES (?, ?)",
+                      [(table_id, json.dumps(row)) for row in batch])
+        conn.commit()
+    last = conn.execute("SELECT MAX(id) FROM records WHERE table_id = ?", (table_id,)).fetchone()[0]
+    return range(first, last + 1) if first is not None else range(0)
+
+
+def generate(db_file: str, records: int, seed: int = 42) -> Dict[str, Any]:
+    """Create a fresh benchmark database with about `records` records; returns a summary"""
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    sizes = table_sizes(records)
+    conn = sqlite3.connect(db_file)
+    try:
+        if not migrations.is_current(conn, 'advanced'):
+            advanced_server.create_schema(conn)
+            migrations.mark_current(conn, 'advanced')
+        # The database is disposable, so trade durability for load speed
+        conn.execute("PRAGMA journal_mode = MEMORY")
+        conn.execute("PRAGMA synchronous = OFF")
+        c = conn.cursor()
+        existing = [name for name in TABLES
+                    if c.execute("SELECT 1 FROM tables WHERE name = ?", (name,)).fetchone()]
+        if existing:
+            raise ValueError(f"{db_file} already contains benchmark tables: {', '.join(existing)}")
+
+        ids = {name: _create_table(c, name, fields) for name, fields in TABLES.items()}
+        conn.commit()
+
+        product_ids = _insert_records(conn, ids['bench_products'], _products(rng, sizes['bench_products']))
+        variant_ids = _insert_records(conn, ids['bench_variants'],
+                                      _variants(rng, sizes['bench_variants'], product_ids))
+        _insert_records(conn, ids['bench_inventory'], _inventory(rng, sizes['bench_inventory'], variant_ids))
+        _insert_records(conn, ids['bench_customers'], _customers(rng, sizes['bench_customers']))
+
+        canvas_ids = {}
+        for name, (nodes, edges) in canvases().items():
+            c.execute("INSERT INTO canvases (name, description, nodes, edges) VALUES (?, ?, ?, ?)",
+                      (f"bench_{name}", 'Benchmark canvas', json.dumps(nodes), json.dumps(edges)))
+            canvas_ids[name] = c.lastrowid
+        conn.commit()
+    finally:
+        conn.close()
+
+    return {
+        'db_file': db_file,
+        'records': sum(sizes.values()),
+        'tables': sizes,
+        'table_ids': ids,
+        'canvas_ids': canvas_ids,
+        'seconds': round(time.perf_counter() - started, 3),
+    }
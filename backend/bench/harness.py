@@ -0,0 +1,224 @@
+"""Running benchmark workloads and summarizing them.
+
+Canvases run in-process against CanvasExecutor ("executor" target) and API
+workloads run over HTTP against main.py and advanced_server.py started as
+subprocesses on the benchmark database; the "startup" target restarts both
+servers and times each start until the first answered request. Each result
+reports throughput, p50/p99 latency and the peak RSS of the measured process so far.
+"""
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from bench.workloads import API_WORKLOADS, Request, canvases
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STARTUP_TIMEOUT = 30.0
+STARTUP_POLL = 0.02
+REQUEST_TIMEOUT = 300.0
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def peak_rss_kb(pid: Optional[int] = None) -> Optional[int]:
+    """High-water RSS of a process (this one by default) in KiB"""
+    if pid is not None:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1])
+        except OSError:
+            return None
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux but bytes on macOS
+    return usage // 1024 if sys.platform == 'darwin' else usage
+
+
+def summarize(target: str, workload: str, latencies: List[float], errors: int, seconds: float,
+              rss_kb: Optional[int], **extra) -> Dict[str, Any]:
+    result = {
+        'target': target,
+        'workload': workload,
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(seconds, 4),
+        'throughput_per_s': round(len(latencies) / seconds, 2) if seconds > 0 else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+        'peak_rss_kb': rss_kb,
+    }
+    result.update(extra)
+    return result
+
+
+def run_executor(db_file: str, repeat: int) -> List[Dict[str, Any]]:
+    """Execute each canonical canvas `repeat` times in-process"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from canvas_executor import CanvasExecutor
+
+    engine = create_engine(f"sqlite:///{db_file}", connect_args={"check_same_thread": False})
+    Session = sessionmaker(bind=engine)
+    results = []
+    try:
+        for name, (nodes, edges) in canvases().items():
+            latencies, rows, errors = [], 0, 0
+            started = time.perf_counter()
+            for _ in range(repeat):
+                db = Session()
+                t0 = time.perf_counter()
+                try:
+                    rows = len(CanvasExecutor(db).execute(nodes, edges))
+                except Exception as e:
+                    errors += 1
+                    print(f"executor {name}: {e}", file=sys.stderr)
+                finally:
+                    latencies.append(time.perf_counter() - t0)
+                    db.close()
+            results.append(summarize('executor', f"canvas_{name}", latencies, errors,
+                                     time.perf_counter() - started, peak_rss_kb(), rows=rows))
+    finally:
+        engine.dispose()
+    return results
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Server:
+    """One of the API servers running as a subprocess on the benchmark database"""
+
+    def __init__(self, target: str, db_file: str):
+        self.target = target
+        self.port = _free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        env = dict(os.environ)
+        if target == 'main':
+            env['DATABASE_URL'] = f"sqlite:///{os.path.abspath(db_file)}"
+            self.command = [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1',
+                            '--port', str(self.port), '--log-level', 'warning']
+        elif target == 'advanced':
+            env['DB_FILE'] = os.path.abspath(db_file)
+            env['PORT'] = str(self.port)
+            self.command = [sys.executable, 'advanced_server.py']
+        else:
+            raise ValueError(f"Unknown server target: {target}")
+        self.env = env
+        self.process: Optional[subprocess.Popen] = None
+        self.startup_seconds: Optional[float] = None
+
+    def __enter__(self) -> 'Server':
+        spawned = time.perf_counter()
+        self.process = subprocess.Popen(self.command, cwd=BACKEND_DIR, env=self.env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.target} server exited with code {self.process.returncode}")
+            try:
+                # Any HTTP answer means the server is accepting requests
+                httpx.get(f"{self.base_url}/api/tables", timeout=1.0)
+                self.startup_seconds = time.perf_counter() - spawned
+                return self
+            except httpx.HTTPError:
+                pass
+            time.sleep(STARTUP_POLL)
+        self.__exit__(None, None, None)
+        raise RuntimeError(f"{self.target} server did not start within {STARTUP_TIMEOUT}s")
+
+    def __exit__(self, *exc):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid if self.process else None
+
+
+def run_startup(db_file: str, repeat: int) -> List[Dict[str, Any]]:
+    """Time from spawning each server to its first answered request, over `repeat` restarts.
+
+    The first start on the generated database also creates/upgrades the schema;
+    it is reported separately as first_start_ms, the rest are warm restarts.
+    """
+    results = []
+    for target in ('main', 'advanced'):
+        latencies, errors, rss_kb = [], 0, None
+        started = time.perf_counter()
+        for _ in range(max(repeat, 2)):
+            try:
+                with Server(target, db_file) as server:
+                    latencies.append(server.startup_seconds)
+                    rss_kb = peak_rss_kb(server.pid)
+            except RuntimeError as e:
+                errors += 1
+                print(f"startup {target}: {e}", file=sys.stderr)
+        first = latencies.pop(0) if latencies else None
+        results.append(summarize(target, 'startup', latencies, errors, time.perf_counter() - started, rss_kb,
+                                 first_start_ms=round(first * 1000, 3) if first is not None else None))
+    return results
+
+
+def _is_error(response: httpx.Response) -> bool:
+    if response.status_code >= 400:
+        return True
+    # advanced_server reports failures as 200 {"error": ...}
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    return isinstance(body, dict) and 'error' in body
+
+
+def _timed_request(client: httpx.Client, request: Request):
+    method, path, body = request
+    t0 = time.perf_counter()
+    try:
+        failed = _is_error(client.request(method, path, json=body))
+    except httpx.HTTPError:
+        failed = True
+    return time.perf_counter() - t0, failed
+
+
+def run_api(server: Server, context: Dict[str, Any], workloads: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Run the API workloads supported by the server's target"""
+    results = []
+    with httpx.Client(base_url=server.base_url, timeout=REQUEST_TIMEOUT) as client:
+        for name, (build, concurrency, targets) in API_WORKLOADS.items():
+            if server.target not in targets or (workloads and name not in workloads):
+                continue
+            requests = build(context)
+            started = time.perf_counter()
+            if concurrency > 1:
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    timings = list(pool.map(lambda r: _timed_request(client, r), requests))
+            else:
+                timings = [_timed_request(client, r) for r in requests]
+            seconds = time.perf_counter() - started
+            results.append(summarize(server.target, name, [t for t, _ in timings],
+                                     sum(1 for _, failed in timings if failed), seconds,
+                                     peak_rss_kb(server.pid), concurrency=concurrency))
+    return results
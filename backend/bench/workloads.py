@@ -0,0 +1,93 @@
+"""Canonical canvases and API workloads used by the benchmark harness.
+
+Every API workload is a function (context) -> list of (method, path, json)
+requests, where context is the datagen summary; the harness times each request.
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+Request = Tuple[str, str, Optional[Dict[str, Any]]]
+
+PAGE_SIZE = 100
+LIST_REQUESTS = 50
+PAGES = 50
+BULK_BATCHES = 20
+BULK_SIZE = 500
+WEBHOOK_BURST = 500
+WEBHOOK_CONCURRENCY = 8
+
+
+def _node(node_id: str, node_type: str, **data) -> Dict[str, Any]:
+    return {'id': node_id, 'type': node_type, 'position': {'x': 0, 'y': 0}, 'data': data}
+
+
+def _edges(*pairs: Tuple[str, str]) -> List[Dict[str, Any]]:
+    return [{'id': f"e-{source}-{target}", 'source': source, 'target': target} for source, target in pairs]
+
+
+def canvases() -> Dict[str, Tuple[List[Dict], List[Dict]]]:
+    """name -> (nodes, edges) for the canonical benchmark canvases"""
+    inventory = _node('inventory', 'tableNode', tableName='bench_inventory')
+    return {
+        # Single filter over the largest table
+        'filter': ([inventory, _node('in-stock', 'filterNode', condition='available > 0')],
+                   _edges(('inventory', 'in-stock'))),
+        # Inventory joined with its variants
+        'join': ([inventory, _node('variants', 'joinNode', joinTable='bench_variants',
+                                   joinField='variant_id', targetField='id')],
+                 _edges(('inventory', 'variants'))),
+        # Filter -> join -> filter -> top-N
+        'chained': ([inventory,
+                     _node('low', 'filterNode', condition='available < 10'),
+                     _node('variants', 'joinNode', joinTable='bench_variants',
+                           joinField='variant_id', targetField='id'),
+                     _node('expensive', 'filterNode', condition='price_rub > 10000'),
+                     _node('sort', 'sortNode', field='available'),
+                     _node('top', 'limitNode', limit=100)],
+                    _edges(('inventory', 'low'), ('low', 'variants'), ('variants', 'expensive'),
+                           ('expensive', 'sort'), ('sort', 'top'))),
+        # Three independent pipelines, two of them over the same table. Not a fan-out: a pipeline
+        # follows only the first outgoing edge of a node, so a second branch needs its own table node
+        'multi_pipeline': ([inventory,
+                            _node('empty', 'filterNode', condition='stock = 0'),
+                            _node('inventory-2', 'tableNode', tableName='bench_inventory'),
+                            _node('reserved', 'filterNode', condition='reserved > 0'),
+                            _node('customers', 'tableNode', tableName='bench_customers'),
+                            _node('no-phone', 'filterNode', condition='phone = null')],
+                           _edges(('inventory', 'empty'), ('inventory-2', 'reserved'), ('customers', 'no-phone'))),
+    }
+
+
+def list_records(context: Dict[str, Any]) -> List[Request]:
+    return [('GET', f"/api/t/bench_inventory?limit={PAGE_SIZE}", None)] * LIST_REQUESTS
+
+
+def paginate(context: Dict[str, Any]) -> List[Request]:
+    return [('GET', f"/api/t/bench_inventory?limit={PAGE_SIZE}&offset={page * PAGE_SIZE}", None)
+            for page in range(PAGES)]
+
+
+def bulk_insert(context: Dict[str, Any]) -> List[Request]:
+    records = [{'name': f"Bulk {i}", 'email': f"bulk{i}@example.com"} for i in range(BULK_SIZE)]
+    return [('POST', "/api/t/bench_customers/bulk", {'records': records})] * BULK_BATCHES
+
+
+def webhook_burst(context: Dict[str, Any]) -> List[Request]:
+    return [('POST', "/api/webhook/bench_inventory",
+             {'variant_id': 1, 'stock': i % 100, 'reserved': 0, 'available': i % 100})
+            for i in range(WEBHOOK_BURST)]
+
+
+def execute_canvases(context: Dict[str, Any]) -> List[Request]:
+    return [('POST', "/api/canvases/execute", {'canvas_id': canvas_id})
+            for canvas_id in context['canvas_ids'].values()]
+
+
+# name -> (requests builder, concurrency, targets that support it)
+API_WORKLOADS: Dict[str, Tuple[Callable[[Dict[str, Any]], List[Request]], int, Tuple[str, ...]]] = {
+    'list': (list_records, 1, ('main', 'advanced')),
+    'paginate': (paginate, 1, ('main', 'advanced')),
+    'bulk_insert': (bulk_insert, 1, ('main', 'advanced')),
+    # Only advanced_server accepts webhooks
+    'webhook_burst': (webhook_burst, WEBHOOK_CONCURRENCY, ('advanced',)),
+    'canvas_execute': (execute_canvases, 1, ('main', 'advanced')),
+}
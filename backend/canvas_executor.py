@@ -1,156 +1,215 @@
-from typing import List, Dict, Any
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple
 from sqlalchemy.orm import Session
-import httpx
-import json
-from models import Table, Record
+import time
+from aggregation import aggregate_rows
+import columnar
+from computed import compute_rows
+from canvas_planner import MAX_LOOKUP_KEYS, CanvasPlan, PlanOp, Planner, delta_scan
+from ordering import sort_rows, top_n
+from sql_pushdown import TableScan
+from profiling import Profiler, record_cache
+import metrics
+import query_log
+
+# Keys per IN (...) query of a lookup join or a delta scan
+LOOKUP_BATCH_SIZE = 500
 
 class CanvasExecutor:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, profiler: Optional[Profiler] = None):
         self.db = db
+        self.profiler = profiler or Profiler(enabled=False)
+        # Sessions of the async engine (see async_db.py): webhooks are awaited on the event loop
+        self.async_io = bool(getattr(db, 'info', {}).get('async_io'))
         
-    def execute(self, nodes: List[Dict], edges: List[Dict]) -> List[Dict[str, Any]]:
-        """Execute canvas workflow and return result data"""
-        # Build execution graph
-        node_map = {node['id']: node for node in nodes}
-        
-        # Find start nodes (nodes with no incoming edges)
-        incoming_edges = {edge['target'] for edge in edges}
-        start_nodes = [node for node in nodes if node['id'] not in incoming_edges]
+    def plan(self, nodes: List[Dict], edges: List[Dict], version: Optional[Tuple] = None) -> CanvasPlan:
+        """Physical plan for the canvas (see canvas_planner.py), cached per canvas and schema.
         
-        if not start_nodes:
-            raise ValueError("No start nodes found in canvas")
+        version is the stored canvas' graph version (canvas_runs.graph_version), which keys the cache.
+        """
+        return Planner(self.db).plan(nodes, edges, version)
         
-        # Execute from start node
+    def execute(self, nodes: List[Dict], edges: List[Dict], version: Optional[Tuple] = None) -> List[Dict[str, Any]]:
+        """Execute canvas workflow and return result data"""
+        with self.profiler.run(self.db), self._measured():
+            return self._run(self.plan(nodes, edges, version).pipelines)
+    
+    async def execute_async(self, nodes: List[Dict], edges: List[Dict],
+                            version: Optional[Tuple] = None) -> List[Dict[str, Any]]:
+        """execute() for an AsyncSession: the same plan and operators, run through run_sync"""
+        return await self.db.run_sync(
+            lambda session: CanvasExecutor(session, self.profiler).execute(nodes, edges, version))
+    
+    def execute_delta(self, nodes: List[Dict], edges: List[Dict], table_name: str,
+                      record_ids: List[int], version: Optional[Tuple] = None) -> Optional[List[Dict[str, Any]]]:
+        """Run the canvas over only these records of table_name.
+        
+        Returns None when the canvas needs every row (aggregates, sorts, limits
+        after the table, or the table is only joined), so the caller runs it in full.
+        """
+        pipelines = self.plan(nodes, edges, version).delta_pipelines(table_name)
+        if pipelines is None:
+            return None
+        with self.profiler.run(self.db), self._measured():
+            return self._run(pipelines, sorted(set(record_ids)))
+    
+    @contextmanager
+    def _measured(self):
+        started = time.perf_counter()
+        result = 'error'
+        try:
+            yield
+            result = 'ok'
+        finally:
+            metrics.CANVAS_EXECUTIONS.inc(result)
+            metrics.CANVAS_DURATION.observe(time.perf_counter() - started)
+    
+    def _run(self, pipelines: List[List[PlanOp]], record_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+        # Outputs of operator prefixes shared by several pipelines, computed once
+        shared: Dict[str, Any] = {}
         result_data = []
-        for start_node in start_nodes:
-            data = self._execute_node_chain(start_node['id'], node_map, edges, {})
+        for pipeline in pipelines:
+            data = self._execute_pipeline(pipeline, shared, record_ids)
             if data:
                 result_data.extend(data if isinstance(data, list) else [data])
-        
         return result_data
     
-    def _execute_node_chain(self, node_id: str, node_map: Dict, edges: List[Dict], context: Dict) -> Any:
-        """Execute a chain of nodes starting from node_id"""
-        node = node_map[node_id]
-        node_type = node.get('type', 'default')
-        
-        # Execute current node
-        if node_type == 'tableNode':
-            data = self._execute_table_node(node)
-        elif node_type == 'filterNode':
-            input_data = context.get('input_data', [])
-            data = self._execute_filter_node(node, input_data)
-        elif node_type == 'joinNode':
-            input_data = context.get('input_data', [])
-            data = self._execute_join_node(node, input_data)
-        elif node_type == 'webhookNode':
-            input_data = context.get('input_data', [])
-            data = self._execute_webhook_node(node, input_data)
-        else:
-            data = context.get('input_data', [])
-        
-        # Find next nodes
-        next_edges = [edge for edge in edges if edge['source'] == node_id]
-        
-        if not next_edges:
-            return data
-        
-        # Execute next nodes with current data as input
-        for edge in next_edges:
-            next_context = {'input_data': data}
-            return self._execute_node_chain(edge['target'], node_map, edges, next_context)
-        
+    def explain(self, nodes: List[Dict], edges: List[Dict], version: Optional[Tuple] = None) -> Dict[str, Any]:
+        """Describe the plan execute() would run, with pushdowns, join strategies and estimates, without running it"""
+        planner = Planner(self.db)
+        plan = planner.plan(nodes, edges, version)
+        return {**plan.describe(), 'cached': planner.cached}
+    
+    def _execute_pipeline(self, pipeline: List[PlanOp], shared: Dict[str, Any],
+                          record_ids: Optional[List[int]] = None) -> Any:
+        """Run one start node's operators, resuming after the longest prefix already computed"""
+        data: Any = []
+        start = 0
+        for i in range(len(pipeline) - 1, -1, -1):
+            if pipeline[i].shared and pipeline[i].key in shared:
+                data, start = shared[pipeline[i].key], i + 1
+                break
+        if any(op.shared for op in pipeline):
+            record_cache('subplan', start > 0)
+        
+        for op in pipeline[start:]:
+            node = {'id': op.node_ids[0], 'type': op.node_type}
+            with self.profiler.node(node, data) as entry, query_log.scope(node=op.node_ids[0]):
+                if op.kind == 'sql_scan' and record_ids is not None:
+                    data = self._delta_rows(op, record_ids)
+                else:
+                    data = self._execute_op(op, data)
+                self.profiler.finish_node(entry, data, op.node_ids[1:])
+            if op.shared:
+                shared[op.key] = data
         return data
     
-    def _execute_table_node(self, node: Dict) -> List[Dict[str, Any]]:
-        """Execute table node - fetch data from table"""
-        table_name = node.get('data', {}).get('tableName')
-        if not table_name:
-            return []
-        
-        table = self.db.query(Table).filter(Table.name == table_name).first()
-        if not table:
+    def _execute_op(self, op: PlanOp, input_data: Any) -> Any:
+        if op.kind == 'sql_scan':
+            return op.query.rows(self.db)
+        if op.kind == 'empty':
             return []
-        
-        records = self.db.query(Record).filter(Record.table_id == table.id).all()
-        return [{'id': r.id, **r.data} for r in records]
+        if op.kind == 'filter':
+            return self._execute_filter(op, input_data)
+        if op.kind == 'compute':
+            return compute_rows(op.columns, input_data)
+        if op.kind == 'hash_join':
+            return self._execute_hash_join(op, input_data)
+        if op.kind == 'lookup_join':
+            return self._execute_lookup_join(op, input_data)
+        if op.kind == 'aggregate':
+            return aggregate_rows(op.spec, input_data)
+        if op.kind == 'sort':
+            return sort_rows(input_data, op.keys)
+        if op.kind == 'topn':
+            return top_n(input_data, op.keys, op.limit, op.offset)
+        if op.kind == 'limit':
+            return input_data[op.offset:op.offset + op.limit]
+        if op.kind == 'webhook':
+            return self._execute_webhook(op, input_data)
+        raise ValueError(f"Unknown plan operator: {op.kind}")
     
-    def _execute_filter_node(self, node: Dict, input_data: List[Dict]) -> List[Dict[str, Any]]:
-        """Execute filter node - filter data based on condition"""
-        condition = node.get('data', {}).get('condition', '')
-        if not condition or not input_data:
-            return input_data
-        
-        try:
-            # Simple filter parsing (e.g., "stock > 0", "status = 'active'")
-            filtered_data = []
-            for item in input_data:
-                if self._evaluate_condition(condition, item):
-                    filtered_data.append(item)
-            return filtered_data
-        except Exception:
-            return input_data
+    def _delta_rows(self, op: PlanOp, record_ids: List[int]) -> List[Dict[str, Any]]:
+        rows = []
+        for i in range(0, len(record_ids), LOOKUP_BATCH_SIZE):
+            rows.extend(delta_scan(self.db, op, record_ids[i:i + LOOKUP_BATCH_SIZE]).rows(self.db))
+        return rows
     
-    def _execute_join_node(self, node: Dict, input_data: List[Dict]) -> List[Dict[str, Any]]:
-        """Execute join node - join with another table"""
-        join_table = node.get('data', {}).get('joinTable')
-        join_field = node.get('data', {}).get('joinField')
-        target_field = node.get('data', {}).get('targetField')
-        
-        if not all([join_table, join_field, target_field]) or not input_data:
+    def _execute_filter(self, op: PlanOp, input_data: List[Dict]) -> List[Dict[str, Any]]:
+        """Filter rows on all the conditions in one pass; expressions are parsed once and compiled"""
+        if not input_data:
             return input_data
-        
-        # Get join table data
-        table = self.db.query(Table).filter(Table.name == join_table).first()
-        if not table:
-            return input_data
-        
-        join_records = self.db.query(Record).filter(Record.table_id == table.id).all()
-        join_data = {r.data.get(target_field): {'id': r.id, **r.data} for r in join_records}
-        
-        # Perform join
+        # Large inputs are filtered as whole columns when NumPy is installed (see columnar.py)
+        mask = columnar.filter_mask(op.expressions, input_data)
+        if mask is not None:
+            return columnar.select(input_data, mask)
+        predicates = [expression.predicate() for expression in op.expressions]
+        if len(predicates) == 1:
+            predicate = predicates[0]
+            return [item for item in input_data if predicate(item)]
+        return [item for item in input_data if all(p(item) for p in predicates)]
+    
+    def _probe(self, op: PlanOp, input_data: List[Dict], join_data: Dict[Any, Dict]) -> List[Dict[str, Any]]:
         result = []
         for item in input_data:
-            join_key = item.get(join_field)
+            join_key = item.get(op.join_field)
             if join_key in join_data:
-                joined_item = {**item, **join_data[join_key]}
-                result.append(joined_item)
-        
+                result.append({**item, **join_data[join_key]})
         return result
     
-    def _execute_webhook_node(self, node: Dict, input_data: List[Dict]) -> List[Dict[str, Any]]:
+    def _execute_hash_join(self, op: PlanOp, input_data: List[Dict]) -> List[Dict[str, Any]]:
+        """Join with every row of the related table, keyed on the target field (last row wins)"""
+        if not input_data:
+            return input_data
+        rows = TableScan(self.db, op.table).rows()
+        join_data = {row.get(op.target_field): row for row in rows}
+        return self._probe(op, input_data, join_data)
+    
+    def _execute_lookup_join(self, op: PlanOp, input_data: List[Dict]) -> List[Dict[str, Any]]:
+        """Join by fetching only the related rows whose target field matches an input key"""
+        if not input_data:
+            return input_data
+        keys = list({item.get(op.join_field) for item in input_data})
+        if len(keys) > MAX_LOOKUP_KEYS:
+            # The input turned out much larger than estimated
+            return self._execute_hash_join(op, input_data)
+        
+        rows = []
+        for i in range(0, len(keys), LOOKUP_BATCH_SIZE):
+            scan = TableScan(self.db, op.table)
+            if not scan.push_in(op.target_field, keys[i:i + LOOKUP_BATCH_SIZE]):
+                return self._execute_hash_join(op, input_data)
+            rows.extend(scan.rows())
+        # Same last-row-wins order as loading the whole table
+        rows.sort(key=lambda row: row['id'])
+        join_data = {row.get(op.target_field): row for row in rows}
+        return self._probe(op, input_data, join_data)
+    
+    def _execute_webhook(self, op: PlanOp, input_data: List[Dict]) -> List[Dict[str, Any]]:
         """Execute webhook node - send data to webhook URL"""
-        webhook_url = node.get('data', {}).get('webhookUrl')
-        if not webhook_url or not input_data:
+        if not input_data:
             return input_data
         
+        # Imported on first use: httpx alone is a sizeable part of server startup
+        import httpx
+        request = dict(json={'data': input_data}, headers={'Content-Type': 'application/json'}, timeout=10.0)
         try:
-            # Send POST request to webhook
-            with httpx.Client() as client:
-                response = client.post(
-                    webhook_url,
-                    json={'data': input_data},
-                    headers={'Content-Type': 'application/json'},
-                    timeout=10.0
-                )
-                
-            # Return original data (webhook is side effect)
-            return input_data
+            if self.async_io:
+                # Inside AsyncSession.run_sync: hand the request to the event loop instead of blocking it
+                from sqlalchemy.util import await_only
+                await_only(self._post_async(op.url, request))
+            else:
+                # Send POST request to webhook
+                with httpx.Client() as client:
+                    client.post(op.url, **request)
         except Exception:
             # If webhook fails, still return the data
-            return input_data
+            pass
+        # Return original data (webhook is side effect)
+        return input_data
     
-    def _evaluate_condition(self, condition: str, item: Dict) -> bool:
-        """Evaluate simple filter condition"""
-        try:
-            # Replace field names with item values
-            for key, value in item.items():
-                if isinstance(value, str):
-                    condition = condition.replace(key, f"'{value}'")
-                else:
-                    condition = condition.replace(key, str(value))
-            
-            # Simple eval (in production, use a proper expression parser)
-            return eval(condition)
-        except Exception:
-            return True
+    @staticmethod
+    async def _post_async(url: str, request: Dict[str, Any]):
+        import httpx
+        async with httpx.AsyncClient() as client:
+            await client.post(url, **request)
@@ -0,0 +1,108 @@
+"""Incremental canvas saves (PATCH /api/canvases/{id}/ops).
+
+Instead of the whole nodes and edges arrays the editor sends the operations
+since its last save, together with the canvas version it started from:
+
+    {"version": 7, "ops": [
+        {"op": "update_node", "id": "filter-1", "changes": {"position": {"x": 10, "y": 40}}},
+        {"op": "add_edge", "edge": {"id": "e1", "source": "table-1", "target": "filter-1"}},
+        {"op": "remove_node", "id": "join-2"}]}
+
+update_node / update_edge replace the given top-level keys (null removes one),
+remove_node also removes the node's edges, removing a missing element is a
+no-op. The ops are applied in order on the server and the canvas is written
+with version = version + 1 only if nobody saved in between; otherwise the
+save fails with the current version and the editor reloads.
+
+Every change of nodes or edges (full saves too) bumps the version, so
+(canvas id, version) also names the graph for the plan cache (see canvas_planner.py).
+"""
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from canvas_runs import load_json
+from database import execute_sql
+
+
+class CanvasOpsError(ValueError):
+    """Raised for an operation that cannot be applied"""
+
+
+class VersionConflict(CanvasOpsError):
+    """The canvas was saved by someone else since the client's version"""
+
+    def __init__(self, version: int):
+        super().__init__(f"Canvas was changed by another save (current version {version})")
+        self.version = version
+
+
+def _merge(element: Dict[str, Any], changes: Dict[str, Any]) -> Dict[str, Any]:
+    if not isinstance(changes, dict):
+        raise CanvasOpsError("changes must be an object")
+    if 'id' in changes and changes['id'] != element.get('id'):
+        raise CanvasOpsError("an element's id cannot change")
+    merged = dict(element)
+    for key, value in changes.items():
+        if value is None:
+            merged.pop(key, None)
+        else:
+            merged[key] = value
+    return merged
+
+
+def _index(elements: List[Dict[str, Any]], element_id: Any) -> Optional[int]:
+    for i, element in enumerate(elements):
+        if element.get('id') == element_id:
+            return i
+    return None
+
+
+def apply_ops(nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]],
+              ops: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """New (nodes, edges) after applying ops in order"""
+    nodes, edges = list(nodes), list(edges)
+    for number, op in enumerate(ops, start=1):
+        kind = op.get('op') if isinstance(op, dict) else None
+        action, _, target = (kind or '').partition('_')
+        if target not in ('node', 'edge') or action not in ('add', 'update', 'remove'):
+            raise CanvasOpsError(f"op {number}: unknown operation {kind!r}")
+        elements = nodes if target == 'node' else edges
+        if action == 'add':
+            element = op.get(target)
+            if not isinstance(element, dict) or element.get('id') is None:
+                raise CanvasOpsError(f"op {number}: {kind} needs a {target} with an id")
+            if _index(elements, element['id']) is not None:
+                raise CanvasOpsError(f"op {number}: {target} {element['id']!r} already exists")
+            elements.append(element)
+            continue
+        i = _index(elements, op.get('id'))
+        if action == 'update':
+            if i is None:
+                raise CanvasOpsError(f"op {number}: no {target} {op.get('id')!r}")
+            try:
+                elements[i] = _merge(elements[i], op.get('changes') or {})
+            except CanvasOpsError as e:
+                raise CanvasOpsError(f"op {number}: {e}")
+        elif i is not None:
+            del elements[i]
+            if target == 'node':
+                edges = [e for e in edges if op['id'] not in (e.get('source'), e.get('target'))]
+    return nodes, edges
+
+
+def save_ops(conn, canvas_id: int, version: int, ops: List[Dict[str, Any]]) -> Optional[int]:
+    """Apply ops to a stored canvas; returns the new version, None if the canvas does not exist"""
+    row = execute_sql(conn, "SELECT nodes, edges, version FROM canvases WHERE id = :id AND deleted_at IS NULL", {'id': canvas_id}).fetchone()
+    if row is None:
+        return None
+    if row[2] != version:
+        raise VersionConflict(row[2])
+    nodes, edges = apply_ops(load_json(row[0]) or [], load_json(row[1]) or [], ops)
+    # The version condition makes a concurrent save between the read and this write fail instead of being lost
+    result = execute_sql(conn, "UPDATE canvases SET nodes = :nodes, edges = :edges, version = version + 1, "
+                               "updated_at = CURRENT_TIMESTAMP WHERE id = :id AND version = :version",
+                         {'nodes': json.dumps(nodes), 'edges': json.dumps(edges), 'id': canvas_id, 'version': version})
+    if not result.rowcount:
+        current = execute_sql(conn, "SELECT version FROM canvases WHERE id = :id", {'id': canvas_id}).fetchone()
+        raise VersionConflict(current[0] if current else version)
+    return version + 1
@@ -0,0 +1,654 @@
+"""Planning of canvas executions.
+
+The React Flow graph is turned into a logical plan: one pipeline of operators
+per start node, following the first outgoing edge of every node exactly as the
+executor always has. Rewrite rules then simplify the pipelines:
+
+- no-op nodes (unconfigured filters/sorts/limits/computes, dangling joins) are dropped
+- filters are split into conjuncts and pushed below joins when the join
+  cannot change the fields they read
+- sort followed by limit becomes a top-N
+- scans only produce the fields later operators need (projection pruning)
+
+The physical plan folds the longest possible prefix of every pipeline into
+one SQL query (sql_pushdown.TableScan), computed columns included, merges the remaining filters into a
+single Python pass, picks hash or lookup joins from table row counts, and
+marks operator prefixes shared by several pipelines so they run once.
+A filter is only folded when every comparison in it has SQL that gives
+compare_values' result on any stored value; otherwise it and everything
+after it stay in Python.
+
+Row estimates come from table statistics (table_stats.py) where a table was
+analyzed: row counts, null fractions, distinct counts, top values and
+min/max give filter selectivities and group counts; tables without
+statistics are counted and filters assumed to keep a third of the rows.
+
+Plans are cached per canvas and schema: editing the canvas, changing the
+fields/storage of a table it reads or analyzing one produces a new plan.
+A stored canvas is keyed by its version (see canvas_ops.py) instead of a
+hash of its whole graph.
+"""
+import ast
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from aggregation import parse_aggregate_spec
+from computed import FIELD_TYPES, ComputeError, check_columns, parse_compute_spec
+from database import execute_sql
+from expressions import CONSTANT_NAMES, Expression, ExpressionError, parse as parse_expression
+from ordering import parse_limit, parse_sort_spec
+from profiling import record_cache
+from sql_pushdown import CompiledScan, TableScan
+import typed_storage
+
+PLAN_CACHE_SIZE = 128
+
+# Joins probe the related table by key with IN (...) instead of loading it whole
+# when the input is expected to be this much smaller than the table
+LOOKUP_JOIN_RATIO = 10
+MAX_LOOKUP_KEYS = 5000
+
+# Fraction of rows assumed to pass each filter conjunct
+FILTER_SELECTIVITY = 0.33
+
+
+class TableInfo(NamedTuple):
+    """What planning needs to know about a table; safe to keep in cached plans"""
+    id: int
+    name: str
+    storage_mode: str
+    fields: Tuple[Dict[str, str], ...]
+    row_count: Optional[int] = None  # from table_stats, when the table was analyzed
+    stats: Optional[Dict[str, Dict[str, Any]]] = None  # per field summaries from table_stats
+    analyzed_at: Optional[str] = None
+
+    @property
+    def field_names(self) -> frozenset:
+        return frozenset(f['name'] for f in self.fields)
+
+
+class PlanOp:
+    """One operator of a pipeline; logical and physical plans share this shape"""
+
+    def __init__(self, kind: str, node_ids: List[str], node_type: str, **params):
+        self.kind = kind
+        self.node_ids = list(node_ids)
+        self.node_type = node_type
+        self.params = params
+        self.key: Optional[str] = None  # identity of the pipeline prefix ending here
+        self.shared = False  # another pipeline has the same prefix
+        self.estimated_rows: Optional[float] = None
+        self.folded: List['PlanOp'] = []  # logical operators computed by a sql_scan
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['params'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def identity(self) -> str:
+        if self.kind == 'webhook':
+            # Side effects never merge with another pipeline's
+            return f"webhook:{id(self)}"
+        parts = []
+        for name, value in sorted(self.params.items()):
+            if isinstance(value, Expression):
+                value = value.key
+            elif name == 'expressions':
+                value = [e.key for e in value]
+            elif name == 'columns':
+                value = [(c.name, c.expression.key) for c in value]
+            elif isinstance(value, TableInfo):
+                value = value.id
+            elif name == 'query':
+                value = (value.sql, sorted(value.params.items(), key=str))
+            parts.append(f"{name}={value!r}")
+        return f"{self.kind}({', '.join(parts)})"
+
+    def describe(self) -> Dict[str, Any]:
+        info: Dict[str, Any] = {'operator': self.kind, 'nodes': self.node_ids}
+        for name, value in self.params.items():
+            if name == 'query':
+                info.update(sql=value.sql, params=value.params)
+                continue
+            if isinstance(value, Expression):
+                value = value.source
+            elif name == 'expressions':
+                value = [e.source for e in value]
+            elif name == 'columns':
+                value = [{'name': c.name, 'expression': c.expression.source, 'type': c.type} for c in value]
+            elif isinstance(value, TableInfo):
+                info['storage'] = value.storage_mode
+                value = value.name
+            elif name == 'spec':
+                value = {'group_by': value.group_by, 'aggregates': [a._asdict() for a in value.aggregates]}
+            elif name == 'keys':
+                value = [{'field': k.field, 'descending': k.descending} for k in value]
+            info[name] = value
+        if self.estimated_rows is not None:
+            info['estimated_rows'] = int(round(self.estimated_rows))
+        if self.shared:
+            info['shared'] = True
+        return info
+
+
+# Operators whose output for a set of rows does not depend on the other input rows
+ROW_LOCAL = {'filter', 'compute', 'hash_join', 'lookup_join', 'webhook'}
+
+
+class CanvasPlan:
+    def __init__(self, pipelines: List[List[PlanOp]], rewrites: List[str]):
+        self.pipelines = pipelines
+        self.rewrites = rewrites
+
+    def delta_pipelines(self, table_name: str) -> Optional[List[List[PlanOp]]]:
+        """Pipelines scanning table_name if all of them can run over just some of its rows, else None"""
+        pipelines = [p for p in self.pipelines if p[0].kind == 'sql_scan' and p[0].table.name == table_name]
+        if not pipelines:
+            return None
+        for pipeline in pipelines:
+            if any(op.kind not in ('filter', 'compute') for op in pipeline[0].folded):
+                return None
+            if any(op.kind not in ROW_LOCAL for op in pipeline[1:]):
+                return None
+        return pipelines
+
+    def describe(self) -> Dict[str, Any]:
+        return {'pipelines': [[op.describe() for op in pipeline] for pipeline in self.pipelines],
+                'rewrites': self.rewrites}
+
+
+# Catalog
+
+def _load_tables(db, names) -> Dict[str, TableInfo]:
+    names = sorted(set(n for n in names if n))
+    if not names:
+        return {}
+    params = {f"n{i}": name for i, name in enumerate(names)}
+    rows = execute_sql(db, f"SELECT t.id, t.name, t.storage_mode, f.name, f.field_type, "
+                           f"s.row_count, s.summary, s.analyzed_at FROM tables t "
+                           f"LEFT JOIN fields f ON f.table_id = t.id "
+                           f"LEFT JOIN table_stats s ON s.table_id = t.id "
+                           f"WHERE t.name IN ({', '.join(':' + p for p in params)}) AND t.deleted_at IS NULL "
+                           f"ORDER BY t.id, f.id",
+                       params).fetchall()
+    tables: Dict[str, TableInfo] = {}
+    for table_id, name, storage_mode, field_name, field_type, row_count, summary, analyzed_at in rows:
+        info = tables.get(name)
+        if info is None:
+            info = tables[name] = TableInfo(table_id, name, storage_mode or typed_storage.STORAGE_JSON, (),
+                                            row_count, typed_storage.load_data(summary) if summary else None,
+                                            analyzed_at)
+        if field_name is not None:
+            tables[name] = info._replace(fields=info.fields + ({'name': field_name, 'field_type': field_type},))
+    return tables
+
+
+def table_row_count(db, table: TableInfo) -> int:
+    """Row count from the table's statistics, counted when it was never analyzed"""
+    if table.row_count is not None:
+        return table.row_count
+    return execute_sql(db, "SELECT COUNT(*) FROM records WHERE table_id = :table_id",
+                       {'table_id': table.id}).fetchone()[0]
+
+
+# Logical plan
+
+def _start_nodes(nodes: List[Dict], edges: List[Dict]) -> List[Dict]:
+    incoming = {edge['target'] for edge in edges}
+    start_nodes = [node for node in nodes if node['id'] not in incoming]
+    if not start_nodes:
+        raise ValueError("No start nodes found in canvas")
+    return start_nodes
+
+
+def _chain(start_id: str, node_map: Dict, edges: List[Dict]) -> List[Dict]:
+    """Nodes from start_id along the first outgoing edge of each node"""
+    chain, seen = [], set()
+    node_id = start_id
+    while node_id in node_map and node_id not in seen:
+        seen.add(node_id)
+        chain.append(node_map[node_id])
+        next_edges = [edge for edge in edges if edge['source'] == node_id]
+        node_id = next_edges[0]['target'] if next_edges else None
+    return chain
+
+
+def _logical_op(node: Dict, tables: Dict[str, TableInfo]) -> PlanOp:
+    node_id, node_type = node['id'], node.get('type', 'default')
+    data = node.get('data', {}) or {}
+    ids = [node_id]
+    if node_type == 'tableNode':
+        table = tables.get(data.get('tableName'))
+        return PlanOp('scan', ids, node_type, table=table) if table else PlanOp('empty', ids, node_type)
+    if node_type == 'filterNode':
+        try:
+            return PlanOp('filter', ids, node_type, expression=parse_expression(data.get('condition') or ''))
+        except ExpressionError:
+            return PlanOp('noop', ids, node_type)
+    if node_type == 'computeNode':
+        try:
+            columns = parse_compute_spec(data)
+        except ComputeError as e:
+            raise ComputeError(f"computeNode {node_id}: {e}")
+        return PlanOp('compute', ids, node_type, columns=columns) if columns else PlanOp('noop', ids, node_type)
+    if node_type == 'joinNode':
+        table = tables.get(data.get('joinTable'))
+        if table and data.get('joinField') and data.get('targetField'):
+            return PlanOp('join', ids, node_type, table=table, join_field=data['joinField'],
+                          target_field=data['targetField'])
+        return PlanOp('noop', ids, node_type)
+    if node_type == 'aggregateNode':
+        spec = parse_aggregate_spec(data)
+        return PlanOp('aggregate', ids, node_type, spec=spec) if spec else PlanOp('noop', ids, node_type)
+    if node_type == 'sortNode':
+        keys = parse_sort_spec(data)
+        return PlanOp('sort', ids, node_type, keys=keys) if keys else PlanOp('noop', ids, node_type)
+    if node_type == 'limitNode':
+        limit = parse_limit(data)
+        return PlanOp('limit', ids, node_type, limit=limit[0], offset=limit[1]) if limit else PlanOp('noop', ids, node_type)
+    if node_type == 'webhookNode':
+        url = data.get('webhookUrl')
+        return PlanOp('webhook', ids, node_type, url=url) if url else PlanOp('noop', ids, node_type)
+    return PlanOp('noop', ids, node_type)
+
+
+def _table_fields(table: TableInfo) -> Dict[str, str]:
+    return {'id': 'number', **{f['name']: FIELD_TYPES.get(f['field_type'], 'text') for f in table.fields}}
+
+
+def check_types(ops: List[PlanOp]) -> List[PlanOp]:
+    """Type the computed columns from the fields reaching each computeNode; raises ComputeError"""
+    # Typed tables hold exactly their fields; JSON records and unknown inputs may carry any key
+    fields: Dict[str, str] = {}
+    exact = False
+    result = []
+    for op in ops:
+        if op.kind == 'scan':
+            fields, exact = _table_fields(op.table), op.table.storage_mode == typed_storage.STORAGE_TYPED
+        elif op.kind == 'join':
+            fields = {**fields, **_table_fields(op.table)}
+            exact = exact and op.table.storage_mode == typed_storage.STORAGE_TYPED
+        elif op.kind == 'aggregate':
+            spec, before = op.spec, fields
+            fields = {name: before.get(name, 'any') for name in spec.group_by}
+            fields.update((a.alias, before.get(a.field, 'any') if a.op in ('min', 'max') else 'number')
+                          for a in spec.aggregates)
+            exact = True
+        elif op.kind == 'compute':
+            try:
+                columns = check_columns(op.columns, fields, exact)
+            except ComputeError as e:
+                raise ComputeError(f"computeNode {op.node_ids[0]}: {e}")
+            op = PlanOp('compute', op.node_ids, op.node_type, columns=columns)
+        result.append(op)
+    return result
+
+
+# Rewrite rules; each returns the new pipeline and whether it changed anything
+
+def drop_noops(ops: List[PlanOp]) -> Tuple[List[PlanOp], bool]:
+    """Remove operators that pass rows through unchanged (their node ids ride along for profiling)"""
+    kept: List[PlanOp] = []
+    changed = False
+    for op in ops:
+        if op.kind == 'noop' and kept:
+            kept[-1].node_ids.extend(op.node_ids)
+            changed = True
+        elif op.kind == 'noop':
+            # Nothing upstream: a pipeline starting with a no-op produces no rows
+            kept.append(PlanOp('empty', op.node_ids, op.node_type))
+            changed = True
+        else:
+            kept.append(op)
+    return kept, changed
+
+
+def split_conjuncts(ops: List[PlanOp]) -> Tuple[List[PlanOp], bool]:
+    result: List[PlanOp] = []
+    changed = False
+    for op in ops:
+        parts = op.expression.conjuncts() if op.kind == 'filter' else None
+        if parts and len(parts) > 1:
+            result.extend(PlanOp('filter', op.node_ids, op.node_type, expression=part) for part in parts)
+            changed = True
+        else:
+            result.append(op)
+    return result, changed
+
+
+def push_filters_below_joins(ops: List[PlanOp]) -> Tuple[List[PlanOp], bool]:
+    """Move filters ahead of the join before them when the joined table cannot overwrite the filtered fields"""
+    ops = list(ops)
+    changed = False
+    for i in range(1, len(ops)):
+        if ops[i].kind != 'filter':
+            continue
+        # Filters commute with each other, so look past the ones in between
+        j = i - 1
+        while j > 0 and ops[j].kind == 'filter':
+            j -= 1
+        join = ops[j]
+        # Typed rows hold exactly the declared fields; JSON records may carry
+        # undeclared keys, so any field could be overwritten by the join
+        if join.kind != 'join' or join.table.storage_mode != typed_storage.STORAGE_TYPED:
+            continue
+        if not (ops[i].expression.fields & (join.table.field_names | {'id'})):
+            ops.insert(j, ops.pop(i))
+            changed = True
+    return ops, changed
+
+
+def fuse_top_n(ops: List[PlanOp]) -> Tuple[List[PlanOp], bool]:
+    result: List[PlanOp] = []
+    changed = False
+    for op in ops:
+        if op.kind == 'limit' and result and result[-1].kind == 'sort':
+            sort = result.pop()
+            result.append(PlanOp('topn', sort.node_ids + op.node_ids, sort.node_type,
+                                 keys=sort.keys, limit=op.limit, offset=op.offset))
+            changed = True
+        else:
+            result.append(op)
+    return result, changed
+
+
+REWRITE_RULES = [drop_noops, split_conjuncts, push_filters_below_joins, fuse_top_n]
+
+
+def required_fields(ops: List[PlanOp]) -> Optional[frozenset]:
+    """Fields the operators need from their input; None means every field (rows reach the output)"""
+    required: Optional[frozenset] = None
+    for op in reversed(ops):
+        if op.kind == 'aggregate':
+            spec = op.spec
+            required = frozenset(spec.group_by) | {a.field for a in spec.aggregates if a.field}
+        elif op.kind == 'webhook':
+            required = None
+        elif required is None:
+            continue
+        elif op.kind == 'filter':
+            required = required | op.expression.fields
+        elif op.kind == 'compute':
+            for column in reversed(op.columns):
+                required = (required - {column.name}) | column.expression.fields
+        elif op.kind in ('sort', 'topn'):
+            required = required | {k.field for k in op.keys}
+        elif op.kind in ('join', 'lookup_join', 'hash_join'):
+            # Fields the joined row lacks still come from the input, so none can be dropped here
+            required = required | {op.join_field}
+    return required
+
+
+# Physical plan
+
+def _push_op(scan: TableScan, op: PlanOp) -> bool:
+    node_id = op.node_ids[0]
+    if op.kind == 'filter':
+        return scan.push_filter(op.expression, node_id)
+    if op.kind == 'sort':
+        return scan.push_sort(op.keys, node_id)
+    if op.kind == 'limit':
+        return scan.push_limit(op.limit, op.offset, node_id)
+    if op.kind == 'topn':
+        return scan.push_sort(op.keys, node_id) and scan.push_limit(op.limit, op.offset, node_id)
+    if op.kind == 'aggregate':
+        return scan.push_aggregate(op.spec, node_id)
+    if op.kind == 'compute':
+        return scan.push_compute(op.columns, node_id)
+    return False
+
+
+def _constant(node: ast.AST) -> Tuple[bool, Any]:
+    if isinstance(node, ast.Constant):
+        return True, node.value
+    if isinstance(node, ast.Name) and node.id in CONSTANT_NAMES:
+        return True, CONSTANT_NAMES[node.id]
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub) and isinstance(node.operand, ast.Constant):
+        return True, -node.operand.value
+    return False, None
+
+
+_MIRRORED = {ast.Lt: ast.Gt, ast.LtE: ast.GtE, ast.Gt: ast.Lt, ast.GtE: ast.LtE}
+
+
+def selectivity(tree: ast.AST, field_stats: Dict[str, Dict[str, Any]]) -> float:
+    """Estimated fraction of rows passing a condition, from field statistics where it can tell"""
+    if isinstance(tree, ast.BoolOp):
+        parts = [selectivity(value, field_stats) for value in tree.values]
+        result = parts[0]
+        for part in parts[1:]:
+            result = result * part if isinstance(tree.op, ast.And) else result + part - result * part
+        return result
+    if isinstance(tree, ast.UnaryOp) and isinstance(tree.op, ast.Not):
+        return 1 - selectivity(tree.operand, field_stats)
+    if not (isinstance(tree, ast.Compare) and len(tree.ops) == 1):
+        return FILTER_SELECTIVITY
+    left, op, right = tree.left, type(tree.ops[0]), tree.comparators[0]
+    is_constant, value = _constant(right)
+    if not (isinstance(left, ast.Name) and is_constant):
+        is_constant, value = _constant(left)
+        left, op = right, _MIRRORED.get(op, op)
+    stats = field_stats.get(left.id) if isinstance(left, ast.Name) and is_constant else None
+    if not stats:
+        return FILTER_SELECTIVITY
+
+    nulls = stats.get('null_fraction') or 0.0
+    if value is None and op in (ast.Eq, ast.NotEq):
+        return nulls if op is ast.Eq else 1 - nulls
+    if op in (ast.Eq, ast.NotEq):
+        total = sum(top['count'] for top in stats.get('top_values', [])) or 1
+        rows = max(total, stats.get('rows') or total)
+        matches = [top['count'] for top in stats.get('top_values', []) if top['value'] == value]
+        if matches:
+            equal = matches[0] / rows
+        else:
+            equal = (1 - nulls) / max(1, stats.get('distinct') or 1)
+        return equal if op is ast.Eq else max(0.0, 1 - nulls - equal)
+    low, high = stats.get('min'), stats.get('max')
+    numeric = all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in (low, high, value))
+    if numeric and high > low:
+        below = min(1.0, max(0.0, (value - low) / (high - low)))
+        fraction = below if op in (ast.Lt, ast.LtE) else 1 - below
+        return fraction * (1 - nulls)
+    return FILTER_SELECTIVITY
+
+
+def _estimate(op: PlanOp, rows: float, field_stats: Dict[str, Dict[str, Any]]) -> float:
+    if op.kind == 'filter':
+        return rows * selectivity(op.expression.tree, field_stats)
+    if op.kind in ('limit', 'topn'):
+        return min(rows, op.limit)
+    if op.kind == 'aggregate':
+        if not op.spec.group_by:
+            return 1
+        groups = 1.0
+        for name in op.spec.group_by:
+            distinct = (field_stats.get(name) or {}).get('distinct')
+            groups *= distinct if distinct else max(1.0, rows / 10)
+        return max(1.0, min(rows, groups))
+    return rows
+
+
+def _field_stats(table: TableInfo) -> Dict[str, Dict[str, Any]]:
+    """Field summaries with the table's row count, which top value counts are relative to"""
+    return {name: {**summary, 'rows': table.row_count} for name, summary in (table.stats or {}).items()}
+
+
+class Planner:
+    def __init__(self, db):
+        self.db = db
+        self._row_counts: Dict[int, int] = {}
+        self.cached = False  # whether the last plan() came from the plan cache
+
+    def row_count(self, table: TableInfo) -> int:
+        if table.id not in self._row_counts:
+            self._row_counts[table.id] = table_row_count(self.db, table)
+        return self._row_counts[table.id]
+
+    def logical(self, nodes: List[Dict], edges: List[Dict], tables: Dict[str, TableInfo]) -> Tuple[List[List[PlanOp]], List[str]]:
+        node_map = {node['id']: node for node in nodes}
+        applied: List[str] = []
+        pipelines = []
+        for start in _start_nodes(nodes, edges):
+            ops = check_types([_logical_op(node, tables) for node in _chain(start['id'], node_map, edges)])
+            for rule in REWRITE_RULES:
+                ops, changed = rule(ops)
+                if changed and rule.__name__ not in applied:
+                    applied.append(rule.__name__)
+            pipelines.append(ops)
+        return pipelines, applied
+
+    def physical(self, ops: List[PlanOp], applied: List[str]) -> List[PlanOp]:
+        result: List[PlanOp] = []
+        rows = 0.0
+        field_stats: Dict[str, Dict[str, Any]] = {}
+        i = 0
+        if ops and ops[0].kind == 'scan':
+            table = ops[0].table
+            scan = TableScan(self.db, table)
+            node_ids = list(ops[0].node_ids)
+            i = 1
+            while i < len(ops) and _push_op(scan, ops[i]):
+                node_ids.extend(n for n in ops[i].node_ids if n not in node_ids)
+                i += 1
+            rows = float(self.row_count(table))
+            field_stats = _field_stats(table)
+            for op in ops[1:i]:
+                rows = _estimate(op, rows, field_stats)
+            projection = required_fields(ops[i:]) if scan.aggregate is None else None
+            if projection is not None:
+                scan.project(projection)
+                if 'prune_projection' not in applied:
+                    applied.append('prune_projection')
+            op = PlanOp('sql_scan', node_ids, 'tableNode', table=table, query=scan.compile())
+            op.folded = ops[1:i]
+            op.estimated_rows = rows
+            result.append(op)
+        elif ops and ops[0].kind == 'empty':
+            result.append(ops[0])
+            i = 1
+
+        while i < len(ops):
+            op = ops[i]
+            i += 1
+            if op.kind == 'filter':
+                # Consecutive Python filters run as one pass over the rows
+                filters = [op]
+                while i < len(ops) and ops[i].kind == 'filter':
+                    filters.append(ops[i])
+                    i += 1
+                node_ids = []
+                for f in filters:
+                    node_ids.extend(n for n in f.node_ids if n not in node_ids)
+                if len(filters) > 1 and 'merge_filters' not in applied:
+                    applied.append('merge_filters')
+                phys = PlanOp('filter', node_ids, op.node_type, expressions=[f.expression for f in filters])
+                for f in filters:
+                    rows = _estimate(f, rows, field_stats)
+            elif op.kind == 'join':
+                build_rows = self.row_count(op.table)
+                lookup = rows <= MAX_LOOKUP_KEYS and rows * LOOKUP_JOIN_RATIO < build_rows
+                phys = PlanOp('lookup_join' if lookup else 'hash_join', op.node_ids, op.node_type, table=op.table,
+                              join_field=op.join_field, target_field=op.target_field)
+                phys.params['build_rows'] = build_rows
+                field_stats = {**field_stats, **_field_stats(op.table)}
+            else:
+                phys = op
+                rows = _estimate(op, rows, field_stats)
+                if op.kind == 'aggregate':
+                    field_stats = {}
+            phys.estimated_rows = rows
+            result.append(phys)
+        return result
+
+    def plan(self, nodes: List[Dict], edges: List[Dict], version: Optional[Tuple] = None) -> CanvasPlan:
+        names = []
+        for node in nodes:
+            data = node.get('data', {}) or {}
+            if node.get('type') == 'tableNode':
+                names.append(data.get('tableName'))
+            elif node.get('type') == 'joinNode':
+                names.append(data.get('joinTable'))
+        tables = _load_tables(self.db, names)
+
+        key = _plan_key(nodes, edges, tables, version)
+        with _cache_lock:
+            cached = _cache.get(key)
+            if cached is not None:
+                _cache.move_to_end(key)
+        record_cache('plan', cached is not None)
+        self.cached = cached is not None
+        if cached is not None:
+            return cached
+
+        logical, applied = self.logical(nodes, edges, tables)
+        pipelines = [self.physical(ops, applied) for ops in logical]
+        _mark_shared(pipelines, applied)
+        plan = CanvasPlan(pipelines, applied)
+        with _cache_lock:
+            _cache[key] = plan
+            if len(_cache) > PLAN_CACHE_SIZE:
+                _cache.popitem(last=False)
+        return plan
+
+
+def _mark_shared(pipelines: List[List[PlanOp]], applied: List[str]):
+    """Common subexpression elimination: identical pipeline prefixes are computed once"""
+    seen: Dict[str, int] = {}
+    for pipeline in pipelines:
+        prefix = ''
+        for op in pipeline:
+            prefix = hashlib.sha1((prefix + '|' + op.identity()).encode()).hexdigest()
+            op.key = prefix
+            seen[prefix] = seen.get(prefix, 0) + 1
+    for pipeline in pipelines:
+        for op in pipeline:
+            if seen[op.key] > 1:
+                op.shared = True
+                if 'share_common_prefixes' not in applied:
+                    applied.append('share_common_prefixes')
+
+
+def _plan_key(nodes: List[Dict], edges: List[Dict], tables: Dict[str, TableInfo],
+              version: Optional[Tuple] = None) -> str:
+    if version is not None:
+        # A stored canvas' version changes with every edit, so its graph need not be hashed
+        graph = {'version': version}
+    else:
+        graph = {
+            'nodes': [{'id': n['id'], 'type': n.get('type'), 'data': n.get('data')} for n in nodes],
+            'edges': [{'source': e['source'], 'target': e['target']} for e in edges],
+        }
+    # Plans are redone when the schema changes or the table is analyzed again
+    graph['schema'] = sorted((t.id, t.name, t.storage_mode, t.fields, t.row_count, t.analyzed_at)
+                             for t in tables.values())
+    return hashlib.sha1(json.dumps(graph, sort_keys=True, default=str).encode()).hexdigest()
+
+
+# Plans are looked up from server threads and background jobs at once
+_cache: 'OrderedDict[str, CanvasPlan]' = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def delta_scan(db, op: PlanOp, record_ids: List[int]) -> CompiledScan:
+    """The query of a sql_scan restricted to some records; only valid for plans from delta_pipelines()"""
+    scan = TableScan(db, op.table)
+    scan.push_in('id', record_ids)
+    for folded in op.folded:
+        _push_op(scan, folded)
+    scan.project(op.query.projection)
+    return scan.compile()
+
+
+def plan_canvas(db, nodes: List[Dict], edges: List[Dict], version: Optional[Tuple] = None) -> CanvasPlan:
+    """Plan for a canvas, reused until the canvas or the schema of the tables it reads changes"""
+    return Planner(db).plan(nodes, edges, version)
+
+
+def invalidate():
+    with _cache_lock:
+        _cache.clear()
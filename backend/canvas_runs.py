@@ -0,0 +1,60 @@
+"""Helpers shared by background canvas runs (triggers.py, scheduler.py).
+
+They work on either an ORM session or a sqlite3 connection, like database.execute_sql.
+"""
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from database import execute_sql
+
+
+def load_json(value: Any) -> Any:
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def graph_version(canvas_id: int, version: Optional[int], created_at: Any) -> Optional[Tuple]:
+    """Plan cache key of a stored canvas' graph (see canvas_ops.py), None for canvases without a version.
+
+    created_at tells apart a canvas that got the id of a deleted one.
+    """
+    return None if version is None else (canvas_id, version, str(created_at))
+
+
+def load_canvas(conn, canvas_id: int) -> Optional[Tuple[List[Dict], List[Dict], Optional[Tuple]]]:
+    """(nodes, edges, graph version) of a canvas, None if it does not exist"""
+    row = execute_sql(conn, "SELECT nodes, edges, version, created_at FROM canvases "
+                            "WHERE id = :id AND deleted_at IS NULL", {'id': canvas_id}).fetchone()
+    if row is None:
+        return None
+    return load_json(row[0]) or [], load_json(row[1]) or [], graph_version(canvas_id, row[2], row[3])
+
+
+def next_view_number(conn, canvas_id: int) -> int:
+    """Sequence number for the next default view name of a canvas, from a counter on the canvas row"""
+    # Canvases from before the counter start from their current number of views
+    execute_sql(conn, "UPDATE canvases SET view_seq = COALESCE(view_seq, "
+                      "(SELECT COUNT(*) FROM views WHERE views.canvas_id = canvases.id)) + 1 WHERE id = :id",
+                {'id': canvas_id})
+    row = execute_sql(conn, "SELECT view_seq FROM canvases WHERE id = :id", {'id': canvas_id}).fetchone()
+    return row[0] if row and row[0] else 1
+
+
+def save_view(conn, canvas_id: int, name: Optional[str], data: List[Dict[str, Any]]) -> Optional[int]:
+    """Insert a view; name defaults to View_{canvas_id}_{n}"""
+    name = name or f"View_{canvas_id}_{next_view_number(conn, canvas_id)}"
+    payload = json.dumps(data, default=str)
+    result = execute_sql(conn, "INSERT INTO views (name, canvas_id, data, size_bytes) "
+                               "VALUES (:name, :canvas_id, :data, :size)",
+                         {'name': name, 'canvas_id': canvas_id, 'data': payload, 'size': len(payload)})
+    return getattr(result, 'lastrowid', None)
+
+
+def prune_views(conn, canvas_id: int, keep: int) -> int:
+    """Delete all but the newest keep views of a canvas; returns how many were deleted"""
+    if not keep or keep < 1:
+        return 0
+    result = execute_sql(conn, """
+        DELETE FROM views WHERE canvas_id = :canvas_id AND id < (
+            SELECT MIN(id) FROM (SELECT id FROM views WHERE canvas_id = :canvas_id ORDER BY id DESC LIMIT :keep) AS newest)
+    """, {'canvas_id': canvas_id, 'keep': keep})
+    return result.rowcount or 0
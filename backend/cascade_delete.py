@@ -0,0 +1,166 @@
+"""Deleting tables and canvases in the background.
+
+Deleting a table with millions of records in one statement holds the write
+lock for minutes (ON DELETE CASCADE or the ORM cascade in main.py, which
+also loads every record first). Instead, DELETE only marks the row
+(deleted_at) and returns; everything reading tables or canvases skips marked
+rows. A deleted table is also renamed (tombstone_name), so the lookups by
+name miss it at once and the name can be reused right away. Triggers and
+schedules of the deleted entity are removed at once, so they stop firing.
+
+A job (jobs.py) then deletes the rows belonging to it in id order,
+BATCH_SIZE rows per transaction with THROTTLE_MS between batches, removes
+the entity row itself and, on SQLite, returns the freed pages to the OS
+(view_retention.release_pages). Every batch only deletes what is left, so a
+cancelled or interrupted purge is simply started again: resume() runs on
+server start for rows still marked deleted, and for records whose table row
+is already gone (left behind when advanced_server deleted tables on
+connections without PRAGMA foreign_keys).
+"""
+import os
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional
+
+import change_feed
+from database import execute_sql
+import jobs
+import table_stats
+import typed_storage
+import view_retention
+
+BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "5000"))
+THROTTLE_MS = int(os.getenv("PURGE_THROTTLE_MS", "20"))
+
+
+def tombstone_name(name: str, table_id: int) -> str:
+    return f"{name}~deleted~{table_id}"
+
+
+def mark_table_deleted(conn, table_id: int) -> Optional[str]:
+    """Mark a table deleted; returns its name, None if there is no such (live) table"""
+    row = execute_sql(conn, "SELECT name FROM tables WHERE id = :id AND deleted_at IS NULL",
+                      {'id': table_id}).fetchone()
+    if not row:
+        return None
+    execute_sql(conn, "UPDATE tables SET deleted_at = CURRENT_TIMESTAMP, name = :tombstone WHERE id = :id",
+                {'id': table_id, 'tombstone': tombstone_name(row[0], table_id)})
+    execute_sql(conn, "DELETE FROM triggers WHERE table_name = :name", {'name': row[0]})
+    return row[0]
+
+
+def mark_canvas_deleted(conn, canvas_id: int) -> bool:
+    """Mark a canvas deleted; False if there is no such (live) canvas"""
+    marked = execute_sql(conn, "UPDATE canvases SET deleted_at = CURRENT_TIMESTAMP "
+                               "WHERE id = :id AND deleted_at IS NULL", {'id': canvas_id}).rowcount
+    if marked:
+        execute_sql(conn, "DELETE FROM triggers WHERE canvas_id = :id", {'id': canvas_id})
+        execute_sql(conn, "DELETE FROM schedules WHERE canvas_id = :id", {'id': canvas_id})
+    return bool(marked)
+
+
+def _delete_batches(conn, table: str, where: str, params: Dict[str, Any], key: str, job,
+                    progress: Dict[str, int], on_batch: Optional[Callable[[], None]] = None) -> bool:
+    """Delete the matching rows BATCH_SIZE at a time; False if the job was cancelled first"""
+    while not job.cancelled:
+        # Keyset batches on the owner's index; a batch ends at its largest key
+        upto, count = execute_sql(conn, f"SELECT MAX({key}), COUNT(*) FROM (SELECT {key} FROM {table} "
+                                        f"WHERE {where} ORDER BY {key} LIMIT :limit) batch",
+                                  {**params, 'limit': BATCH_SIZE}).fetchone()
+        if not count:
+            return True
+        execute_sql(conn, f"DELETE FROM {table} WHERE {where} AND {key} <= :upto", {**params, 'upto': upto})
+        conn.commit()
+        progress[table] = progress.get(table, 0) + count
+        job.update(**progress)
+        if on_batch:
+            on_batch()
+        if THROTTLE_MS > 0:
+            time.sleep(THROTTLE_MS / 1000)
+    return False
+
+
+def _release_pages(conn, progress: Dict[str, Any]):
+    # The rows are already gone: not getting the pages back must not fail the purge
+    try:
+        progress.update(view_retention.release_pages(conn))
+    except Exception as e:
+        traceback.print_exc()
+        progress['release_error'] = str(e)
+
+
+def purge_table(conn, table_id: int, job) -> Dict[str, Any]:
+    """Delete a marked table's records, typed mirror, fields and statistics, then the table row"""
+    progress: Dict[str, Any] = {'table_id': table_id}
+    row = execute_sql(conn, "SELECT storage_mode FROM tables WHERE id = :id", {'id': table_id}).fetchone()
+    if row and row[0] == typed_storage.STORAGE_TYPED:
+        mirror = typed_storage.typed_table_name(table_id)
+        if not _delete_batches(conn, mirror, "1 = 1", {}, typed_storage.quote_ident(typed_storage.RECORD_ID_COLUMN),
+                               job, progress):
+            return progress
+    if not _delete_batches(conn, 'records', "table_id = :table_id", {'table_id': table_id}, 'id', job, progress):
+        return progress
+    typed_storage.drop_typed_table(conn, table_id)
+    execute_sql(conn, "DELETE FROM fields WHERE table_id = :id", {'id': table_id})
+    table_stats.forget(conn, table_id)
+    execute_sql(conn, "DELETE FROM tables WHERE id = :id AND deleted_at IS NOT NULL", {'id': table_id})
+    conn.commit()
+    _release_pages(conn, progress)
+    return progress
+
+
+def purge_canvas(conn, canvas_id: int, job) -> Dict[str, Any]:
+    """Delete a marked canvas' views, then the canvas row"""
+    progress: Dict[str, Any] = {'canvas_id': canvas_id}
+    if not _delete_batches(conn, 'views', "canvas_id = :canvas_id", {'canvas_id': canvas_id}, 'id', job, progress,
+                           on_batch=lambda: change_feed.publish('view', 'delete', canvas_id=canvas_id)):
+        return progress
+    execute_sql(conn, "DELETE FROM triggers WHERE canvas_id = :id", {'id': canvas_id})
+    execute_sql(conn, "DELETE FROM schedules WHERE canvas_id = :id", {'id': canvas_id})
+    execute_sql(conn, "DELETE FROM canvases WHERE id = :id AND deleted_at IS NOT NULL", {'id': canvas_id})
+    conn.commit()
+    _release_pages(conn, progress)
+    return progress
+
+
+_PURGES = {'table': purge_table, 'canvas': purge_canvas}
+
+
+def start_purge(connect: Callable[[], Any], kind: str, entity_id: int) -> jobs.Job:
+    """Purge a marked table or canvas in a job, over a connection from connect()"""
+    def run(job):
+        conn = connect()
+        try:
+            return _PURGES[kind](conn, entity_id, job)
+        finally:
+            conn.close()
+
+    return jobs.submit('purge', run, entity=kind, id=entity_id)
+
+
+def pending(conn) -> List[tuple]:
+    """(kind, id) of everything still to purge"""
+    tables = execute_sql(conn, "SELECT id FROM tables WHERE deleted_at IS NOT NULL ORDER BY id").fetchall()
+    canvases = execute_sql(conn, "SELECT id FROM canvases WHERE deleted_at IS NOT NULL ORDER BY id").fetchall()
+    orphaned = execute_sql(conn, "SELECT DISTINCT table_id FROM records WHERE NOT EXISTS "
+                                 "(SELECT 1 FROM tables WHERE tables.id = records.table_id) ORDER BY table_id").fetchall()
+    return ([('table', row[0]) for row in tables] + [('table', row[0]) for row in orphaned] +
+            [('canvas', row[0]) for row in canvases])
+
+
+def resume(connect: Callable[[], Any]) -> jobs.Job:
+    """On server start: one job purging whatever earlier deletes left behind"""
+    def run(job):
+        conn = connect()
+        try:
+            done = []
+            for kind, entity_id in pending(conn):
+                if job.cancelled:
+                    break
+                _PURGES[kind](conn, entity_id, job)
+                done.append({'kind': kind, 'id': entity_id})
+            return {'purged': done}
+        finally:
+            conn.close()
+
+    return jobs.submit('purge', run, entity='all')
@@ -0,0 +1,226 @@
+"""Change feed pushed to clients as Server-Sent Events (GET /api/changes).
+
+Write paths publish an event for every committed change of records, tables,
+fields, canvases and views, so pages can apply deltas instead of polling
+full lists. Each event gets the next sequence number, and its SSE id is
+"<epoch>-<seq>". A client that reconnects with Last-Event-ID (EventSource
+does this by itself) resumes right after the last event it saw. If that is
+impossible, because the client fell more than CHANGE_FEED_SIZE events
+behind or its id is from another feed, the client gets a `reset` event and
+should refetch what it shows.
+
+Several server processes (uvicorn --workers, or main.py and a second
+instance on the same database) each see only their own writes, so once a
+server calls share() the events go through the change_events table instead:
+publish() inserts the event, whose autoincrement seq is the sequence number
+(on PostgreSQL under a table lock, so seq order is commit order and no
+reader skips a late commit), and a follower thread per process reads
+`seq > last seq` every POLL_SECONDS into the in-memory feed the streams
+read. Sequence numbers and the epoch are then the same in every process and
+survive restarts, so a client can reconnect to any worker. Rows older than
+the last CHANGE_FEED_SIZE events are deleted every PRUNE_EVERY events.
+Without share() (tests, scripts) the feed stays in memory.
+
+Record events carry the changed records when there are at most
+INLINE_RECORDS of them, else only their ids.
+"""
+import json
+import os
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from database import execute_sql, sql_dialect
+
+FEED_SIZE = int(os.getenv("CHANGE_FEED_SIZE") or 10000)
+INLINE_RECORDS = 100
+KEEPALIVE_SECONDS = 15.0
+POLL_SECONDS = 0.25  # how often async streams and the follower check for new events
+PRUNE_EVERY = 1000
+SHARED_EPOCH = 'db'
+
+
+class ChangeFeed:
+    def __init__(self, size: int = FEED_SIZE):
+        self.epoch = format(int(time.time() * 1000), 'x')
+        self.seq = 0
+        self.size = size
+        self._events = deque(maxlen=size)
+        self._changed = threading.Condition()
+        self._connect: Optional[Callable[[], Any]] = None
+        self._poke = threading.Event()
+
+    def share(self, connect: Callable[[], Any]):
+        """Keep events in the change_events table (over connections from connect()) and follow it"""
+        with self._changed:
+            if self._connect is not None:
+                return
+            self._connect = connect
+            self.epoch = SHARED_EPOCH
+            self._events.clear()
+            self.seq = 0
+        conn = connect()
+        try:
+            last = execute_sql(conn, "SELECT MAX(seq) FROM change_events").fetchone()[0] or 0
+        finally:
+            conn.close()
+        # Start with the newest events, so clients coming from another worker can resume
+        self._pull(max(0, last - self.size))
+        threading.Thread(target=self._follow, name='change-feed', daemon=True).start()
+
+    def publish(self, type: str, action: str, **payload) -> Dict[str, Any]:
+        if self._connect is not None:
+            return self._publish_shared({'type': type, 'action': action, **payload})
+        with self._changed:
+            self.seq += 1
+            event = {'seq': self.seq, 'type': type, 'action': action, **payload}
+            self._events.append(event)
+            self._changed.notify_all()
+        return event
+
+    def _publish_shared(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        # Called after the write committed: a failure here is logged, not raised into the request
+        conn = self._connect()
+        try:
+            if sql_dialect(conn) == 'postgresql':
+                execute_sql(conn, "LOCK TABLE change_events IN EXCLUSIVE MODE")
+            seq = execute_sql(conn, "INSERT INTO change_events (event) VALUES (:event) RETURNING seq",
+                              {'event': json.dumps(event, default=str)}).fetchone()[0]
+            if seq % PRUNE_EVERY == 0:
+                execute_sql(conn, "DELETE FROM change_events WHERE seq <= :upto", {'upto': seq - self.size})
+            conn.commit()
+        except Exception:
+            traceback.print_exc()
+            return event
+        finally:
+            conn.close()
+        self._poke.set()
+        return {'seq': seq, **event}
+
+    def _pull(self, after: Optional[int] = None):
+        """Append the events committed to change_events since the last one read"""
+        conn = self._connect()
+        try:
+            rows = execute_sql(conn, "SELECT seq, event FROM change_events WHERE seq > :seq ORDER BY seq",
+                               {'seq': self.seq if after is None else after}).fetchall()
+        finally:
+            conn.close()
+        if rows:
+            with self._changed:
+                for seq, event in rows:
+                    if seq > self.seq:
+                        self._events.append({'seq': seq, **json.loads(event)})
+                        self.seq = seq
+                self._changed.notify_all()
+
+    def _follow(self):
+        while True:
+            self._poke.wait(POLL_SECONDS)
+            self._poke.clear()
+            try:
+                self._pull()
+            except Exception:
+                traceback.print_exc()
+
+    def event_id(self, seq: int) -> str:
+        return f"{self.epoch}-{seq}"
+
+    def resume_from(self, last_event_id: Optional[str]) -> Optional[int]:
+        """Sequence number to continue after, or None when the client has to reset"""
+        if not last_event_id:
+            return self.seq
+        epoch, _, seq = last_event_id.partition('-')
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        if int(seq) > self.seq and self._connect is not None:
+            # Seen on another worker before this one's follower got there
+            self._pull()
+        if int(seq) > self.seq:
+            return None
+        return int(seq)
+
+    def since(self, seq: int) -> Optional[List[Dict[str, Any]]]:
+        """Events after seq, or None when some of them were already dropped"""
+        with self._changed:
+            if seq >= self.seq:
+                return []
+            if not self._events or self._events[0]['seq'] > seq + 1:
+                return None
+            return [event for event in self._events if event['seq'] > seq]
+
+    def wait(self, seq: int, timeout: float) -> Optional[List[Dict[str, Any]]]:
+        with self._changed:
+            self._changed.wait_for(lambda: self.seq > seq, timeout)
+        return self.since(seq)
+
+
+FEED = ChangeFeed()
+
+
+def share(connect: Callable[[], Any]):
+    """On server start, after the schema exists: share the feed with other processes on the database"""
+    FEED.share(connect)
+
+
+def publish(type: str, action: str, **payload) -> Dict[str, Any]:
+    return FEED.publish(type, action, **payload)
+
+
+def records_changed(table: str, action: str, ids: List[int], records: Optional[List[Dict[str, Any]]] = None):
+    """Event for inserted/updated/deleted records; records are the API dicts of the changed rows"""
+    payload = {'table': table, 'ids': ids}
+    if records is not None and len(records) <= INLINE_RECORDS:
+        payload['records'] = records
+    publish('record', action, **payload)
+
+
+def _message(event: str, event_id: str, data: Any) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def _messages(feed: ChangeFeed, seq: Optional[int], events: Optional[List[Dict[str, Any]]]):
+    """SSE text for a batch of events, and the sequence number to continue after"""
+    if seq is None or events is None:
+        current = feed.seq
+        return _message('reset', feed.event_id(current), {'seq': current}), current
+    if not events:
+        return '', seq
+    return ''.join(_message('change', feed.event_id(e['seq']), e) for e in events), events[-1]['seq']
+
+
+def stream(last_event_id: Optional[str] = None, feed: ChangeFeed = FEED) -> Iterator[str]:
+    """Blocking SSE stream, for a server with a thread per connection"""
+    seq = feed.resume_from(last_event_id)
+    # The retry hint makes EventSource reconnect quickly after a restart
+    yield "retry: 2000\n\n"
+    if seq is None:
+        text, seq = _messages(feed, None, None)
+        yield text
+    while True:
+        text, seq = _messages(feed, seq, feed.wait(seq, KEEPALIVE_SECONDS))
+        yield text or ": keepalive\n\n"
+
+
+async def astream(last_event_id: Optional[str] = None, is_disconnected=None, feed: ChangeFeed = FEED):
+    """SSE stream for the event loop: checks the feed every POLL_SECONDS instead of holding a thread"""
+    import asyncio
+
+    seq = feed.resume_from(last_event_id)
+    yield "retry: 2000\n\n"
+    if seq is None:
+        text, seq = _messages(feed, None, None)
+        yield text
+    idle = 0.0
+    while not (is_disconnected and await is_disconnected()):
+        text, seq = _messages(feed, seq, feed.since(seq))
+        if text:
+            idle = 0.0
+            yield text
+            continue
+        await asyncio.sleep(POLL_SECONDS)
+        idle += POLL_SECONDS
+        if idle >= KEEPALIVE_SECONDS:
+            idle = 0.0
+            yield ": keepalive\n\n"
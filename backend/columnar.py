@@ -0,0 +1,316 @@
+"""Vectorized evaluation of canvas expressions with NumPy (optional).
+
+Filters that the planner cannot push into SQL (conditions on joined fields,
+filters after an aggregate or a limit) run over the rows in Python. With
+NumPy installed, a filter over at least MIN_ROWS rows instead reads each
+field it uses into a column once: numbers (and booleans) become float64
+arrays, text becomes object arrays, each with a validity mask for missing
+values. The expression is then evaluated as whole-array operations into one
+boolean mask, and the matching rows are picked out as they are; rows are
+never rebuilt.
+
+The results are the same as the row-by-row functions in expressions.py:
+comparisons with a missing or non-numeric value are false, numeric text
+compares as a number against numbers, and arithmetic with a missing value
+or a division by zero is missing. A column mixing text and numbers (or
+holding lists/objects) is not vectorized, so the caller falls back to the
+row-by-row predicate.
+
+Computed columns (computeNode) are evaluated the same way when their
+result is a number or a boolean, and turned back into Python values once.
+
+COLUMNAR_EXECUTION=0 turns this off.
+"""
+import ast
+import itertools
+import operator
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from expressions import ARITH_OPS, COMPARE_OPS, CONSTANT_NAMES, Expression, compare_values, is_null_literal
+from typed_storage import coerce_value
+
+MIN_ROWS = 1000
+ENABLED = os.getenv("COLUMNAR_EXECUTION", "1") != "0"
+
+_NUMERIC_TYPES = (int, float, bool, type(None))
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def enabled() -> bool:
+    return ENABLED and _numpy() is not None
+
+
+class NotVectorizable(Exception):
+    """The expression or the data needs the row-by-row path"""
+
+
+class _Num:
+    """Numeric vector: values where valid, anything elsewhere"""
+
+    def __init__(self, values, valid):
+        self.values, self.valid = values, valid
+
+
+class _Text:
+    """Text vector: an object array of str ('' where not valid)"""
+
+    def __init__(self, values, valid):
+        self.values, self.valid = values, valid
+
+
+class _Const:
+    def __init__(self, value: Any):
+        self.value = value
+
+
+class Batch:
+    """Columns of a list of row dicts, read on first use"""
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self.np = _numpy()
+        self.rows = rows
+        self._columns: Dict[str, Any] = {}
+        self._numbers: Dict[int, _Num] = {}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def column(self, name: str):
+        if name not in self._columns:
+            self._columns[name] = self._read(name)
+        return self._columns[name]
+
+    def _read(self, name: str):
+        np = self.np
+        values = [row.get(name) for row in self.rows]
+        types = set(map(type, values))
+        has_none = type(None) in types
+        valid = np.array([v is not None for v in values], dtype=bool) if has_none else np.ones(len(values), bool)
+        if types <= set(_NUMERIC_TYPES):
+            column = np.array(values, dtype=np.float64)
+            if int in types and np.nanmax(np.abs(column), initial=0) > 2 ** 53:
+                raise NotVectorizable(f"{name}: integers beyond float precision")
+            return _Num(column, valid)
+        if types <= {str, type(None)}:
+            column = np.array(values, dtype=object)
+            if has_none:
+                column[~valid] = ''
+            return _Text(column, valid)
+        raise NotVectorizable(f"{name}: mixed or structured values")
+
+    def add_column(self, name: str, vector):
+        self._columns[name] = vector
+
+    def to_number(self, vector: _Text) -> _Num:
+        """Text parsed the way comparisons and arithmetic parse it; once per column"""
+        key = id(vector)
+        if key not in self._numbers:
+            np = self.np
+            parsed = [coerce_value('number', v) if ok else None for v, ok in zip(vector.values, vector.valid)]
+            valid = np.array([v is not None for v in parsed], dtype=bool)
+            self._numbers[key] = _Num(np.array([v if v is not None else 0 for v in parsed], dtype=np.float64), valid)
+        return self._numbers[key]
+
+
+def _const_number(value: Any) -> Optional[float]:
+    number = coerce_value('number', value) if value is not None else None
+    return None if number is None else float(number)
+
+
+class Evaluator:
+    """Evaluates one expression tree over a Batch"""
+
+    def __init__(self, batch: Batch):
+        self.batch = batch
+        self.np = batch.np
+
+    def mask(self, expression: Expression):
+        return self._truth(self._eval(expression.tree))
+
+    def evaluate(self, expression: Expression):
+        return self._eval(expression.tree)
+
+    def _full(self, value: bool):
+        return self.np.full(len(self.batch), value, dtype=bool)
+
+    def _truth(self, value):
+        """Truthiness of every element, like bool() in the row-by-row predicate"""
+        if isinstance(value, _Const):
+            return self._full(bool(value.value))
+        if isinstance(value, _Num):
+            with self.np.errstate(invalid='ignore'):
+                return value.valid & (value.values != 0)
+        if isinstance(value, _Text):
+            return value.valid & (value.values != '')
+        return value
+
+    def _number(self, value) -> Any:
+        """Operand in numeric context: a _Num, or a _Const holding a float or None"""
+        if isinstance(value, _Const):
+            return _Const(_const_number(value.value))
+        if isinstance(value, _Text):
+            return self.batch.to_number(value)
+        if isinstance(value, _Num):
+            return value
+        # A boolean mask used as a number
+        return _Num(value.astype(self.np.float64), self._full(True))
+
+    def _eval(self, node: ast.AST):
+        np = self.np
+        if isinstance(node, ast.Constant):
+            return _Const(node.value)
+        if isinstance(node, ast.Name):
+            if node.id in CONSTANT_NAMES:
+                return _Const(CONSTANT_NAMES[node.id])
+            return self.batch.column(node.id)
+        if isinstance(node, ast.BoolOp):
+            masks = [self._truth(self._eval(v)) for v in node.values]
+            combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            return combine.reduce(masks)
+        if isinstance(node, ast.UnaryOp):
+            operand = self._eval(node.operand)
+            if isinstance(node.op, ast.Not):
+                return ~self._truth(operand)
+            if isinstance(node.op, ast.USub):
+                return self._arith(operator.sub, _Const(0), operand)
+            return operand
+        if isinstance(node, ast.BinOp):
+            return self._arith(ARITH_OPS[type(node.op)], self._eval(node.left), self._eval(node.right))
+        if isinstance(node, ast.Compare):
+            nodes = [node.left] + list(node.comparators)
+            operands = [self._eval(n) for n in nodes]
+            result = self._full(True)
+            for i, op in enumerate(node.ops):
+                if is_null_literal(nodes[i]) or is_null_literal(nodes[i + 1]):
+                    result &= self._null_check(op, operands[i + 1] if is_null_literal(nodes[i]) else operands[i])
+                else:
+                    result &= self._compare(COMPARE_OPS[type(op)], operands[i], operands[i + 1])
+            return result
+        raise NotVectorizable(type(node).__name__)
+
+    def _null_check(self, op: ast.AST, value):
+        if not isinstance(op, (ast.Eq, ast.NotEq)):
+            return self._full(False)
+        if isinstance(value, _Const):
+            present = self._full(value.value is not None)
+        elif isinstance(value, (_Num, _Text)):
+            present = value.valid
+        else:
+            present = self._full(True)
+        return ~present if isinstance(op, ast.Eq) else present
+
+    def _arith(self, op: Callable, left, right):
+        np = self.np
+        left, right = self._number(left), self._number(right)
+        if isinstance(left, _Const) and isinstance(right, _Const):
+            if left.value is None or right.value is None:
+                return _Const(None)
+            try:
+                return _Const(op(left.value, right.value))
+            except ZeroDivisionError:
+                return _Const(None)
+        if (isinstance(left, _Const) and left.value is None) or (isinstance(right, _Const) and right.value is None):
+            return _Num(np.zeros(len(self.batch)), self._full(False))
+        values_l = left.value if isinstance(left, _Const) else left.values
+        values_r = right.value if isinstance(right, _Const) else right.values
+        valid = self._full(True)
+        for side in (left, right):
+            if isinstance(side, _Num):
+                valid = valid & side.valid
+        if op in (operator.truediv, operator.mod):
+            # Division by zero is missing, as in the row-by-row path
+            valid = valid & (np.asarray(values_r) != 0)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            values = op(values_l, values_r)
+        return _Num(np.broadcast_to(values, valid.shape), valid)
+
+    def _compare(self, op: Callable, left, right):
+        np = self.np
+        if isinstance(left, _Const) and isinstance(right, _Const):
+            return self._full(compare_values(op, left.value, right.value))
+        if any(isinstance(side, _Const) and side.value is None for side in (left, right)):
+            return self._full(False)
+        if not isinstance(left, (_Num, _Text, _Const)) or not isinstance(right, (_Num, _Text, _Const)):
+            left, right = self._number(left), self._number(right)
+        # Text against text compares as text; anything against a number compares numerically
+        textual = all(isinstance(side, _Text) or (isinstance(side, _Const) and isinstance(side.value, str))
+                      for side in (left, right))
+        if not textual:
+            left, right = self._number(left), self._number(right)
+            if any(isinstance(side, _Const) and side.value is None for side in (left, right)):
+                return self._full(False)
+        valid = self._full(True)
+        for side in (left, right):
+            if not isinstance(side, _Const):
+                valid = valid & side.valid
+        values_l = left.value if isinstance(left, _Const) else left.values
+        values_r = right.value if isinstance(right, _Const) else right.values
+        with np.errstate(invalid='ignore'):
+            return valid & np.asarray(op(values_l, values_r), dtype=bool)
+
+
+def filter_mask(expressions: List[Expression], rows: List[Dict[str, Any]]):
+    """Boolean mask of the rows passing every expression, None when they cannot be vectorized"""
+    if not enabled() or len(rows) < MIN_ROWS:
+        return None
+    batch = Batch(rows)
+    evaluator = Evaluator(batch)
+    try:
+        mask = evaluator.mask(expressions[0])
+        for expression in expressions[1:]:
+            mask &= evaluator.mask(expression)
+    except NotVectorizable:
+        return None
+    return mask
+
+
+def _values(evaluator: Evaluator, result) -> List[Any]:
+    """Python values of a number or boolean result, as the row-by-row functions return them"""
+    if isinstance(result, (_Text, _Const)):
+        raise NotVectorizable("not a number or boolean")
+    if not isinstance(result, _Num):
+        return result.tolist()
+    np = evaluator.np
+    values = np.where(result.valid, result.values, 0)
+    if np.any(np.abs(values) > 2 ** 53):
+        # Beyond float precision the row path's integer arithmetic is exact
+        raise NotVectorizable("result beyond float precision")
+    return [(int(v) if v.is_integer() else v) if ok else None
+            for v, ok in zip(values.tolist(), result.valid.tolist())]
+
+
+def column_values(columns: List[Tuple[str, Expression]], rows: List[Dict[str, Any]]) -> Optional[List[List[Any]]]:
+    """Values of computed columns for every row, None when they cannot be vectorized.
+
+    Later columns may use earlier ones, which are added to the batch as they are computed.
+    """
+    if not enabled() or len(rows) < MIN_ROWS:
+        return None
+    batch = Batch(rows)
+    evaluator = Evaluator(batch)
+    result = []
+    try:
+        for name, expression in columns:
+            tree = expression.tree
+            # Only operators whose row-by-row result is always a number/None or a bool
+            if not (isinstance(tree, (ast.BinOp, ast.Compare, ast.BoolOp)) or
+                    (isinstance(tree, ast.UnaryOp) and isinstance(tree.op, (ast.USub, ast.Not)))):
+                raise NotVectorizable(type(tree).__name__)
+            vector = evaluator.evaluate(expression)
+            result.append(_values(evaluator, vector))
+            batch.add_column(name, vector)
+    except NotVectorizable:
+        return None
+    return result
+
+
+def select(rows: List[Dict[str, Any]], mask) -> List[Dict[str, Any]]:
+    return list(itertools.compress(rows, mask.tolist()))
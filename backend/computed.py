@@ -0,0 +1,148 @@
+"""Computed columns for computeNode.
+
+Node data looks like:
+    {"columns": [{"name": "available", "expression": "stock - reserved"},
+                 {"name": "price_total", "expression": "price_rub * qty"}]}
+or, as the editor writes it, one "name = expression" per line:
+    {"columns": "available = stock - reserved\\nprice_total = price_rub * qty"}
+
+Expressions use the filter syntax (expressions.py) and are parsed once when
+the canvas is planned. Columns are added to every row in order, so a column
+can use the ones before it, and a column named like a stored field replaces
+it from that node on.
+
+The planner checks each expression against the fields its input has: a
+typed table's rows hold exactly the declared fields, so an unknown name is an
+error there (JSON records may carry undeclared keys, so any name is allowed),
+and arithmetic on a text field is an error everywhere. The inferred type of
+a column (number, boolean, text) decides how it is pushed into SQL
+(sql_pushdown.TableScan.push_compute) and how it is read back.
+"""
+import ast
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import columnar
+from expressions import CONSTANT_NAMES, Expression, ExpressionError, parse as parse_expression
+from typed_storage import read_value
+
+
+class ComputeError(ExpressionError):
+    """Raised for a computeNode column that cannot be parsed or has the wrong types"""
+
+
+class ComputedColumn(NamedTuple):
+    name: str
+    expression: Expression
+    type: str = 'any'  # number, boolean, text or any (unknown until run)
+
+
+# Field types as seen by expressions; relations hold record ids
+FIELD_TYPES = {'number': 'number', 'relation': 'number', 'text': 'text', 'select': 'text'}
+
+
+def _items(columns: Any) -> List[Dict[str, Any]]:
+    if isinstance(columns, str):
+        items = []
+        for line in columns.splitlines():
+            if line.strip():
+                name, _, expression = line.partition('=')
+                items.append({'name': name, 'expression': expression})
+        return items
+    return [item for item in columns or [] if isinstance(item, dict)]
+
+
+def parse_compute_spec(data: Dict[str, Any]) -> List[ComputedColumn]:
+    """Columns of computeNode data, empty if the node is not configured"""
+    items = _items(data.get('columns'))
+    if not items and data.get('name'):
+        items = [data]
+    columns = []
+    for item in items:
+        name = str(item.get('name') or '').strip()
+        source = str(item.get('expression') or '').strip()
+        if not name and not source:
+            continue
+        if not name.isidentifier() or name in CONSTANT_NAMES:
+            raise ComputeError(f"{name!r} is not a valid column name")
+        if not source:
+            raise ComputeError(f"{name}: expression is empty")
+        try:
+            columns.append(ComputedColumn(name, parse_expression(source)))
+        except ExpressionError as e:
+            raise ComputeError(f"{name}: {e}")
+    return columns
+
+
+def infer_type(node: ast.AST, fields: Dict[str, str], exact: bool) -> str:
+    """Type of an expression over rows with these fields; raises ComputeError on a type error"""
+    if isinstance(node, ast.Constant) or (isinstance(node, ast.Name) and node.id in CONSTANT_NAMES):
+        value = node.value if isinstance(node, ast.Constant) else CONSTANT_NAMES[node.id]
+        if value is None:
+            return 'any'
+        if isinstance(value, bool):
+            return 'boolean'
+        return 'number' if isinstance(value, (int, float)) else 'text'
+    if isinstance(node, ast.Name):
+        if node.id not in fields:
+            if exact:
+                raise ComputeError(f"unknown field {node.id!r}")
+            return 'any'
+        return fields[node.id]
+    if isinstance(node, (ast.BoolOp, ast.Compare)):
+        for child in (node.values if isinstance(node, ast.BoolOp) else [node.left] + list(node.comparators)):
+            infer_type(child, fields, exact)
+        return 'boolean'
+    if isinstance(node, ast.UnaryOp):
+        operand = infer_type(node.operand, fields, exact)
+        if isinstance(node.op, ast.Not):
+            return 'boolean'
+        if isinstance(node.op, ast.UAdd):
+            return operand
+        operands = [(node.operand, operand)]
+    elif isinstance(node, ast.BinOp):
+        operands = [(n, infer_type(n, fields, exact)) for n in (node.left, node.right)]
+    else:
+        raise ComputeError(f"unsupported syntax {type(node).__name__}")
+    for operand, operand_type in operands:
+        if operand_type == 'text':
+            raise ComputeError(f"{ast.unparse(operand)} is text, not a number")
+    return 'number'
+
+
+def check_columns(columns: List[ComputedColumn], fields: Dict[str, str], exact: bool) -> List[ComputedColumn]:
+    """Typed columns; fields is updated with them for the operators that follow"""
+    typed = []
+    for column in columns:
+        try:
+            column_type = infer_type(column.expression.tree, fields, exact)
+        except ComputeError as e:
+            raise ComputeError(f"{column.name}: {e}")
+        typed.append(column._replace(type=column_type))
+        fields[column.name] = column_type
+    return typed
+
+
+def output_value(column: ComputedColumn, value: Any) -> Any:
+    """A computed value as it appears in rows, the same from Python and from SQL"""
+    if column.type == 'number':
+        return read_value('number', value)
+    if column.type == 'boolean' and value is not None:
+        return bool(value)
+    return value
+
+
+def compute_rows(columns: List[ComputedColumn], rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Rows with the columns added; large inputs are evaluated a column at a time (see columnar.py)"""
+    values = columnar.column_values([(c.name, c.expression) for c in columns], rows)
+    if values is not None:
+        names = [c.name for c in columns]
+        return [{**row, **dict(zip(names, computed))} for row, computed in zip(rows, zip(*values))]
+
+    functions = [(column, column.expression.compile()) for column in columns]
+    result = []
+    for row in rows:
+        row = dict(row)
+        for column, fn in functions:
+            row[column.name] = output_value(column, fn(row))
+        result.append(row)
+    return result
@@ -1,18 +1,116 @@
-from sqlalchemy import create_engine, MetaData
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+import json
 import os
+import sqlite3
+import threading
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./psih_canvasdb.db")
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# engine, SessionLocal and Base are created on first access (see __getattr__), so
+# advanced_server, which only uses the raw SQL helpers below, never imports SQLAlchemy
+_SQLALCHEMY_NAMES = ('engine', 'SessionLocal', 'Base')
+_init_lock = threading.Lock()
 
-Base = declarative_base()
+def _sqlalchemy(name: str):
+    with _init_lock:
+        if name not in globals():
+            from sqlalchemy import create_engine
+            from sqlalchemy.ext.declarative import declarative_base
+            from sqlalchemy.orm import sessionmaker
+
+            engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+            globals().update(
+                engine=engine,
+                SessionLocal=sessionmaker(autocommit=False, autoflush=False, bind=engine),
+                Base=declarative_base(),
+            )
+    return globals()[name]
+
+def __getattr__(name):
+    if name in _SQLALCHEMY_NAMES:
+        return _sqlalchemy(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def get_db():
-    db = SessionLocal()
+    db = _sqlalchemy('SessionLocal')()
     try:
         yield db
     finally:
         db.close()
+
+def add_missing_columns(bind, table_name: str, columns: dict):
+    """Add columns introduced after a table was first created (create_all never alters tables)"""
+    from sqlalchemy import inspect, text
+    existing = {col['name'] for col in inspect(bind).get_columns(table_name)}
+    with bind.begin() as conn:
+        for name, ddl in columns.items():
+            if name not in existing:
+                conn.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {name} {ddl}'))
+
+def add_missing_index(bind, index_name: str, table_name: str, columns: str):
+    """Create an index declared after a table was first created"""
+    from sqlalchemy import text
+    with bind.begin() as conn:
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} ({columns})'))
+
+def _is_sqlite3(conn) -> bool:
+    return isinstance(conn, (sqlite3.Connection, sqlite3.Cursor))
+
+def execute_sql(conn, sql: str, params=None):
+    """Run raw SQL on either an ORM session or a sqlite3 connection/cursor.
+
+    Statements use named ``:param`` placeholders, which both SQLAlchemy text()
+    and sqlite3 understand, so helpers can be shared by main.py and advanced_server.
+    """
+    if _is_sqlite3(conn):
+        return conn.execute(sql, params or {})
+    from sqlalchemy import text
+    return conn.execute(text(sql), params or {})
+
+def sqlite_connection(conn) -> sqlite3.Connection:
+    """The sqlite3 connection behind a sqlite3 connection/cursor or an ORM session on SQLite"""
+    if isinstance(conn, sqlite3.Connection):
+        return conn
+    if isinstance(conn, sqlite3.Cursor):
+        return conn.connection
+    return conn.connection().connection.connection
+
+def sql_dialect(conn) -> str:
+    """Name of the database dialect behind conn ('sqlite', 'postgresql', ...)"""
+    if _is_sqlite3(conn) or not hasattr(conn, 'get_bind'):
+        return 'sqlite'
+    return conn.get_bind().dialect.name
+
+def json_field_sql(conn, column: str, field: str, param: str):
+    """SQL expression reading a top-level key of a JSON column, plus its bind params"""
+    if sql_dialect(conn) == 'postgresql':
+        return f"({column}::jsonb ->> :{param})", {param: field}
+    return f"json_extract({column}, :{param})", {param: '$."' + field + '"'}
+
+def json_merge_sql(conn, column: str, patch: dict, prefix: str = 'merge'):
+    """SQL expression applying a merge patch to the top-level keys of a JSON column, plus its bind params.
+
+    Keys set to None are removed, the others replace their value, so one UPDATE
+    changes only the patched keys instead of rewriting the document from Python.
+    """
+    values = {key: value for key, value in patch.items() if value is not None}
+    removed = [key for key, value in patch.items() if value is None]
+    if sql_dialect(conn) == 'postgresql':
+        params = {prefix: json.dumps(values)}
+        sql = f"COALESCE({column}::jsonb, '{{}}'::jsonb) || CAST(:{prefix} AS jsonb)"
+        for i, key in enumerate(removed):
+            sql += f" - :{prefix}_r{i}"
+            params[f'{prefix}_r{i}'] = key
+        return f"({sql})::json", params
+    params, sets, paths = {}, [], []
+    for i, (key, value) in enumerate(values.items()):
+        sets.append(f":{prefix}_p{i}, json(:{prefix}_v{i})")
+        params.update({f'{prefix}_p{i}': '$."' + key + '"', f'{prefix}_v{i}': json.dumps(value)})
+    for i, key in enumerate(removed):
+        paths.append(f":{prefix}_r{i}")
+        params[f'{prefix}_r{i}'] = '$."' + key + '"'
+    sql = f"COALESCE({column}, '{{}}')"
+    if sets:
+        sql = f"json_set({sql}, {', '.join(sets)})"
+    if paths:
+        sql = f"json_remove({sql}, {', '.join(paths)})"
+    return sql, params
@@ -0,0 +1,307 @@
+"""Parsing and compilation of canvas expressions.
+
+Filter conditions such as ``available > 0 and status = 'active'`` are parsed
+once into a Python AST restricted to comparisons, boolean logic, arithmetic,
+field names and literals. The tree is then compiled either to a Python
+function over a row dict or to a SQL fragment for pushdown.
+
+Comparisons follow SQL semantics: anything compared with a missing value or
+with an incompatible type is false rather than an error.
+"""
+import ast
+import operator
+import re
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set
+
+from profiling import record_cache
+from typed_storage import coerce_value
+
+
+class ExpressionError(ValueError):
+    """Raised for expressions outside the supported subset"""
+
+
+CONSTANT_NAMES = {'true': True, 'false': False, 'null': None, 'True': True, 'False': False, 'None': None}
+
+COMPARE_OPS = {
+    ast.Eq: operator.eq, ast.NotEq: operator.ne,
+    ast.Lt: operator.lt, ast.LtE: operator.le,
+    ast.Gt: operator.gt, ast.GtE: operator.ge,
+}
+_COMPARE_SQL = {ast.Eq: '=', ast.NotEq: '<>', ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>='}
+ARITH_OPS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+    ast.Div: operator.truediv, ast.Mod: operator.mod,
+}
+_ARITH_SQL = {ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/', ast.Mod: '%'}
+
+_STRING_RE = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")")
+_KEYWORD_RE = re.compile(r'\b(AND|OR|NOT)\b')
+_SINGLE_EQ_RE = re.compile(r'(?<![<>!=])=(?!=)')
+
+
+def normalize(source: str) -> str:
+    """Translate SQL-ish spellings (=, <>, AND/OR/NOT) to Python outside string literals"""
+    parts = _STRING_RE.split(source)
+    for i in range(0, len(parts), 2):
+        part = _KEYWORD_RE.sub(lambda m: m.group(1).lower(), parts[i])
+        part = part.replace('<>', '!=')
+        parts[i] = _SINGLE_EQ_RE.sub('==', part)
+    return ''.join(parts)
+
+
+class SqlOperand(NamedTuple):
+    """One side of a comparison, handed to the query builder's compare_sql"""
+    kind: str  # 'field' (value: its name), 'literal' (value: the Python constant), 'number' (value: SQL arithmetic)
+    value: Any
+
+
+class Expression:
+    """A parsed expression; compile once and reuse for every row"""
+
+    def __init__(self, source: str, tree: Optional[ast.AST] = None):
+        self.source = source
+        if tree is None:
+            try:
+                tree = ast.parse(normalize(source.strip()), mode='eval').body
+            except SyntaxError as e:
+                raise ExpressionError(f"Invalid expression {source!r}: {e.msg}")
+        self.tree = tree
+        self._check(self.tree)
+
+    def _check(self, node: ast.AST):
+        allowed = (ast.Compare, ast.BoolOp, ast.UnaryOp, ast.BinOp, ast.Name, ast.Constant,
+                   ast.And, ast.Or, ast.Not, ast.USub, ast.UAdd, ast.Load) + \
+            tuple(COMPARE_OPS) + tuple(ARITH_OPS)
+        for child in ast.walk(node):
+            if not isinstance(child, allowed):
+                raise ExpressionError(f"Unsupported syntax in {self.source!r}: {type(child).__name__}")
+
+    @property
+    def fields(self) -> Set[str]:
+        return {n.id for n in ast.walk(self.tree) if isinstance(n, ast.Name) and n.id not in CONSTANT_NAMES}
+
+    @property
+    def key(self) -> str:
+        """Structural identity, equal for expressions that only differ in spelling"""
+        return ast.dump(self.tree)
+
+    def conjuncts(self) -> List['Expression']:
+        """Split a top-level "a and b and c" into its parts"""
+        if isinstance(self.tree, ast.BoolOp) and isinstance(self.tree.op, ast.And):
+            return [Expression(ast.unparse(value), value) for value in self.tree.values]
+        return [self]
+
+    # Python compilation
+
+    def compile(self) -> Callable[[Dict[str, Any]], Any]:
+        return _compile(self.tree)
+
+    def predicate(self) -> Callable[[Dict[str, Any]], bool]:
+        fn = self.compile()
+        return lambda row: bool(fn(row))
+
+    # SQL compilation; field_sql(name, numeric), bind(value) and compare_sql(op, left, right) come from
+    # the caller's query builder, which knows how values are stored and so how to compare them like
+    # compare_values does
+
+    def to_sql(self, field_sql: Callable[[str, bool], str], bind: Callable[[Any], str],
+               compare_sql: Callable[[str, SqlOperand, SqlOperand], str]) -> str:
+        """SQL boolean condition; raises ExpressionError if the expression is not a predicate
+        or a comparison in it cannot be done in SQL with the same result"""
+        if not _is_predicate(self.tree):
+            raise ExpressionError(f"{self.source!r} is not a condition")
+        return _to_sql(self.tree, field_sql, bind, numeric=False, compare_sql=compare_sql)
+
+    def value_sql(self, field_sql: Callable[[str, bool], str], bind: Callable[[Any], str]) -> str:
+        """SQL number for arithmetic over fields and numbers; raises ExpressionError for anything else"""
+        if not isinstance(self.tree, (ast.BinOp, ast.UnaryOp)) or not _is_arithmetic(self.tree):
+            raise ExpressionError(f"{self.source!r} is not arithmetic")
+        return _to_sql(self.tree, field_sql, bind, numeric=True)
+
+
+def _numeric_pair(left: Any, right: Any):
+    # Numeric strings compare as numbers against numbers, as they would after validation
+    if isinstance(left, (int, float)) and isinstance(right, str):
+        return left, coerce_value('number', right)
+    if isinstance(right, (int, float)) and isinstance(left, str):
+        return coerce_value('number', left), right
+    return left, right
+
+
+def compare_values(op, left: Any, right: Any) -> bool:
+    if left is None or right is None:
+        return False
+    left, right = _numeric_pair(left, right)
+    if left is None or right is None:
+        return False
+    try:
+        return op(left, right)
+    except TypeError:
+        return False
+
+
+def _arith(op, left: Any, right: Any) -> Any:
+    if left is None or right is None:
+        return None
+    left, right = coerce_value('number', left), coerce_value('number', right)
+    if left is None or right is None:
+        return None
+    try:
+        return op(left, right)
+    except ZeroDivisionError:
+        return None
+
+
+def _compile(node: ast.AST) -> Callable[[Dict[str, Any]], Any]:
+    if isinstance(node, ast.Constant):
+        value = node.value
+        return lambda row: value
+    if isinstance(node, ast.Name):
+        if node.id in CONSTANT_NAMES:
+            value = CONSTANT_NAMES[node.id]
+            return lambda row: value
+        name = node.id
+        return lambda row: row.get(name)
+    if isinstance(node, ast.BoolOp):
+        parts = [_compile(v) for v in node.values]
+        if isinstance(node.op, ast.And):
+            return lambda row: all(p(row) for p in parts)
+        return lambda row: any(p(row) for p in parts)
+    if isinstance(node, ast.UnaryOp):
+        operand = _compile(node.operand)
+        if isinstance(node.op, ast.Not):
+            return lambda row: not operand(row)
+        if isinstance(node.op, ast.USub):
+            return lambda row: _arith(operator.sub, 0, operand(row))
+        return operand
+    if isinstance(node, ast.BinOp):
+        op = ARITH_OPS[type(node.op)]
+        left, right = _compile(node.left), _compile(node.right)
+        return lambda row: _arith(op, left(row), right(row))
+    if isinstance(node, ast.Compare):
+        nodes = [node.left] + list(node.comparators)
+        operands = [_compile(n) for n in nodes]
+        checks = []
+        for i, op in enumerate(node.ops):
+            if is_null_literal(nodes[i]) or is_null_literal(nodes[i + 1]):
+                # "x = null" / "x != null" test for presence, like IS [NOT] NULL
+                other = operands[i + 1] if is_null_literal(nodes[i]) else operands[i]
+                if isinstance(op, ast.Eq):
+                    checks.append(lambda values, row, other=other: other(row) is None)
+                elif isinstance(op, ast.NotEq):
+                    checks.append(lambda values, row, other=other: other(row) is not None)
+                else:
+                    checks.append(lambda values, row: False)
+            else:
+                fn = COMPARE_OPS[type(op)]
+                checks.append(lambda values, row, i=i, fn=fn: compare_values(fn, values[i], values[i + 1]))
+
+        def compare(row):
+            values = [o(row) for o in operands]
+            return all(check(values, row) for check in checks)
+        return compare
+    raise ExpressionError(f"Unsupported syntax: {type(node).__name__}")
+
+
+def is_null_literal(node: ast.AST) -> bool:
+    return (isinstance(node, ast.Constant) and node.value is None) or \
+        (isinstance(node, ast.Name) and node.id in CONSTANT_NAMES and CONSTANT_NAMES[node.id] is None)
+
+
+def _is_predicate(node: ast.AST) -> bool:
+    if isinstance(node, ast.Compare):
+        return True
+    if isinstance(node, ast.BoolOp):
+        return all(_is_predicate(v) for v in node.values)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        return _is_predicate(node.operand)
+    return False
+
+
+def _is_arithmetic(node: ast.AST) -> bool:
+    # Conditions inside arithmetic are false in Python where SQL gives NULL, so they stay out
+    if isinstance(node, ast.BinOp):
+        # SQL % truncates to integers and keeps the dividend's sign, Python's % does neither
+        return not isinstance(node.op, ast.Mod) and _is_arithmetic(node.left) and _is_arithmetic(node.right)
+    if isinstance(node, ast.UnaryOp):
+        return isinstance(node.op, (ast.USub, ast.UAdd)) and _is_arithmetic(node.operand)
+    if isinstance(node, ast.Constant):
+        return not isinstance(node.value, str)
+    return isinstance(node, ast.Name)
+
+
+def _operand(node: ast.AST, field_sql, bind) -> SqlOperand:
+    if isinstance(node, ast.Constant):
+        return SqlOperand('literal', node.value)
+    if isinstance(node, ast.Name):
+        if node.id in CONSTANT_NAMES:
+            return SqlOperand('literal', CONSTANT_NAMES[node.id])
+        return SqlOperand('field', node.id)
+    if _is_arithmetic(node):
+        return SqlOperand('number', _to_sql(node, field_sql, bind, True))
+    # A condition compared with something is a bool in Python and has no SQL equivalent here
+    raise ExpressionError(f"Unsupported comparison operand: {type(node).__name__}")
+
+
+def _to_sql(node: ast.AST, field_sql, bind, numeric: bool, compare_sql=None) -> str:
+    if isinstance(node, ast.Constant):
+        if node.value is None:
+            return 'NULL'
+        value = int(node.value) if isinstance(node.value, bool) else node.value
+        return bind(value)
+    if isinstance(node, ast.Name):
+        if node.id in CONSTANT_NAMES:
+            value = CONSTANT_NAMES[node.id]
+            return 'NULL' if value is None else bind(int(value))
+        return field_sql(node.id, numeric)
+    if isinstance(node, ast.BoolOp):
+        joiner = ' AND ' if isinstance(node.op, ast.And) else ' OR '
+        return '(' + joiner.join(_to_sql(v, field_sql, bind, False, compare_sql) for v in node.values) + ')'
+    if isinstance(node, ast.UnaryOp):
+        operand = _to_sql(node.operand, field_sql, bind, not isinstance(node.op, ast.Not), compare_sql)
+        if isinstance(node.op, ast.Not):
+            # NOT over an unknown (NULL) comparison is true in Python, so make it false first
+            return f"(NOT COALESCE({operand}, 1 = 0))"
+        return f"(-{operand})" if isinstance(node.op, ast.USub) else operand
+    if isinstance(node, ast.BinOp):
+        left = _to_sql(node.left, field_sql, bind, True)
+        right = _to_sql(node.right, field_sql, bind, True)
+        if isinstance(node.op, ast.Div):
+            # Match Python's true division and NULL on division by zero
+            return f"(({left}) * 1.0 / NULLIF({right}, 0))"
+        return f"({left} {_ARITH_SQL[type(node.op)]} {right})"
+    if isinstance(node, ast.Compare):
+        operands = [node.left] + list(node.comparators)
+        parts: List[str] = []
+        for i, op in enumerate(node.ops):
+            left, right = operands[i], operands[i + 1]
+            if is_null_literal(right) or is_null_literal(left):
+                other = left if is_null_literal(right) else right
+                if type(op) not in (ast.Eq, ast.NotEq):
+                    parts.append('(1 = 0)')
+                    continue
+                is_null = 'IS NULL' if isinstance(op, ast.Eq) else 'IS NOT NULL'
+                parts.append(f"({_to_sql(other, field_sql, bind, False)} {is_null})")
+                continue
+            if compare_sql is None:
+                raise ExpressionError("Comparisons need the query builder's compare_sql")
+            parts.append(compare_sql(_COMPARE_SQL[type(op)], _operand(left, field_sql, bind),
+                                     _operand(right, field_sql, bind)))
+        return parts[0] if len(parts) == 1 else '(' + ' AND '.join(parts) + ')'
+    raise ExpressionError(f"Unsupported syntax: {type(node).__name__}")
+
+
+_cache: Dict[str, Expression] = {}
+
+
+def parse(source: str) -> Expression:
+    """Parse an expression, reusing the compiled tree for repeated sources"""
+    expression = _cache.get(source)
+    record_cache('expression', expression is not None)
+    if expression is None:
+        expression = Expression(source)
+        if len(_cache) > 1024:
+            _cache.clear()
+        _cache[source] = expression
+    return expression
@@ -0,0 +1,171 @@
+"""Online field changes: existing records are rewritten by a background job.
+
+Deleting, renaming or adding a field (or giving it a default) changes the
+fields row at once, but records.data of existing records is rewritten by a
+job (jobs.py): in id order, chunk_size records per transaction, sleeping
+throttle_ms between chunks so the API's own writes get the database. Every
+chunk is one UPDATE with JSON functions that only touches the records still
+needing the change, so a cancelled migration can simply be started again.
+
+- drop: the key is removed from every record (stale keys are otherwise read,
+  sent and stored forever)
+- rename: the value moves to the new key; until the job reaches a record it
+  still has the old key
+- backfill: records without the key get the field's default; for typed
+  tables the chunk is also copied into the mirror column added by
+  typed_storage.sync_schema (renames and drops are ALTERs on the mirror)
+
+Migrations of one table run one after another in the order they were
+started, so a rename followed by a drop of the new name cannot interleave.
+"""
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from database import execute_sql, sql_dialect
+import table_stats
+import typed_storage
+
+CHUNK_SIZE = 1000
+MAX_CHUNK_SIZE = 50000
+THROTTLE_MS = int(os.getenv("FIELD_MIGRATION_THROTTLE_MS", "20"))
+
+OPS = ('drop', 'rename', 'backfill')
+
+
+class FieldMigrationError(ValueError):
+    """Raised for a field change that cannot be made"""
+
+
+def check_name(name: Any, existing) -> str:
+    """A new field name: a non-empty identifier not used by another field of the table"""
+    name = str(name or '').strip()
+    if not name.isidentifier():
+        raise FieldMigrationError(f"{name!r} is not a valid field name")
+    if name in existing:
+        raise FieldMigrationError(f"Field {name!r} already exists")
+    return name
+
+
+# Per-table turns: a migration waits until the ones started before it on the same table finished
+_turns = threading.Condition()
+_next_turn: Dict[int, int] = {}
+_serving: Dict[int, int] = {}
+
+
+def take_turn(table_id: int) -> int:
+    """Called when the migration is started (in request order)"""
+    with _turns:
+        turn = _next_turn.get(table_id, 0)
+        _next_turn[table_id] = turn + 1
+        return turn
+
+
+def _wait_turn(table_id: int, turn: int, job):
+    with _turns:
+        while _serving.get(table_id, 0) != turn:
+            job.update(waiting=True)
+            _turns.wait(1.0)
+    job.update(waiting=False)
+
+
+def _end_turn(table_id: int):
+    with _turns:
+        _serving[table_id] = _serving.get(table_id, 0) + 1
+        _turns.notify_all()
+
+
+def _path(name: str) -> str:
+    return '$."' + name + '"'
+
+
+def _update_sql(dialect: str, op: str) -> str:
+    """UPDATE of the records in one chunk that still need the change"""
+    chunk = "table_id = :table_id AND id > :after_id AND id <= :upto_id"
+    if dialect == 'postgresql':
+        if op == 'drop':
+            return f"UPDATE records SET data = (data::jsonb - :name)::json WHERE {chunk} AND data::jsonb -> :name IS NOT NULL"
+        if op == 'rename':
+            return (f"UPDATE records SET data = ((data::jsonb - :name) || "
+                    f"jsonb_build_object(CAST(:new_name AS text), data::jsonb -> :name))::json "
+                    f"WHERE {chunk} AND data::jsonb -> :name IS NOT NULL")
+        return (f"UPDATE records SET data = (COALESCE(data::jsonb, '{{}}'::jsonb) || "
+                f"jsonb_build_object(CAST(:name AS text), CAST(:value AS jsonb)))::json "
+                f"WHERE {chunk} AND (data::jsonb -> :name) IS NULL")
+    if op == 'drop':
+        return f"UPDATE records SET data = json_remove(data, :path) WHERE {chunk} AND json_type(data, :path) IS NOT NULL"
+    if op == 'rename':
+        # json_extract turns true/false into 1/0, so those are re-created as JSON
+        value = ("CASE json_type(data, :path) WHEN 'true' THEN json('true') WHEN 'false' THEN json('false') "
+                 "ELSE json_extract(data, :path) END")
+        return (f"UPDATE records SET data = json_remove(json_set(data, :new_path, {value}), :path) "
+                f"WHERE {chunk} AND json_type(data, :path) IS NOT NULL")
+    return (f"UPDATE records SET data = json_set(COALESCE(data, '{{}}'), :path, json(:value)) "
+            f"WHERE {chunk} AND json_type(data, :path) IS NULL")
+
+
+def _typed_fields(conn, table_id: int) -> Optional[typed_storage.FieldSpec]:
+    """Mirror columns as they are now (a later field change may already have altered them), None for JSON tables"""
+    row = execute_sql(conn, "SELECT storage_mode FROM tables WHERE id = :id", {'id': table_id}).fetchone()
+    if not row or row[0] != typed_storage.STORAGE_TYPED:
+        return None
+    rows = execute_sql(conn, "SELECT name, field_type FROM fields WHERE table_id = :id ORDER BY id",
+                       {'id': table_id}).fetchall()
+    return typed_storage.field_specs({'name': r[0], 'field_type': r[1]} for r in rows)
+
+
+def migrate_records(conn, table_id: int, op: str, name: str, job, new_name: Optional[str] = None,
+                    default: Any = None, chunk_size: int = CHUNK_SIZE, throttle_ms: int = THROTTLE_MS) -> Dict[str, Any]:
+    """Rewrite the table's records chunk by chunk; returns the final progress.
+
+    For backfill, default is the (validated) value for records without the
+    key, None to only copy the column into the typed mirror.
+    """
+    if op not in OPS:
+        raise FieldMigrationError(f"Unknown field migration: {op}")
+    chunk_size = max(1, min(chunk_size, MAX_CHUNK_SIZE))
+    typed_fields = _typed_fields(conn, table_id) if op == 'backfill' else None
+    sql = None if op == 'backfill' and default is None else _update_sql(sql_dialect(conn), op)
+    params = {'table_id': table_id, 'name': name, 'path': _path(name), 'new_name': new_name,
+              'new_path': _path(new_name or ''), 'value': json.dumps(default)}
+    total = execute_sql(conn, "SELECT COUNT(*) FROM records WHERE table_id = :table_id",
+                        {'table_id': table_id}).fetchone()[0]
+    progress = {'total': total, 'scanned': 0, 'updated': 0, 'last_id': 0}
+    job.update(**progress)
+    while not job.cancelled:
+        # Keyset pagination on the (table_id, id) index; the chunk ends at its largest id
+        upto_id, count = execute_sql(conn, "SELECT MAX(id), COUNT(*) FROM (SELECT id FROM records "
+                                           "WHERE table_id = :table_id AND id > :after_id ORDER BY id LIMIT :limit) chunk",
+                                     {'table_id': table_id, 'after_id': progress['last_id'],
+                                      'limit': chunk_size}).fetchone()
+        if not count:
+            break
+        chunk = {**params, 'after_id': progress['last_id'], 'upto_id': upto_id}
+        updated = execute_sql(conn, sql, chunk).rowcount if sql else 0
+        if op == 'backfill' and typed_fields is not None:
+            typed_storage.backfill(conn, table_id, typed_fields, progress['last_id'], upto_id)
+        conn.commit()
+        progress.update(scanned=progress['scanned'] + count, updated=progress['updated'] + updated, last_id=upto_id)
+        job.update(**progress)
+        if throttle_ms > 0:
+            time.sleep(throttle_ms / 1000)
+    if progress['updated']:
+        table_stats.record_writes(conn, table_id, changed=progress['updated'])
+    return progress
+
+
+def run_migration(connect, table_id: int, turn: int, op: str, name: str, job, **kwargs) -> Dict[str, Any]:
+    """Job body: wait for the table's earlier migrations, then migrate over a connection from connect()"""
+    _wait_turn(table_id, turn, job)
+    try:
+        if job.cancelled:
+            return {}
+        conn = connect()
+        try:
+            return migrate_records(conn, table_id, op, name, job, **kwargs)
+        finally:
+            conn.close()
+    finally:
+        _end_turn(table_id)
@@ -0,0 +1,93 @@
+"""Background jobs for requests that run for minutes (record imports, ...).
+
+The request starts a job and returns its id right away; the work runs in a
+daemon thread and reports progress, which clients poll with GET /api/jobs/{id}.
+A job can be cancelled with DELETE /api/jobs/{id}: the work checks
+job.cancelled between steps and stops at the next one.
+
+Jobs live in the memory of the server process that started them, so they are
+lost on restart. The newest MAX_JOBS are kept; running jobs are never dropped.
+"""
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+MAX_JOBS = 100
+RUNNING, DONE, FAILED, CANCELLED = 'running', 'done', 'failed', 'cancelled'
+
+
+class Job:
+    def __init__(self, kind: str, info: Dict[str, Any]):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.info = info
+        self.status = RUNNING
+        self.progress: Dict[str, Any] = {}
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def update(self, **progress):
+        with self._lock:
+            self.progress.update(progress)
+
+    def finish(self, status: str, result: Any = None, error: Optional[str] = None):
+        with self._lock:
+            self.status, self.result, self.error = status, result, error
+            self.finished_at = time.time()
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'id': self.id, 'kind': self.kind, 'status': self.status, 'info': self.info,
+                    'progress': dict(self.progress), 'result': self.result, 'error': self.error,
+                    'started_at': self.started_at, 'finished_at': self.finished_at}
+
+
+_jobs: 'OrderedDict[str, Job]' = OrderedDict()
+_lock = threading.Lock()
+
+
+def _run(job: Job, work: Callable[[Job], Any]):
+    try:
+        result = work(job)
+    except Exception as e:
+        traceback.print_exc()
+        job.finish(FAILED, error=str(e))
+    else:
+        job.finish(CANCELLED if job.cancelled else DONE, result)
+
+
+def submit(kind: str, work: Callable[[Job], Any], **info) -> Job:
+    """Run work(job) in a background thread and return the job"""
+    job = Job(kind, info)
+    with _lock:
+        _jobs[job.id] = job
+        finished = [job_id for job_id, old in _jobs.items() if old.status != RUNNING]
+        for job_id in finished[:max(0, len(_jobs) - MAX_JOBS)]:
+            del _jobs[job_id]
+    threading.Thread(target=_run, args=(job, work), name=f'job-{kind}', daemon=True).start()
+    return job
+
+
+def get(job_id: str) -> Optional[Job]:
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def recent(limit: int = 20) -> List[Job]:
+    """Newest jobs first"""
+    with _lock:
+        return list(reversed(_jobs.values()))[:limit]
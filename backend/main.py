@@ -1,21 +1,54 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, File, Header, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+import json
 import os
+import time
 
-from database import engine, get_db, Base, SessionLocal
-from models import Table, Field, Record, Canvas, View
+from database import engine, get_db, Base, SessionLocal, add_missing_columns, add_missing_index
+from models import Table, Field, Record, Canvas, View, Trigger, Schedule
 from schemas import (
-    TableCreate, TableResponse, RecordCreate, RecordUpdate, RecordResponse,
-    CanvasCreate, CanvasUpdate, CanvasResponse, ViewResponse, ExecuteCanvasRequest
+    TableCreate, TableResponse, TableStorageUpdate, RecordCreate, RecordUpdate, RecordResponse,
+    BulkRecordCreate, BulkRecordResponse, RecordSearchResult,
+    CanvasCreate, CanvasUpdate, CanvasOps, CanvasResponse, ViewResponse, ExecuteCanvasRequest,
+    TriggerCreate, TriggerResponse, ScheduleCreate, ScheduleResponse
 )
-from canvas_executor import CanvasExecutor
+from profiling import Profiler
+import metrics
+import migrations
+import query_log
+import table_stats
+import triggers
+import typed_storage
+from record_validation import RecordValidationError, get_validator
+import relations
+import scheduler
+import view_retention
+import async_db
+import canvas_ops
+import cascade_delete
+import change_feed
+import jobs
+import record_export
+import record_import
+import record_patch
+from canvas_runs import graph_version, next_view_number
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+view_retention.use_incremental_vacuum(engine)
+metrics.instrument_engine(engine)
+trigger_engine = triggers.TriggerEngine(SessionLocal)
+canvas_scheduler = scheduler.Scheduler(SessionLocal)
+view_compactor = view_retention.ViewCompactor(SessionLocal)
+table_stats.start_refresher(SessionLocal)
 
 app = FastAPI(title="PSIH CanvasDB", version="1.0.0")
+if async_db.enabled():
+    # Must be set before the routes below are declared
+    app.router.route_class = async_db.DatabaseRoute
+    view_retention.use_incremental_vacuum(async_db.engine().sync_engine)
+    metrics.instrument_engine(async_db.engine().sync_engine)
 
 # CORS
 origins = os.getenv("CORS_ORIGINS", "http://localhost:5173").split(",")
@@ -27,33 +60,121 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize demo data
-@app.on_event("startup")
-async def startup_event():
-    from demo_data import init_demo_data
+_route_paths = {}
+
+def _route_template(request: Request) -> str:
+    """Path template of the matched route, so /api/t/{table_name} is one label and not one per table"""
+    endpoint = request.scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    if not _route_paths:
+        _route_paths.update({route.endpoint: route.path for route in app.routes if hasattr(route, "endpoint")})
+    return _route_paths.get(endpoint, "unmatched")
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        with query_log.scope(route=f"{request.method} {request.url.path}"):
+            response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.observe_request(request.method, _route_template(request), status, time.perf_counter() - started)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/changes")
+async def stream_changes(request: Request, last_event_id: Optional[str] = None):
+    """Server-Sent Events of record/table/view changes (see change_feed.py)"""
+    resume = request.headers.get("last-event-id") or last_event_id
+    return StreamingResponse(change_feed.astream(resume, request.is_disconnected), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Demo tables and canvas for an empty database, opt-in
+SEED_DEMO_DATA = os.getenv("SEED_DEMO_DATA", "").lower() in ("1", "true", "yes")
+
+def init_schema():
+    """Create/upgrade tables unless schema_version says they are current (one query on a warm start)"""
+    db = SessionLocal()
+    try:
+        if migrations.is_current(db, "main"):
+            return
+    finally:
+        db.close()
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine, "tables", {"storage_mode": "VARCHAR DEFAULT 'json'", "deleted_at": "TIMESTAMP"})
+    add_missing_columns(engine, "views", {"profile": "JSON", "size_bytes": "INTEGER"})
+    add_missing_columns(engine, "canvases", {"view_seq": "INTEGER", "retention_keep": "INTEGER",
+                                             "retention_days": "FLOAT", "retention_bytes": "INTEGER",
+                                             "version": "INTEGER NOT NULL DEFAULT 1", "deleted_at": "TIMESTAMP"})
+    # Covers the retention scans (see view_retention.py) without reading view data
+    add_missing_index(engine, "ix_views_retention", "views", "canvas_id, id, created_at, size_bytes")
+    # Keyset scans of one table's records (exports, see record_export.py)
+    add_missing_index(engine, "ix_records_table", "records", "table_id, id")
     db = SessionLocal()
     try:
-        init_demo_data(db)
-    except Exception as e:
-        print(f"Demo data initialization error: {e}")
+        migrations.mark_current(db, "main")
     finally:
         db.close()
 
+@app.on_event("startup")
+async def startup_event():
+    init_schema()
+    if SEED_DEMO_DATA:
+        from demo_data import init_demo_data
+        db = SessionLocal()
+        try:
+            init_demo_data(db)
+        except Exception as e:
+            print(f"Demo data initialization error: {e}")
+        finally:
+            db.close()
+    change_feed.share(SessionLocal)
+    canvas_scheduler.start()
+    view_compactor.start()
+    cascade_delete.resume(SessionLocal)
+
+@app.on_event("shutdown")
+def shutdown_event():
+    view_compactor.shutdown()
+    canvas_scheduler.shutdown()
+    trigger_engine.shutdown()
+
+def _is_typed(table: Table) -> bool:
+    return table.storage_mode == typed_storage.STORAGE_TYPED
+
+def _record_dict(record: Record) -> dict:
+    return {"id": record.id, "table_id": record.table_id, "data": record.data,
+            "created_at": record.created_at, "updated_at": record.updated_at}
+
+def _validate_record(table: Table, data: dict, partial: bool = False, check_required: bool = True) -> dict:
+    try:
+        return get_validator(table.id, table.fields).validate(data, check_required=check_required, partial=partial)
+    except RecordValidationError as e:
+        raise HTTPException(status_code=422, detail={"errors": e.errors})
+
 # Tables API
 @app.get("/api/tables", response_model=List[TableResponse])
 def get_tables(db: Session = Depends(get_db)):
-    return db.query(Table).all()
+    return db.query(Table).filter(Table.deleted_at.is_(None)).all()
 
 @app.post("/api/tables", response_model=TableResponse)
 def create_table(table: TableCreate, db: Session = Depends(get_db)):
     # Check if table name already exists
     if db.query(Table).filter(Table.name == table.name).first():
         raise HTTPException(status_code=400, detail="Table name already exists")
+    if table.storage_mode not in typed_storage.STORAGE_MODES:
+        raise HTTPException(status_code=400, detail="Unknown storage mode")
     
     db_table = Table(
         name=table.name,
         display_name=table.display_name,
-        description=table.description
+        description=table.description,
+        storage_mode=table.storage_mode
     )
     db.add(db_table)
     db.commit()
@@ -73,53 +194,234 @@ def create_table(table: TableCreate, db: Session = Depends(get_db)):
     
     db.commit()
     db.refresh(db_table)
+    
+    if _is_typed(db_table):
+        typed_storage.create_typed_table(db, db_table.id, typed_storage.field_specs(db_table.fields))
+        db.commit()
+    change_feed.publish('table', 'insert', table=db_table.name, id=db_table.id)
     return db_table
 
 @app.get("/api/tables/{table_name}", response_model=TableResponse)
 def get_table(table_name: str, db: Session = Depends(get_db)):
-    table = db.query(Table).filter(Table.name == table_name).first()
+    table = db.query(Table).filter(Table.name == table_name, Table.deleted_at.is_(None)).first()
+    if not table:
+        raise HTTPException(status_code=404, detail="Table not found")
+    return table
+
+@app.get("/api/tables/{table_name}/stats")
+def get_table_stats(table_name: str, refresh: bool = False, db: Session = Depends(get_db)):
+    """Row count and per-field statistics; the table is analyzed first if it never was or refresh=1"""
+    table = db.query(Table).filter(Table.name == table_name, Table.deleted_at.is_(None)).first()
+    if not table:
+        raise HTTPException(status_code=404, detail="Table not found")
+    stats = None if refresh else table_stats.get_stats(db, table.id)
+    if stats is None:
+        table_stats.analyze(db, table.id)
+        db.commit()
+        stats = table_stats.get_stats(db, table.id)
+    return {"table": table.name, **stats}
+
+@app.put("/api/tables/{table_name}/storage", response_model=TableResponse)
+def update_table_storage(table_name: str, storage: TableStorageUpdate, db: Session = Depends(get_db)):
+    table = db.query(Table).filter(Table.name == table_name, Table.deleted_at.is_(None)).first()
     if not table:
         raise HTTPException(status_code=404, detail="Table not found")
+    if storage.storage_mode not in typed_storage.STORAGE_MODES:
+        raise HTTPException(status_code=400, detail="Unknown storage mode")
+    
+    # Switching to typed materializes the mirror from existing records
+    if storage.storage_mode == typed_storage.STORAGE_TYPED:
+        typed_storage.create_typed_table(db, table.id, typed_storage.field_specs(table.fields))
+    else:
+        typed_storage.drop_typed_table(db, table.id)
+    table.storage_mode = storage.storage_mode
+    db.commit()
+    db.refresh(table)
+    change_feed.publish('table', 'update', table=table.name, id=table.id)
     return table
 
+@app.delete("/api/tables/{table_id}")
+def delete_table(table_id: int, db: Session = Depends(get_db)):
+    """Mark the table deleted; its records are purged in batches by a job (see cascade_delete.py)"""
+    table_name = cascade_delete.mark_table_deleted(db, table_id)
+    if table_name is None:
+        raise HTTPException(status_code=404, detail="Table not found")
+    db.commit()
+    trigger_engine.invalidate()
+    change_feed.publish('table', 'delete', table=table_name, id=table_id)
+    job = cascade_delete.start_purge(SessionLocal, 'table', table_id)
+    return {"message": "Table deleted", "job": job.to_dict()}
+
 # Records API
 @app.get("/api/t/{table_name}", response_model=List[RecordResponse])
-def get_records(table_name: str, db: Session = Depends(get_db)):
-    table = db.query(Table).filter(Table.name == table_name).first()
+def get_records(table_name: str, limit: Optional[int] = None, offset: int = 0,
+                expand: Optional[str] = None, db: Session = Depends(get_db)):
+    table = db.query(Table).filter(Table.name == table_name, Table.deleted_at.is_(None)).first()
+    if not table:
+        raise HTTPException(status_code=404, detail="Table not found")
+    # Always records.data, also for typed tables: the mirror only keeps declared fields as coerced values
+    query = db.query(Record).filter(Record.table_id == table.id).order_by(Record.id)
+    if limit is not None:
+        query = query.offset(offset).limit(limit)
+    records = query.all()
+    
+    expand_fields = relations.parse_expand(expand)
+    if not expand_fields:
+        return records
+    # Related records for the whole page are fetched with one IN (...) query per relation
+    records = [r if isinstance(r, dict) else _record_dict(r) for r in records]
+    return relations.expand_relations(db, table.fields, records, expand_fields)
+
+@app.get("/api/t/{table_name}/search", response_model=List[RecordSearchResult])
+def search_records(table_name: str, q: str = "", field: Optional[str] = None, limit: int = relations.SEARCH_LIMIT,
+                   db: Session = Depends(get_db)):
+    table = db.query(Table).filter(Table.name == table_name, Table.deleted_at.is_(None)).first()
     if not table:
         raise HTTPException(status_code=404, detail="Table not found")
-    return db.query(Record).filter(Record.table_id == table.id).all()
+    field = field or relations.label_field(table.fields)
+    if not field:
+        return []
+    return relations.search_records(db, table.id, field, q, limit)
+
+def _export_response(name: str, fmt: str, export) -> StreamingResponse:
+    """Stream an export; export(session) yields the encoded chunks"""
+    def chunks():
+        # Own session: the response body is produced after the request's session is gone
+        session = SessionLocal()
+        try:
+            yield from export(session)
+        finally:
+            session.close()
+    
+    return StreamingResponse(chunks(), media_type=record_export.MEDIA_TYPES[fmt],
+                             headers={"Content-Disposition": record_export.content_disposition(name, fmt)})
+
+@app.get("/api/t/{table_name}/export")
+def export_records(table_name: str, format: Optional[str] = None, fields: Optional[str] = None,
+                   batch_size: int = record_export.BATCH_SIZE, db: Session = Depends(get_db)):
+    table = db.query(Table).filter(Table.name == table_name, Table.deleted_at.is_(None)).first()
+    if not table:
+        raise HTTPException(status_code=404, detail="Table not found")
+    try:
+        fmt = record_export.check_format(format)
+        columns = record_export.parse_fields(fields, record_export.table_columns(table.fields))
+    except record_export.RecordExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    table_id = table.id
+    field_rows = [{"name": f.name, "field_type": f.field_type} for f in table.fields]
+    return _export_response(table_name, fmt, lambda session: record_export.export_table(
+        session, table_id, field_rows, fmt, columns, batch_size))
 
 @app.post("/api/t/{table_name}", response_model=RecordResponse)
 def create_record(table_name: str, record: RecordCreate, db: Session = Depends(get_db)):
-    table = db.query(Table).filter(Table.name == table_name).first()
+    table = db.query(Table).filter(Table.name == table_name, Table.deleted_at.is_(None)).first()
     if not table:
         raise HTTPException(status_code=404, detail="Table not found")
     
-    db_record = Record(table_id=table.id, data=record.data)
+    db_record = Record(table_id=table.id, data=_validate_record(table, record.data, check_required=not record.blank))
     db.add(db_record)
+    db.flush()
+    if _is_typed(table):
+        typed_storage.upsert_row(db, table.id, typed_storage.field_specs(table.fields), db_record.id, db_record.data)
     db.commit()
+    table_stats.record_writes(db, table.id, inserted=1)
+    trigger_engine.publish(table.name, 'insert', [db_record.id])
     db.refresh(db_record)
+    change_feed.records_changed(table.name, 'insert', [db_record.id], [_record_dict(db_record)])
     return db_record
 
-@app.patch("/api/t/{table_name}/{record_id}", response_model=RecordResponse)
-def update_record(table_name: str, record_id: int, record: RecordUpdate, db: Session = Depends(get_db)):
-    table = db.query(Table).filter(Table.name == table_name).first()
+@app.post("/api/t/{table_name}/bulk", response_model=BulkRecordResponse)
+def create_records_bulk(table_name: str, bulk: BulkRecordCreate, db: Session = Depends(get_db)):
+    table = db.query(Table).filter(Table.name == table_name, Table.deleted_at.is_(None)).first()
     if not table:
         raise HTTPException(status_code=404, detail="Table not found")
     
-    db_record = db.query(Record).filter(Record.id == record_id, Record.table_id == table.id).first()
-    if not db_record:
-        raise HTTPException(status_code=404, detail="Record not found")
-    
-    db_record.data = record.data
+    # Valid rows are inserted in one transaction, invalid ones are reported per row
+    valid, errors = get_validator(table.id, table.fields).validate_many(bulk.records)
+    db_records = [Record(table_id=table.id, data=data) for _, data in valid]
+    db.add_all(db_records)
+    db.flush()
+    if _is_typed(table):
+        specs = typed_storage.field_specs(table.fields)
+        for db_record in db_records:
+            typed_storage.upsert_row(db, table.id, specs, db_record.id, db_record.data)
     db.commit()
-    db.refresh(db_record)
+    ids = [r.id for r in db_records]
+    table_stats.record_writes(db, table.id, inserted=len(ids))
+    if ids:
+        trigger_engine.publish(table.name, 'insert', ids)
+        change_feed.records_changed(table.name, 'insert', ids, [_record_dict(r) for r in db_records])
+    return {"inserted": len(ids), "ids": ids, "errors": errors}
+
+@app.post("/api/t/{table_name}/import")
+def import_records(table_name: str, file: UploadFile = File(...), format: Optional[str] = None,
+                   mapping: Optional[str] = None, chunk_size: int = record_import.CHUNK_SIZE,
+                   db: Session = Depends(get_db)):
+    table = db.query(Table).filter(Table.name == table_name, Table.deleted_at.is_(None)).first()
+    if not table:
+        raise HTTPException(status_code=404, detail="Table not found")
+    try:
+        fmt = record_import.detect_format(format, file.filename, file.content_type)
+        columns = record_import.parse_mapping(mapping, table.fields)
+    except record_import.RecordImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # The upload is already spooled to a temporary file; the job reads it after the response
+    stream = file.file
+    stream.seek(0, os.SEEK_END)
+    total_bytes = stream.tell()
+    stream.seek(0)
+    table_id = table.id
+    
+    def run(job):
+        session = SessionLocal()
+        try:
+            table = session.query(Table).get(table_id)
+            typed_fields = typed_storage.field_specs(table.fields) if _is_typed(table) else None
+            return record_import.import_records(
+                session, table.id, table.fields, get_validator(table.id, table.fields), stream, fmt, job,
+                mapping=columns, typed_fields=typed_fields, chunk_size=chunk_size,
+                on_insert=lambda ids: (trigger_engine.publish(table_name, 'insert', ids),
+                                       change_feed.records_changed(table_name, 'insert', ids)))
+        finally:
+            session.close()
+            stream.close()
+    
+    return jobs.submit('import', run, table=table_name, format=fmt, total_bytes=total_bytes).to_dict()
+
+@app.patch("/api/t/{table_name}/{record_id}", response_model=RecordResponse)
+def update_record(table_name: str, record_id: int, record: RecordUpdate, content_type: Optional[str] = Header(None),
+                  db: Session = Depends(get_db)):
+    table = db.query(Table).filter(Table.name == table_name, Table.deleted_at.is_(None)).first()
+    if not table:
+        raise HTTPException(status_code=404, detail="Table not found")
+    
+    if record_patch.is_merge_patch(content_type):
+        # Only the sent fields change, in one UPDATE (see record_patch.py)
+        patch = _validate_record(table, record.data, partial=True)
+        typed_fields = typed_storage.field_specs(table.fields) if _is_typed(table) else None
+        if not record_patch.merge_record(db, table.id, record_id, patch, typed_fields):
+            raise HTTPException(status_code=404, detail="Record not found")
+        db.commit()
+        db_record = db.query(Record).get(record_id)
+    else:
+        db_record = db.query(Record).filter(Record.id == record_id, Record.table_id == table.id).first()
+        if not db_record:
+            raise HTTPException(status_code=404, detail="Record not found")
+        
+        db_record.data = _validate_record(table, record.data)
+        if _is_typed(table):
+            typed_storage.upsert_row(db, table.id, typed_storage.field_specs(table.fields), db_record.id, db_record.data)
+        db.commit()
+        db.refresh(db_record)
+    table_stats.record_writes(db, table.id, changed=1)
+    trigger_engine.publish(table.name, 'update', [record_id])
+    change_feed.records_changed(table.name, 'update', [record_id], [_record_dict(db_record)])
     return db_record
 
 @app.delete("/api/t/{table_name}/{record_id}")
 def delete_record(table_name: str, record_id: int, db: Session = Depends(get_db)):
-    table = db.query(Table).filter(Table.name == table_name).first()
+    table = db.query(Table).filter(Table.name == table_name, Table.deleted_at.is_(None)).first()
     if not table:
         raise HTTPException(status_code=404, detail="Table not found")
     
@@ -128,13 +430,18 @@ def delete_record(table_name: str, record_id: int, db: Session = Depends(get_db)
         raise HTTPException(status_code=404, detail="Record not found")
     
     db.delete(db_record)
+    if _is_typed(table):
+        typed_storage.delete_row(db, table.id, record_id)
     db.commit()
+    table_stats.record_writes(db, table.id, changed=1)
+    trigger_engine.publish(table.name, 'delete', [record_id])
+    change_feed.records_changed(table.name, 'delete', [record_id])
     return {"message": "Record deleted"}
 
 # Canvas API
 @app.get("/api/canvases", response_model=List[CanvasResponse])
 def get_canvases(db: Session = Depends(get_db)):
-    return db.query(Canvas).all()
+    return db.query(Canvas).filter(Canvas.deleted_at.is_(None)).all()
 
 @app.post("/api/canvases", response_model=CanvasResponse)
 def create_canvas(canvas: CanvasCreate, db: Session = Depends(get_db)):
@@ -142,56 +449,123 @@ def create_canvas(canvas: CanvasCreate, db: Session = Depends(get_db)):
     db.add(db_canvas)
     db.commit()
     db.refresh(db_canvas)
+    change_feed.publish('canvas', 'insert', id=db_canvas.id)
     return db_canvas
 
 @app.get("/api/canvases/{canvas_id}", response_model=CanvasResponse)
 def get_canvas(canvas_id: int, db: Session = Depends(get_db)):
-    canvas = db.query(Canvas).filter(Canvas.id == canvas_id).first()
+    canvas = db.query(Canvas).filter(Canvas.id == canvas_id, Canvas.deleted_at.is_(None)).first()
     if not canvas:
         raise HTTPException(status_code=404, detail="Canvas not found")
     return canvas
 
 @app.patch("/api/canvases/{canvas_id}", response_model=CanvasResponse)
 def update_canvas(canvas_id: int, canvas: CanvasUpdate, db: Session = Depends(get_db)):
-    db_canvas = db.query(Canvas).filter(Canvas.id == canvas_id).first()
+    db_canvas = db.query(Canvas).filter(Canvas.id == canvas_id, Canvas.deleted_at.is_(None)).first()
     if not db_canvas:
         raise HTTPException(status_code=404, detail="Canvas not found")
     
-    for field, value in canvas.dict(exclude_unset=True).items():
+    changes = canvas.dict(exclude_unset=True)
+    for field, value in changes.items():
         setattr(db_canvas, field, value)
+    if 'nodes' in changes or 'edges' in changes:
+        db_canvas.version = Canvas.version + 1
     
     db.commit()
     db.refresh(db_canvas)
+    change_feed.publish('canvas', 'update', id=db_canvas.id)
     return db_canvas
 
+@app.patch("/api/canvases/{canvas_id}/ops")
+def save_canvas_ops(canvas_id: int, request: CanvasOps, db: Session = Depends(get_db)):
+    """Incremental save: node/edge operations on top of the client's version (see canvas_ops.py)"""
+    try:
+        version = canvas_ops.save_ops(db, canvas_id, request.version, request.ops)
+    except canvas_ops.VersionConflict as e:
+        raise HTTPException(status_code=409, detail={"error": str(e), "version": e.version})
+    except canvas_ops.CanvasOpsError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if version is None:
+        raise HTTPException(status_code=404, detail="Canvas not found")
+    db.commit()
+    change_feed.publish('canvas', 'update', id=canvas_id, version=version)
+    return {"id": canvas_id, "version": version}
+
+@app.delete("/api/canvases/{canvas_id}")
+def delete_canvas(canvas_id: int, db: Session = Depends(get_db)):
+    """Mark the canvas deleted; its views are purged in batches by a job (see cascade_delete.py)"""
+    if not cascade_delete.mark_canvas_deleted(db, canvas_id):
+        raise HTTPException(status_code=404, detail="Canvas not found")
+    db.commit()
+    trigger_engine.invalidate()
+    change_feed.publish('canvas', 'delete', id=canvas_id)
+    job = cascade_delete.start_purge(SessionLocal, 'canvas', canvas_id)
+    return {"message": "Canvas deleted", "job": job.to_dict()}
+
 # Canvas execution
 @app.post("/api/canvases/execute", response_model=ViewResponse)
-def execute_canvas(request: ExecuteCanvasRequest, db: Session = Depends(get_db)):
-    canvas = db.query(Canvas).filter(Canvas.id == request.canvas_id).first()
+def execute_canvas(request: ExecuteCanvasRequest, profile: bool = False, db: Session = Depends(get_db)):
+    canvas = db.query(Canvas).filter(Canvas.id == request.canvas_id, Canvas.deleted_at.is_(None)).first()
     if not canvas:
         raise HTTPException(status_code=404, detail="Canvas not found")
     
-    executor = CanvasExecutor(db)
-    result_data = executor.execute(canvas.nodes, canvas.edges)
+    from canvas_executor import CanvasExecutor  # imported on first use to keep startup fast
+    profiler = Profiler(enabled=profile)
+    executor = CanvasExecutor(db, profiler)
+    try:
+        with query_log.scope(canvas=canvas.id):
+            result_data = executor.execute(canvas.nodes, canvas.edges,
+                                           graph_version(canvas.id, canvas.version, canvas.created_at))
+    except ValueError as e:
+        # The canvas cannot be planned (no start node, a computeNode type error)
+        raise HTTPException(status_code=400, detail=str(e))
     
     # Save as view
-    view_name = request.view_name or f"View_{canvas.id}_{len(db.query(View).filter(View.canvas_id == canvas.id).all()) + 1}"
+    view_name = request.view_name or f"View_{canvas.id}_{next_view_number(db, canvas.id)}"
     db_view = View(
         name=view_name,
         canvas_id=canvas.id,
-        data=result_data
+        data=result_data,
+        profile=profiler.to_dict() if profile else None,
+        size_bytes=len(json.dumps(result_data, default=str))
     )
     db.add(db_view)
     db.commit()
     db.refresh(db_view)
+    change_feed.publish('view', 'insert', id=db_view.id, name=db_view.name, canvas_id=canvas.id)
     
     return db_view
 
+@app.post("/api/canvases/{canvas_id}/explain")
+def explain_canvas(canvas_id: int, db: Session = Depends(get_db)):
+    """Physical plan (pipelines, rewrites, pushed-down SQL, join strategies) without executing the canvas"""
+    canvas = db.query(Canvas).filter(Canvas.id == canvas_id, Canvas.deleted_at.is_(None)).first()
+    if not canvas:
+        raise HTTPException(status_code=404, detail="Canvas not found")
+    
+    from canvas_executor import CanvasExecutor
+    try:
+        plan = CanvasExecutor(db).explain(canvas.nodes, canvas.edges,
+                                          graph_version(canvas.id, canvas.version, canvas.created_at))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"canvas_id": canvas.id, "plan": plan}
+
+@app.get("/api/slow-queries")
+def get_slow_queries(limit: int = 50):
+    """Recently logged slow/sampled statements (see query_log.py for the SLOW_QUERY_* settings)"""
+    return query_log.recent(limit)
+
 # Views API
 @app.get("/api/views", response_model=List[ViewResponse])
 def get_views(db: Session = Depends(get_db)):
     return db.query(View).all()
 
+@app.post("/api/views/compact")
+def compact_views(full_vacuum: bool = False, db: Session = Depends(get_db)):
+    """Apply view retention now; full_vacuum=1 also converts an old SQLite file to incremental vacuum"""
+    return view_retention.compact(db, full_vacuum=full_vacuum)
+
 @app.get("/api/view/{view_id}", response_model=ViewResponse)
 def get_view(view_id: int, db: Session = Depends(get_db)):
     view = db.query(View).filter(View.id == view_id).first()
@@ -199,6 +573,104 @@ def get_view(view_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="View not found")
     return view
 
+@app.get("/api/view/{view_id}/export")
+def export_view(view_id: int, format: Optional[str] = None, fields: Optional[str] = None,
+                batch_size: int = record_export.BATCH_SIZE, db: Session = Depends(get_db)):
+    view = db.query(View).filter(View.id == view_id).first()
+    if not view:
+        raise HTTPException(status_code=404, detail="View not found")
+    try:
+        fmt = record_export.check_format(format)
+        columns = record_export.parse_fields(fields)
+    except record_export.RecordExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _export_response(view.name or f"view_{view_id}", fmt, lambda session: record_export.export_view(
+        session, view_id, fmt, columns, batch_size))
+
+# Triggers API
+@app.get("/api/triggers", response_model=List[TriggerResponse])
+def get_triggers(db: Session = Depends(get_db)):
+    return db.query(Trigger).all()
+
+@app.post("/api/triggers", response_model=TriggerResponse)
+def create_trigger(trigger: TriggerCreate, db: Session = Depends(get_db)):
+    try:
+        settings = triggers.validate(trigger.dict())
+    except triggers.TriggerError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not db.query(Canvas).filter(Canvas.id == settings["canvas_id"], Canvas.deleted_at.is_(None)).first():
+        raise HTTPException(status_code=404, detail="Canvas not found")
+    if not db.query(Table).filter(Table.name == settings["table_name"], Table.deleted_at.is_(None)).first():
+        raise HTTPException(status_code=404, detail="Table not found")
+    
+    db_trigger = Trigger(**settings)
+    db.add(db_trigger)
+    db.commit()
+    db.refresh(db_trigger)
+    trigger_engine.invalidate()
+    return db_trigger
+
+@app.delete("/api/triggers/{trigger_id}")
+def delete_trigger(trigger_id: int, db: Session = Depends(get_db)):
+    db_trigger = db.query(Trigger).filter(Trigger.id == trigger_id).first()
+    if not db_trigger:
+        raise HTTPException(status_code=404, detail="Trigger not found")
+    db.delete(db_trigger)
+    db.commit()
+    trigger_engine.invalidate()
+    return {"message": "Trigger deleted"}
+
+# Schedules API
+@app.get("/api/schedules", response_model=List[ScheduleResponse])
+def get_schedules(db: Session = Depends(get_db)):
+    return db.query(Schedule).all()
+
+@app.post("/api/schedules", response_model=ScheduleResponse)
+def create_schedule(schedule: ScheduleCreate, db: Session = Depends(get_db)):
+    try:
+        settings = scheduler.validate(schedule.dict())
+    except scheduler.ScheduleError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not db.query(Canvas).filter(Canvas.id == settings["canvas_id"], Canvas.deleted_at.is_(None)).first():
+        raise HTTPException(status_code=404, detail="Canvas not found")
+    
+    db_schedule = Schedule(**settings)
+    db.add(db_schedule)
+    db.flush()
+    scheduler.arm(db, db_schedule.id)
+    db.commit()
+    db.refresh(db_schedule)
+    return db_schedule
+
+@app.delete("/api/schedules/{schedule_id}")
+def delete_schedule(schedule_id: int, db: Session = Depends(get_db)):
+    db_schedule = db.query(Schedule).filter(Schedule.id == schedule_id).first()
+    if not db_schedule:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    db.delete(db_schedule)
+    db.commit()
+    return {"message": "Schedule deleted"}
+
+# Jobs API (see jobs.py)
+@app.get("/api/jobs")
+def get_jobs(limit: int = 20):
+    return [job.to_dict() for job in jobs.recent(limit)]
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.delete("/api/jobs/{job_id}")
+def cancel_job(job_id: str):
+    job = jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job.cancel()
+    return job.to_dict()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
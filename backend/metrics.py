@@ -0,0 +1,238 @@
+"""Prometheus-style metrics shared by both servers.
+
+Counters and histograms keep one cell per thread: a thread only ever writes
+its own cell, so updates need no lock, and reads (a /metrics scrape) sum the
+cells. render() produces the Prometheus text exposition format.
+"""
+import sqlite3
+import time
+from bisect import bisect_left
+from threading import get_ident
+from typing import Dict, List, Sequence, Tuple
+
+import query_log
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY: List['_Metric'] = []
+
+
+class _Cells:
+    """Per-thread lists of numbers, summed on read"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._cells: Dict[int, List[float]] = {}
+
+    def mine(self) -> List[float]:
+        cell = self._cells.get(get_ident())
+        if cell is None:
+            cell = self._cells.setdefault(get_ident(), [0] * self.size)
+        return cell
+
+    def totals(self) -> List[float]:
+        totals = [0] * self.size
+        for cell in list(self._cells.values()):
+            for i, value in enumerate(cell):
+                totals[i] += value
+        return totals
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], _Cells] = {}
+        REGISTRY.append(self)
+
+    def _cells(self, labels: Tuple[str, ...]) -> _Cells:
+        cells = self._children.get(labels)
+        if cells is None:
+            cells = self._children.setdefault(labels, _Cells(self._cell_size()))
+        return cells
+
+    def _cell_size(self) -> int:
+        return 1
+
+    def _label_str(self, labels: Tuple[str, ...], extra: str = '') -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, cells in sorted(list(self._children.items())):
+            lines.extend(self._render_child(labels, cells.totals()))
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._cells(labels).mine()[0] += amount
+
+    def value(self, *labels: str) -> float:
+        cells = self._children.get(labels)
+        return cells.totals()[0] if cells else 0
+
+    def _render_child(self, labels, totals) -> List[str]:
+        return [f"{self.name}{self._label_str(labels)} {_number(totals[0])}"]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _cell_size(self) -> int:
+        # one count per bucket, one for +Inf, then the sum
+        return len(self.buckets) + 2
+
+    def observe(self, value: float, *labels: str):
+        cell = self._cells(labels).mine()
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def _render_child(self, labels, totals) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), totals[:-1]):
+            cumulative += count
+            le = 'le="' + ('+Inf' if bound == float('inf') else repr(bound)) + '"'
+            lines.append(f"{self.name}_bucket{self._label_str(labels, le)} {_number(cumulative)}")
+        lines.append(f"{self.name}_sum{self._label_str(labels)} {_number(totals[-1])}")
+        lines.append(f"{self.name}_count{self._label_str(labels)} {_number(cumulative)}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+HTTP_REQUESTS = Counter('http_requests_total', 'HTTP requests handled', ('method', 'route', 'status'))
+HTTP_DURATION = Histogram('http_request_duration_seconds', 'HTTP request latency', ('method', 'route'))
+DB_QUERIES = Counter('db_queries_total', 'SQL statements executed', ('statement',))
+DB_DURATION = Histogram('db_query_duration_seconds', 'SQL statement latency', ('statement',))
+WEBHOOK_RECORDS = Counter('webhook_records_total', 'Records received through webhooks', ('table', 'result'))
+CANVAS_EXECUTIONS = Counter('canvas_executions_total', 'Canvas executions', ('result',))
+CANVAS_DURATION = Histogram('canvas_execution_duration_seconds', 'Canvas execution latency')
+TRIGGER_EVENTS = Counter('trigger_events_total', 'Record changes delivered to triggers', ('event',))
+TRIGGER_RUNS = Counter('trigger_runs_total', 'Trigger executions', ('mode', 'result'))
+TRIGGER_DURATION = Histogram('trigger_run_duration_seconds', 'Trigger execution latency')
+SCHEDULE_RUNS = Counter('schedule_runs_total', 'Scheduled canvas runs; skipped = previous run still going', ('result',))
+SCHEDULE_DURATION = Histogram('schedule_run_duration_seconds', 'Scheduled canvas run latency')
+IMPORT_ROWS = Counter('import_rows_total', 'Rows read by record imports (see record_import.py)', ('result',))
+EXPORT_ROWS = Counter('export_rows_total', 'Rows streamed by exports (see record_export.py)', ('format',))
+VIEWS_DELETED = Counter('views_deleted_total', 'Views deleted by retention (see view_retention.py)', ('reason',))
+CACHE_LOOKUPS = Counter('cache_lookups_total', 'Cache lookups; hit ratio = hit / (hit + miss)', ('cache', 'result'))
+
+
+def observe_request(method: str, route: str, status: int, seconds: float):
+    HTTP_REQUESTS.inc(method, route, str(status))
+    HTTP_DURATION.observe(seconds, method, route)
+
+
+def statement_kind(sql: str) -> str:
+    words = sql.lstrip().split(None, 1)
+    return words[0].lower() if words else 'other'
+
+
+def observe_query(sql: str, seconds: float):
+    kind = statement_kind(sql)
+    DB_QUERIES.inc(kind)
+    DB_DURATION.observe(seconds, kind)
+
+
+def record_cache_lookup(cache: str, hit: bool):
+    CACHE_LOOKUPS.inc(cache, 'hit' if hit else 'miss')
+
+
+# SQLAlchemy (main.py)
+
+def instrument_engine(engine):
+    """Time every statement executed through engine, for metrics and the slow query log"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['metrics_query_start'].pop()
+        observe_query(statement, seconds)
+        query_log.observe(statement, parameters, seconds, conn.connection, conn.dialect.name, executemany)
+
+    @event.listens_for(engine, 'handle_error')
+    def _error(context):
+        starts = context.connection.info.get('metrics_query_start') if context.connection else None
+        if starts:
+            observe_query(context.statement or '', time.perf_counter() - starts.pop())
+
+
+# sqlite3 (advanced_server.py)
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            seconds = time.perf_counter() - started
+            observe_query(sql, seconds)
+            query_log.observe(sql, parameters, seconds, self.connection)
+            self.connection.notify_listeners(seconds)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            seconds = time.perf_counter() - started
+            observe_query(sql, seconds)
+            query_log.observe(sql, None, seconds, executemany=True)
+            self.connection.notify_listeners(seconds)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Called with the seconds of every statement, e.g. by a profiled canvas run (profiling.py)
+        self.query_listeners = []
+
+    def notify_listeners(self, seconds: float):
+        for listener in self.query_listeners:
+            listener(seconds)
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connect_sqlite(database: str, **kwargs) -> sqlite3.Connection:
+    """sqlite3.connect whose cursors record query metrics"""
+    return sqlite3.connect(database, factory=InstrumentedConnection, **kwargs)
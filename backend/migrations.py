@@ -0,0 +1,43 @@
+"""Schema version bookkeeping, so a server start checks the schema with one query.
+
+Each server records the version of the DDL it last applied in schema_version
+(one row per server, since main.py and advanced_server.py create slightly
+different tables). On startup it compares that row with SCHEMA_VERSIONS and
+only runs its CREATE TABLE / ALTER TABLE statements when they differ.
+Bump the server's version whenever its DDL changes.
+"""
+from datetime import datetime, timezone
+from typing import Optional
+
+from database import execute_sql
+
+SCHEMA_VERSIONS = {
+    'main': 5,
+    'advanced': 5,
+}
+
+
+def applied_version(conn, component: str) -> Optional[int]:
+    try:
+        row = execute_sql(conn, "SELECT version FROM schema_version WHERE component = :component",
+                          {'component': component}).fetchone()
+    except Exception:
+        # No schema_version table yet: a new database or one from before versioning
+        conn.rollback()
+        return None
+    return row[0] if row else None
+
+
+def is_current(conn, component: str) -> bool:
+    return applied_version(conn, component) == SCHEMA_VERSIONS[component]
+
+
+def mark_current(conn, component: str):
+    execute_sql(conn, "CREATE TABLE IF NOT EXISTS schema_version "
+                      "(component VARCHAR PRIMARY KEY, version INTEGER NOT NULL, applied_at VARCHAR)")
+    execute_sql(conn, """
+        INSERT INTO schema_version (component, version, applied_at) VALUES (:component, :version, :applied_at)
+        ON CONFLICT (component) DO UPDATE SET version = excluded.version, applied_at = excluded.applied_at
+    """, {'component': component, 'version': SCHEMA_VERSIONS[component],
+          'applied_at': datetime.now(timezone.utc).isoformat()})
+    conn.commit()
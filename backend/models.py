@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Float
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.types import JSON
@@ -11,6 +11,8 @@ class Table(Base):
     name = Column(String, unique=True, index=True)
     display_name = Column(String)
     description = Column(Text, nullable=True)
+    storage_mode = Column(String, default="json")  # json, typed (see typed_storage.py)
+    deleted_at = Column(DateTime(timezone=True), nullable=True)  # set by DELETE, purged in the background (cascade_delete.py)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
@@ -42,6 +44,18 @@ class Record(Base):
     
     table = relationship("Table", back_populates="records")
 
+class TableStats(Base):
+    __tablename__ = "table_stats"
+    
+    table_id = Column(Integer, ForeignKey("tables.id", ondelete="CASCADE"), primary_key=True)
+    row_count = Column(Integer)
+    sampled_rows = Column(Integer)
+    sample_fraction = Column(Float)
+    last_record_id = Column(Integer)  # records up to this id are in the statistics
+    summary = Column(JSON)  # per field: null_fraction, distinct, min, max, top_values
+    state = Column(JSON)  # per field sketches for incremental refreshes (see table_stats.py)
+    analyzed_at = Column(String)
+
 class Canvas(Base):
     __tablename__ = "canvases"
     
@@ -50,6 +64,13 @@ class Canvas(Base):
     description = Column(Text, nullable=True)
     nodes = Column(JSON)  # React Flow nodes
     edges = Column(JSON)  # React Flow edges
+    view_seq = Column(Integer, nullable=True)  # number of the last View_{id}_{n} (see canvas_runs.py)
+    version = Column(Integer, nullable=False, default=1, server_default='1')  # bumped by every graph edit (canvas_ops.py)
+    # Retention of this canvas' views, NULL = server default, 0 = unlimited (see view_retention.py)
+    retention_keep = Column(Integer, nullable=True)
+    retention_days = Column(Float, nullable=True)
+    retention_bytes = Column(Integer, nullable=True)
+    deleted_at = Column(DateTime(timezone=True), nullable=True)  # see cascade_delete.py
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -60,6 +81,49 @@ class View(Base):
     name = Column(String)
     canvas_id = Column(Integer, ForeignKey("canvases.id"))
     data = Column(JSON)  # Result data
+    profile = Column(JSON, nullable=True)  # per-node timings when executed with ?profile=1
+    size_bytes = Column(Integer, nullable=True)  # serialized size of data, for retention by bytes
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     canvas = relationship("Canvas")
+
+class Trigger(Base):
+    __tablename__ = "triggers"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    canvas_id = Column(Integer, ForeignKey("canvases.id"))
+    table_name = Column(String, index=True)
+    events = Column(JSON)  # insert, update, delete
+    mode = Column(String, default="delta")  # delta, full (see triggers.py)
+    window_ms = Column(Integer, default=500)
+    max_batch = Column(Integer, default=1000)
+    enabled = Column(Boolean, default=True)
+    last_run_at = Column(String, nullable=True)
+    last_status = Column(String, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class Schedule(Base):
+    __tablename__ = "schedules"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    canvas_id = Column(Integer, ForeignKey("canvases.id"), index=True)
+    cron = Column(String)  # "*/5 * * * *", @hourly, ... (see scheduler.py)
+    overlap = Column(String, default="skip")  # skip, queue
+    jitter_seconds = Column(Integer, default=30)
+    keep_views = Column(Integer, default=10)  # newest views of the canvas kept after each run, 0 = all
+    enabled = Column(Boolean, default=True)
+    next_run_at = Column(Float, nullable=True, index=True)  # epoch seconds
+    running_since = Column(Float, nullable=True)
+    last_run_at = Column(String, nullable=True)
+    last_status = Column(String, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ChangeEvent(Base):
+    __tablename__ = "change_events"
+    __table_args__ = {"sqlite_autoincrement": True}  # seq is never reused, even after the newest rows are deleted
+    
+    seq = Column(Integer, primary_key=True)  # sequence number of the change feed (see change_feed.py)
+    event = Column(Text)  # JSON: type, action and payload
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
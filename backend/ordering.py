@@ -0,0 +1,83 @@
+"""Sorting and top-N for sortNode and limitNode.
+
+sortNode data: {"sortBy": [{"field": "stock", "direction": "asc"}, ...]}
+(or the single-key shorthand {"field": "stock", "direction": "desc"}).
+limitNode data: {"limit": 100, "offset": 0}.
+
+Missing values sort last in both directions, numbers before strings, which is
+what the pushed-down ORDER BY ... NULLS LAST produces as well.
+"""
+import heapq
+from functools import cmp_to_key
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+
+class SortKey(NamedTuple):
+    field: str
+    descending: bool = False
+
+
+def parse_sort_spec(data: Dict[str, Any]) -> List[SortKey]:
+    items = data.get('sortBy')
+    if items is None and data.get('field'):
+        items = [{'field': data.get('field'), 'direction': data.get('direction')}]
+    keys = []
+    for item in items or []:
+        if isinstance(item, str):
+            item = {'field': item}
+        if item.get('field'):
+            keys.append(SortKey(item['field'], str(item.get('direction') or 'asc').lower() == 'desc'))
+    return keys
+
+
+def parse_limit(data: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+    """(limit, offset) from limitNode data, or None if no valid limit is set"""
+    try:
+        limit = int(data.get('limit'))
+        offset = int(data.get('offset') or 0)
+    except (TypeError, ValueError):
+        return None
+    if limit < 0 or offset < 0:
+        return None
+    return limit, offset
+
+
+def _rank(value: Any):
+    if isinstance(value, bool):
+        return (0, int(value))
+    if isinstance(value, (int, float)):
+        return (0, value)
+    return (1, str(value))
+
+
+def _comparator(keys: List[SortKey]):
+    def compare(a: Dict[str, Any], b: Dict[str, Any]) -> int:
+        for key in keys:
+            left, right = a.get(key.field), b.get(key.field)
+            if left is None or right is None:
+                if left is None and right is None:
+                    continue
+                return 1 if left is None else -1
+            left, right = _rank(left), _rank(right)
+            if left != right:
+                result = -1 if left < right else 1
+                return -result if key.descending else result
+        return 0
+    return cmp_to_key(compare)
+
+
+def sort_rows(rows: Iterable[Dict[str, Any]], keys: List[SortKey]) -> List[Dict[str, Any]]:
+    return sorted(rows, key=_comparator(keys))
+
+
+def top_n(rows: Iterable[Dict[str, Any]], keys: List[SortKey], limit: int, offset: int = 0) -> List[Dict[str, Any]]:
+    """First limit rows after offset in sort order, keeping only a bounded heap of offset+limit rows"""
+    if not keys:
+        result = []
+        for i, row in enumerate(rows):
+            if i >= offset + limit:
+                break
+            if i >= offset:
+                result.append(row)
+        return result
+    return heapq.nsmallest(offset + limit, rows, key=_comparator(keys))[offset:]
@@ -0,0 +1,185 @@
+"""Per-node profiling of canvas execution.
+
+A Profiler records, for every executed node, wall time, rows in/out, memory
+allocated (via tracemalloc), SQL statements issued on the executor's
+connection and cache hits/misses. Code below the executor reports cache
+lookups with record_cache(), which also feeds the cache metrics.
+
+tracemalloc is process-wide: concurrently profiled runs share one trace, so
+alloc_bytes and peak_alloc_bytes also count allocations made by other
+threads meanwhile and are only exact for a run that had the process to
+itself. Profilers count themselves in _tracing_users under _tracing_lock;
+tracing starts with the first and stops with the last (and never if it was
+already on), and the peak is only reset, and peak_alloc_bytes reported,
+while a single profiler is running, so no run resets another's peak.
+"""
+import sqlite3
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+import metrics
+
+_current: ContextVar[Optional['NodeProfile']] = ContextVar('profiled_node', default=None)
+
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_started_tracing = False  # tracemalloc was started by the profilers, not by someone else
+
+
+def _start_tracing():
+    global _tracing_users, _started_tracing
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracing = True
+        _tracing_users += 1
+
+
+def _stop_tracing():
+    global _tracing_users, _started_tracing
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0 and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+
+
+def _reset_peak() -> bool:
+    """Reset the traced peak if no other profiler is running; False if the peak is shared"""
+    with _tracing_lock:
+        if _tracing_users != 1:
+            return False
+        tracemalloc.reset_peak()
+        return True
+
+
+def record_cache(name: str, hit: bool):
+    """Count a cache lookup in the metrics and against the node currently being profiled"""
+    metrics.record_cache_lookup(name, hit)
+    entry = _current.get()
+    if entry is not None:
+        key = 'hits' if hit else 'misses'
+        entry.cache.setdefault(name, {'hits': 0, 'misses': 0})[key] += 1
+
+
+def _row_count(data: Any) -> Optional[int]:
+    if data is None:
+        return None
+    return len(data) if isinstance(data, list) else 1
+
+
+class NodeProfile:
+    def __init__(self, node_id: str, node_type: str, rows_in: Optional[int]):
+        self.node_id = node_id
+        self.node_type = node_type
+        self.rows_in = rows_in
+        self.rows_out: Optional[int] = None
+        self.wall_ms = 0.0
+        self.alloc_bytes = 0
+        self.peak_alloc_bytes: Optional[int] = 0  # None when another profiled run was active
+        self.sql_queries = 0
+        self.sql_ms = 0.0
+        self.cache: Dict[str, Dict[str, int]] = {}
+        self.pushed: List[str] = []  # downstream nodes executed as part of this one
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.node_id,
+            'type': self.node_type,
+            'wall_ms': round(self.wall_ms, 3),
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'alloc_bytes': self.alloc_bytes,
+            'peak_alloc_bytes': self.peak_alloc_bytes,
+            'sql_queries': self.sql_queries,
+            'sql_ms': round(self.sql_ms, 3),
+            'cache': self.cache,
+            'pushed': self.pushed,
+        }
+
+
+class Profiler:
+    """Collects NodeProfiles for one canvas execution; disabled profilers cost one branch per node"""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.nodes: List[NodeProfile] = []
+        self.total_ms = 0.0
+
+    @contextmanager
+    def run(self, db):
+        """Profile a whole execution on db, an ORM session or an advanced_server sqlite3 connection"""
+        if not self.enabled:
+            yield self
+            return
+        stop_listening = self._listen(db)
+        _start_tracing()
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.total_ms = (time.perf_counter() - started) * 1000
+            stop_listening()
+            _stop_tracing()
+
+    def _listen(self, db) -> Callable[[], None]:
+        """Count the statements run on db's connection; returns the function that stops counting"""
+        if isinstance(db, sqlite3.Connection):
+            # metrics.InstrumentedConnection reports every statement to its query_listeners
+            listeners = getattr(db, 'query_listeners', [])
+            listeners.append(self._count_query)
+            return lambda: listeners.remove(self._count_query)
+        from sqlalchemy import event  # only profiled runs need it; keeps advanced_server free of SQLAlchemy
+        # Listen on this session's connection only, not on the engine shared with other requests
+        connection = db.connection()
+        event.listen(connection, 'before_cursor_execute', self._before_execute)
+        event.listen(connection, 'after_cursor_execute', self._after_execute)
+
+        def stop():
+            event.remove(connection, 'before_cursor_execute', self._before_execute)
+            event.remove(connection, 'after_cursor_execute', self._after_execute)
+        return stop
+
+    @contextmanager
+    def node(self, node: Dict, input_data: Any):
+        if not self.enabled:
+            yield None
+            return
+        entry = NodeProfile(node['id'], node.get('type', 'default'), _row_count(input_data))
+        self.nodes.append(entry)
+        token = _current.set(entry)
+        own_peak = _reset_peak()
+        mem_before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            entry.wall_ms = (time.perf_counter() - started) * 1000
+            current, peak = tracemalloc.get_traced_memory()
+            entry.alloc_bytes = max(0, current - mem_before)
+            entry.peak_alloc_bytes = max(0, peak - mem_before) if own_peak else None
+            _current.reset(token)
+
+    def finish_node(self, entry: Optional[NodeProfile], data: Any, pushed: Optional[List[str]] = None):
+        if entry is not None:
+            entry.rows_out = _row_count(data)
+            entry.pushed = list(pushed or [])
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('profile_query_start', []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._count_query(time.perf_counter() - conn.info['profile_query_start'].pop())
+
+    def _count_query(self, seconds: float):
+        entry = _current.get()
+        if entry is not None:
+            entry.sql_queries += 1
+            entry.sql_ms += seconds * 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'total_ms': round(self.total_ms, 3), 'nodes': [n.to_dict() for n in self.nodes]}
@@ -0,0 +1,104 @@
+"""Opt-in slow query log and sampled SQL statement tracing.
+
+Configured from the environment:
+    SLOW_QUERY_MS       log statements slower than this many ms (0/unset: off)
+    SLOW_QUERY_SAMPLE   fraction of slow statements to log (default 1.0)
+    SLOW_QUERY_EXPLAIN  also capture EXPLAIN [QUERY PLAN] output for logged slow statements
+    SQL_TRACE_SAMPLE    fraction of all statements to log regardless of duration (default 0)
+
+Both servers time every statement for metrics already, so deciding whether to
+log costs one comparison per statement; only the logged (sampled) statements
+pay for formatting parameters and running EXPLAIN. Each entry carries the
+route and canvas node that issued it, taken from scope().
+"""
+import json
+import logging
+import os
+import random
+import sqlite3
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS") or 0)
+SLOW_QUERY_SAMPLE = float(os.getenv("SLOW_QUERY_SAMPLE") or 1.0)
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "").lower() in ("1", "true", "yes")
+SQL_TRACE_SAMPLE = float(os.getenv("SQL_TRACE_SAMPLE") or 0)
+
+MAX_PARAMS_LENGTH = 500
+RECENT_LIMIT = 200
+
+logger = logging.getLogger("psih.sql")
+
+_recent = deque(maxlen=RECENT_LIMIT)
+_context: ContextVar[Dict[str, Any]] = ContextVar("query_context", default={})
+
+
+def push(**fields):
+    """Attribute following statements to e.g. route=... or node=...; undo with pop(token)"""
+    return _context.set({**_context.get(), **fields})
+
+
+def pop(token):
+    _context.reset(token)
+
+
+@contextmanager
+def scope(**fields):
+    token = push(**fields)
+    try:
+        yield
+    finally:
+        pop(token)
+
+
+def _explain(dbapi_connection, dialect: str, sql: str, params) -> List[str]:
+    # A plain DBAPI cursor, so the EXPLAIN is not itself timed and logged
+    cursor = dbapi_connection.cursor(sqlite3.Cursor) if dialect == "sqlite" else dbapi_connection.cursor()
+    try:
+        if dialect == "sqlite":
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params or ())
+            return [row[-1] for row in cursor.fetchall()]
+        cursor.execute("EXPLAIN " + sql, params or None)
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def observe(sql: str, params: Any, seconds: float, dbapi_connection=None, dialect: str = "sqlite",
+            executemany: bool = False):
+    """Called after every statement; returns immediately unless it is slow or sampled"""
+    slow = SLOW_QUERY_MS > 0 and seconds * 1000 >= SLOW_QUERY_MS
+    if slow:
+        if SLOW_QUERY_SAMPLE < 1 and random.random() >= SLOW_QUERY_SAMPLE:
+            return
+    elif not (SQL_TRACE_SAMPLE > 0 and random.random() < SQL_TRACE_SAMPLE):
+        return
+
+    entry: Dict[str, Any] = {
+        "kind": "slow" if slow else "trace",
+        "at": time.time(),
+        "duration_ms": round(seconds * 1000, 3),
+        "sql": " ".join(sql.split()),
+        "params": repr(params)[:MAX_PARAMS_LENGTH],
+        **_context.get(),
+    }
+    if slow and SLOW_QUERY_EXPLAIN and dbapi_connection is not None and not executemany:
+        try:
+            entry["plan"] = _explain(dbapi_connection, dialect, sql, params)
+        except Exception as e:
+            entry["plan_error"] = str(e)
+
+    _recent.append(entry)
+    if slow:
+        logger.warning("slow query %s", json.dumps(entry, default=str))
+    else:
+        logger.info("sql trace %s", json.dumps(entry, default=str))
+
+
+def recent(limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Most recent logged statements, newest first"""
+    entries = list(_recent)[::-1]
+    return entries[:limit] if limit else entries
@@ -0,0 +1,287 @@
+"""Streaming export of tables and view results (GET /api/t/{table}/export, GET /api/view/{id}/export).
+
+Rows are produced in batches of batch_size and each batch is encoded and
+handed to the server before the next one is read, so memory does not grow
+with the size of the export:
+- table records are read by keyset pagination on id, one short query per
+  batch, so an export to a slow client never holds a read lock on SQLite;
+- a view's result is one stored JSON array, which is fetched as text and
+  decoded one element at a time instead of into a list of dicts.
+
+Formats: csv, ndjson, and parquet / arrow (Arrow IPC stream) when pyarrow is
+installed, where every batch becomes one row group / record batch.
+`fields=a,b` projects and orders the columns; by default a table exports id
+plus its fields and a view the keys of its first batch. NDJSON without
+`fields` writes rows as they are.
+"""
+import csv
+import io
+import json
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from urllib.parse import quote
+
+from database import execute_sql
+import metrics
+from typed_storage import field_attr, load_data
+
+MEDIA_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+EXTENSIONS = {'csv': 'csv', 'ndjson': 'ndjson', 'parquet': 'parquet', 'arrow': 'arrows'}
+BATCH_SIZE = 5000
+MAX_BATCH_SIZE = 50000
+_SEPARATORS = re.compile(r'[\s,]*')
+
+
+class RecordExportError(ValueError):
+    """Raised when an export request cannot start (format, fields)"""
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise RecordExportError("parquet and arrow exports need pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+def check_format(fmt: Optional[str]) -> str:
+    fmt = (fmt or 'csv').lower()
+    if fmt not in MEDIA_TYPES:
+        raise RecordExportError(f"Unknown export format: {fmt} (expected one of {', '.join(MEDIA_TYPES)})")
+    if fmt in ('parquet', 'arrow'):
+        _pyarrow()
+    return fmt
+
+
+def parse_fields(text: Optional[str], known: Optional[List[str]] = None) -> Optional[List[str]]:
+    """Projected columns from `fields=a,b`; checked against known when given"""
+    if not text:
+        return None
+    columns = [name.strip() for name in text.split(',') if name.strip()]
+    unknown = [name for name in columns if known is not None and name not in known]
+    if unknown:
+        raise RecordExportError(f"Unknown fields: {', '.join(unknown)}")
+    return columns
+
+
+def content_disposition(name: str, fmt: str) -> str:
+    """Attachment header; names may be non-ASCII (view names), which headers cannot carry directly"""
+    filename = f"{name}.{EXTENSIONS[fmt]}"
+    fallback = re.sub(r'[^A-Za-z0-9._-]', '_', filename)
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def table_columns(fields: List[Any]) -> List[str]:
+    return ['id'] + [field_attr(f, 'name') for f in fields]
+
+
+def table_batches(conn, table_id: int, batch_size: int = BATCH_SIZE) -> Iterator[List[Dict[str, Any]]]:
+    """A table's records, flattened to {'id', **data}, in id order"""
+    last_id = 0
+    while True:
+        rows = execute_sql(conn, "SELECT id, data FROM records WHERE table_id = :table_id AND id > :last_id "
+                                 "ORDER BY id LIMIT :limit",
+                           {'table_id': table_id, 'last_id': last_id, 'limit': batch_size}).fetchall()
+        if not rows:
+            return
+        yield [{'id': row[0], **load_data(row[1])} for row in rows]
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1][0]
+
+
+def _json_array(text: str) -> Iterator[Any]:
+    """Elements of a JSON array text, decoded one at a time"""
+    decoder = json.JSONDecoder()
+    start = text.find('[')
+    if start < 0:
+        return
+    pos = _SEPARATORS.match(text, start + 1).end()
+    while pos < len(text) and text[pos] != ']':
+        value, pos = decoder.raw_decode(text, pos)
+        yield value
+        pos = _SEPARATORS.match(text, pos).end()
+
+
+def view_batches(conn, view_id: int, batch_size: int = BATCH_SIZE) -> Iterator[List[Dict[str, Any]]]:
+    """Rows of a stored view result"""
+    row = execute_sql(conn, "SELECT CAST(data AS TEXT) FROM views WHERE id = :view_id",
+                      {'view_id': view_id}).fetchone()
+    batch = []
+    for value in _json_array(row[0] if row and row[0] else '[]'):
+        batch.append(value if isinstance(value, dict) else {'value': value})
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _cell(value: Any) -> Any:
+    return json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else value
+
+
+def _csv(batches: Iterable[List[Dict[str, Any]]], columns: List[str]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows([_cell(row.get(name)) for name in columns] for row in batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _ndjson(batches: Iterable[List[Dict[str, Any]]], columns: Optional[List[str]]) -> Iterator[bytes]:
+    for batch in batches:
+        if columns is not None:
+            batch = [{name: row.get(name) for name in columns} for row in batch]
+        yield ''.join(json.dumps(row, ensure_ascii=False, default=str) + '\n' for row in batch).encode('utf-8')
+
+
+class _Sink:
+    """Write-only file for pyarrow whose output is drained after every batch"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _arrow_kind(values: Iterable[Any]) -> str:
+    kinds = {'bool' if isinstance(v, bool) else 'number' if isinstance(v, (int, float)) else 'string'
+             for v in values if v is not None}
+    return kinds.pop() if len(kinds) == 1 else 'string'
+
+
+def _arrow_value(kind: str, value: Any) -> Any:
+    if value is None:
+        return None
+    if kind == 'number':
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    if kind == 'int':
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+    if kind == 'bool':
+        return bool(value)
+    return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+
+
+def _arrow_writer(pa, sink: _Sink, schema, fmt: str):
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema)
+    return pa.ipc.new_stream(pa.PythonFile(sink, mode='w'), schema)
+
+
+def _arrow(batches: Iterable[List[Dict[str, Any]]], columns: Optional[List[str]], kinds: Dict[str, str],
+           fmt: str) -> Iterator[bytes]:
+    pa = _pyarrow()
+    types = {'number': pa.float64(), 'int': pa.int64(), 'bool': pa.bool_(), 'string': pa.string()}
+    sink = _Sink()
+    writer = schema = None
+    for batch in batches:
+        if writer is None:
+            # The schema is fixed by the first batch: field types for tables, the values seen for views
+            columns = columns or _first_keys(batch)
+            kinds = {name: kinds.get(name) or _arrow_kind(row.get(name) for row in batch) for name in columns}
+            schema = pa.schema([(name, types[kinds[name]]) for name in columns])
+            writer = _arrow_writer(pa, sink, schema, fmt)
+        arrays = [pa.array([_arrow_value(kinds[name], row.get(name)) for row in batch], type=schema.field(name).type)
+                  for name in columns]
+        record_batch = pa.RecordBatch.from_arrays(arrays, schema=schema)
+        if fmt == 'parquet':
+            writer.write_table(pa.Table.from_batches([record_batch]))
+        else:
+            writer.write_batch(record_batch)
+        yield sink.drain()
+    if writer is None:
+        # Nothing to export: still a valid file with the known columns
+        schema = pa.schema([(name, types[kinds.get(name) or 'string']) for name in columns or []])
+        writer = _arrow_writer(pa, sink, schema, fmt)
+    writer.close()
+    yield sink.drain()
+
+
+def _first_keys(batch: List[Dict[str, Any]]) -> List[str]:
+    keys: Dict[str, None] = {}
+    for row in batch:
+        keys.update(dict.fromkeys(row))
+    return list(keys)
+
+
+def encode(batches: Iterable[List[Dict[str, Any]]], fmt: str, columns: Optional[List[str]] = None,
+           kinds: Optional[Dict[str, str]] = None) -> Iterator[bytes]:
+    """Encoded chunks of an export, one per batch"""
+
+    def counted(source):
+        for batch in source:
+            metrics.EXPORT_ROWS.inc(fmt, amount=len(batch))
+            yield batch
+
+    batches = counted(batches)
+    if fmt == 'ndjson':
+        return _ndjson(batches, columns)
+    if fmt == 'csv':
+        if columns is None:
+            # Header from the first batch's keys
+            first = next(batches, [])
+            columns = _first_keys(first)
+            batches = _chain(first, batches)
+        return _csv(batches, columns)
+    return _arrow(batches, columns, kinds or {}, fmt)
+
+
+def _chain(first: List[Dict[str, Any]], rest: Iterator[List[Dict[str, Any]]]) -> Iterator[List[Dict[str, Any]]]:
+    if first:
+        yield first
+    yield from rest
+
+
+def export_table(conn, table_id: int, fields: List[Any], fmt: str, columns: Optional[List[str]] = None,
+                 batch_size: int = BATCH_SIZE) -> Iterator[bytes]:
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+    kinds = {'id': 'int'}
+    for field in fields:
+        field_type = field_attr(field, 'field_type')
+        kinds[field_attr(field, 'name')] = 'number' if field_type == 'number' else \
+            'int' if field_type == 'relation' else 'string'
+    return encode(table_batches(conn, table_id, batch_size), fmt, columns or table_columns(fields), kinds)
+
+
+def export_view(conn, view_id: int, fmt: str, columns: Optional[List[str]] = None,
+                batch_size: int = BATCH_SIZE) -> Iterator[bytes]:
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+    return encode(view_batches(conn, view_id, batch_size), fmt, columns)
@@ -0,0 +1,185 @@
+"""Streaming CSV / NDJSON import into a table (POST /api/t/{table}/import).
+
+The upload is read row by row from a binary file (the spooled upload in
+main.py, a temporary file in advanced_server.py), so a 20M-row feed never
+becomes a Python list: rows are validated and inserted chunk_size at a time,
+each chunk in its own transaction, and the job's progress is updated after
+every commit. A failed or cancelled import keeps the chunks committed before
+it stopped; `inserted` in the job tells how far it got.
+
+Columns map onto the table's fields through an explicit {column: field}
+mapping (null skips a column), else by field name, else by display name,
+ignoring case. Other columns are skipped and listed in `unmapped_columns`.
+Empty cells count as missing, so field defaults apply. Invalid rows are
+counted and the first MAX_ERRORS are reported by row number (1 = first data row).
+"""
+import csv
+import io
+import itertools
+import json
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Union
+
+from database import execute_sql, sql_dialect
+from record_validation import RecordValidationError, TableValidator
+import metrics
+import table_stats
+import typed_storage
+from typed_storage import field_attr
+
+FORMATS = ('csv', 'ndjson')
+CHUNK_SIZE = 1000
+MAX_CHUNK_SIZE = 50000
+MAX_ERRORS = 100
+
+
+class RecordImportError(ValueError):
+    """Raised when an import request cannot start (format, mapping)"""
+
+
+def detect_format(fmt: Optional[str], filename: Optional[str] = None, content_type: Optional[str] = None) -> str:
+    """Explicit format, else guessed from the file name or content type"""
+    if fmt:
+        fmt = fmt.lower()
+        if fmt not in FORMATS:
+            raise RecordImportError(f"Unknown import format: {fmt} (expected one of {', '.join(FORMATS)})")
+        return fmt
+    name, ctype = (filename or '').lower(), (content_type or '').lower()
+    if name.endswith(('.ndjson', '.jsonl')) or 'ndjson' in ctype or 'jsonl' in ctype:
+        return 'ndjson'
+    if name.endswith('.csv') or 'csv' in ctype:
+        return 'csv'
+    raise RecordImportError("Cannot tell the import format, pass format=csv or format=ndjson")
+
+
+def parse_mapping(text: Optional[str], fields: List[Any]) -> Dict[str, Optional[str]]:
+    """{column: field} mapping from its JSON text, checked against the table's fields"""
+    if not text:
+        return {}
+    try:
+        mapping = json.loads(text)
+    except ValueError as e:
+        raise RecordImportError(f"mapping is not valid JSON: {e}")
+    if not isinstance(mapping, dict):
+        raise RecordImportError("mapping must be a JSON object of column -> field name")
+    names = {field_attr(f, 'name') for f in fields}
+    unknown = sorted(str(target) for target in mapping.values() if target is not None and target not in names)
+    if unknown:
+        raise RecordImportError(f"mapping targets unknown fields: {', '.join(unknown)}")
+    return mapping
+
+
+class ColumnMap:
+    """Resolves source columns to field names once per column"""
+
+    def __init__(self, fields: List[Any], mapping: Optional[Dict[str, Optional[str]]] = None):
+        self.mapping = mapping or {}
+        self.by_name = {str(field_attr(f, 'name')).lower(): field_attr(f, 'name') for f in fields}
+        self.by_display = {str(field_attr(f, 'display_name') or '').strip().lower(): field_attr(f, 'name')
+                           for f in fields if field_attr(f, 'display_name')}
+        self.columns: Dict[str, Optional[str]] = {}
+        self.unmapped: List[str] = []
+
+    def resolve(self, column: str) -> Optional[str]:
+        if column in self.mapping:
+            return self.mapping[column]
+        key = str(column).strip().lower()
+        return self.by_name.get(key) or self.by_display.get(key)
+
+    def apply(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        data = {}
+        for column, value in row.items():
+            if column not in self.columns:
+                self.columns[column] = target = self.resolve(column)
+                if target is None and column not in self.mapping:
+                    self.unmapped.append(column)
+            target = self.columns[column]
+            if target is not None and value is not None and value != '':
+                data[target] = value
+        return data
+
+
+def _lines(stream: BinaryIO) -> Iterator[str]:
+    # utf-8-sig drops the BOM that spreadsheet exports start with
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        yield from text
+    finally:
+        # Detached, the wrapper does not close the stream, whose position is the progress
+        text.detach()
+
+
+def read_csv(stream: BinaryIO) -> Iterator[Dict[str, str]]:
+    reader = csv.reader(_lines(stream))
+    header = next(reader, None)
+    if header is None:
+        return
+    for values in reader:
+        if values:
+            yield dict(zip(header, values))
+
+
+def read_ndjson(stream: BinaryIO) -> Iterator[Union[Dict[str, Any], ValueError]]:
+    """Objects, one per line; a line that is not one yields a ValueError instead"""
+    for line in _lines(stream):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield ValueError(f"invalid JSON: {e}")
+            continue
+        yield row if isinstance(row, dict) else ValueError("expected a JSON object")
+
+
+READERS = {'csv': read_csv, 'ndjson': read_ndjson}
+
+
+def _insert(conn, table_id: int, rows: List[Dict[str, Any]], typed_fields) -> List[int]:
+    returning = sql_dialect(conn) == 'postgresql'
+    sql = "INSERT INTO records (table_id, data) VALUES (:table_id, :data)" + (" RETURNING id" if returning else "")
+    ids = []
+    for data in rows:
+        result = execute_sql(conn, sql, {'table_id': table_id, 'data': json.dumps(data)})
+        record_id = result.scalar() if returning else result.lastrowid
+        if typed_fields is not None:
+            typed_storage.upsert_row(conn, table_id, typed_fields, record_id, data)
+        ids.append(record_id)
+    return ids
+
+
+def import_records(conn, table_id: int, fields: List[Any], validator: TableValidator, stream: BinaryIO,
+                   fmt: str, job, mapping: Optional[Dict[str, Optional[str]]] = None, typed_fields=None,
+                   chunk_size: int = CHUNK_SIZE,
+                   on_insert: Optional[Callable[[List[int]], None]] = None) -> Dict[str, Any]:
+    """Import stream into the table in chunked transactions; returns the final progress"""
+    chunk_size = max(1, min(chunk_size, MAX_CHUNK_SIZE))
+    columns = ColumnMap(fields, mapping)
+    rows = (row if isinstance(row, ValueError) else columns.apply(row) for row in READERS[fmt](stream))
+    progress = {'rows': 0, 'inserted': 0, 'failed': 0, 'errors': [], 'unmapped_columns': columns.unmapped}
+    while not job.cancelled:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        valid = []
+        for number, data in enumerate(chunk, start=progress['rows'] + 1):
+            try:
+                if isinstance(data, ValueError):
+                    raise RecordValidationError({'_row': str(data)})
+                valid.append(validator.validate(data))
+            except RecordValidationError as e:
+                progress['failed'] += 1
+                if len(progress['errors']) < MAX_ERRORS:
+                    progress['errors'].append({'row': number, 'errors': e.errors})
+        ids = _insert(conn, table_id, valid, typed_fields)
+        conn.commit()
+        progress['rows'] += len(chunk)
+        progress['inserted'] += len(ids)
+        metrics.IMPORT_ROWS.inc('inserted', amount=len(ids))
+        metrics.IMPORT_ROWS.inc('failed', amount=len(chunk) - len(ids))
+        table_stats.record_writes(conn, table_id, inserted=len(ids))
+        if ids and on_insert:
+            on_insert(ids)
+        job.update(**{**progress, 'errors': list(progress['errors']), 'unmapped_columns': list(columns.unmapped),
+                      'bytes_read': stream.tell()})
+    return {**progress, 'unmapped_columns': list(columns.unmapped)}
@@ -0,0 +1,31 @@
+"""Partial record updates (PATCH with Content-Type: application/merge-patch+json).
+
+A plain PATCH replaces a record's data with the body's `data`. A merge patch
+(RFC 7396, one level deep) carries only the changed fields: each one replaces
+its value, null removes it, and the fields not mentioned stay as stored. The
+patch is applied by the database in a single UPDATE (json_set / json_remove
+on SQLite, jsonb || and - on PostgreSQL), so a one-cell edit neither ships nor
+rewrites the whole document, and concurrent edits of different cells no
+longer overwrite each other.
+"""
+from typing import Any, Dict, Optional
+
+from database import execute_sql, json_merge_sql
+import typed_storage
+
+MERGE_PATCH = 'application/merge-patch+json'
+
+
+def is_merge_patch(content_type: Optional[str]) -> bool:
+    return (content_type or '').split(';')[0].strip().lower() == MERGE_PATCH
+
+
+def merge_record(conn, table_id: int, record_id: int, patch: Dict[str, Any], typed_fields=None) -> int:
+    """Apply an already validated patch to a record's data; returns the number of rows updated"""
+    data_sql, params = json_merge_sql(conn, 'data', patch)
+    result = execute_sql(conn, f"UPDATE records SET data = {data_sql}, updated_at = CURRENT_TIMESTAMP "
+                               f"WHERE id = :record_id AND table_id = :table_id",
+                         {**params, 'record_id': record_id, 'table_id': table_id})
+    if result.rowcount and typed_fields is not None:
+        typed_storage.update_row(conn, table_id, typed_fields, record_id, patch)
+    return result.rowcount
@@ -0,0 +1,144 @@
+"""Schema-aware validation and coercion of record data.
+
+A validator is compiled once per table from its Field list and cached under a
+fingerprint of that list, so it is rebuilt automatically after any schema
+change (in this process or another one sharing the database).
+"""
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from profiling import record_cache
+from typed_storage import coerce_value, field_attr, load_options
+
+
+class RecordValidationError(ValueError):
+    """Raised when record data does not match the table schema"""
+
+    def __init__(self, errors: Dict[str, str]):
+        super().__init__('; '.join(f"{name}: {message}" for name, message in errors.items()))
+        self.errors = errors
+
+
+def schema_fingerprint(fields: List[Any]) -> Tuple:
+    """Hashable summary of everything in a Field list that affects validation"""
+    return tuple(
+        (field_attr(f, 'name'), field_attr(f, 'field_type'), bool(field_attr(f, 'required', False)),
+         json.dumps(load_options(field_attr(f, 'options')), sort_keys=True), field_attr(f, 'default_value'))
+        for f in fields
+    )
+
+
+def _number_checker() -> Callable[[Any], Any]:
+    def check(value):
+        coerced = coerce_value('number', value)
+        if coerced is None:
+            raise ValueError(f"expected a number, got {value!r}")
+        return coerced
+    return check
+
+
+def _relation_checker() -> Callable[[Any], Any]:
+    def check(value):
+        coerced = coerce_value('relation', value)
+        if coerced is None:
+            raise ValueError(f"expected a record id, got {value!r}")
+        return coerced
+    return check
+
+
+def _select_checker(choices: List[Any]) -> Callable[[Any], Any]:
+    allowed = {str(choice) for choice in choices}
+
+    def check(value):
+        if allowed and str(value) not in allowed:
+            raise ValueError(f"{value!r} is not one of {sorted(allowed)}")
+        return value
+    return check
+
+
+def _text_checker() -> Callable[[Any], Any]:
+    def check(value):
+        return value if isinstance(value, str) else coerce_value('text', value)
+    return check
+
+
+class TableValidator:
+    """Per-table validator compiled from a Field list"""
+
+    def __init__(self, fields: List[Any]):
+        self.checkers = []
+        for field in fields:
+            name = field_attr(field, 'name')
+            field_type = field_attr(field, 'field_type') or 'text'
+            options = load_options(field_attr(field, 'options'))
+            if field_type == 'number':
+                checker = _number_checker()
+            elif field_type == 'relation':
+                checker = _relation_checker()
+            elif field_type == 'select':
+                checker = _select_checker(options.get('choices') or options.get('options') or [])
+            else:
+                checker = _text_checker()
+            self.checkers.append((name, checker, bool(field_attr(field, 'required', False)),
+                                  field_attr(field, 'default_value')))
+
+    def validate(self, data: Dict[str, Any], check_required: bool = True, partial: bool = False) -> Dict[str, Any]:
+        """Return a coerced copy of data or raise RecordValidationError.
+
+        partial=True validates only the keys present (for patches) and skips defaults.
+        """
+        result = dict(data)
+        errors = {}
+        for name, checker, required, default in self.checkers:
+            if name not in data:
+                if partial:
+                    continue
+                if default is not None:
+                    result[name] = default
+            value = result.get(name)
+            if value is None or value == '':
+                if required and check_required:
+                    errors[name] = "field is required"
+                continue
+            try:
+                result[name] = checker(value)
+            except ValueError as e:
+                errors[name] = str(e)
+        if errors:
+            raise RecordValidationError(errors)
+        return result
+
+    def validate_many(self, rows: List[Dict[str, Any]], check_required: bool = True
+                      ) -> Tuple[List[Tuple[int, Dict[str, Any]]], List[Dict[str, Any]]]:
+        """Split rows into (index, coerced data) pairs and per-row error reports"""
+        valid, errors = [], []
+        for index, data in enumerate(rows):
+            try:
+                valid.append((index, self.validate(data, check_required=check_required)))
+            except RecordValidationError as e:
+                errors.append({'index': index, 'errors': e.errors})
+        return valid, errors
+
+
+_validators: Dict[int, Tuple[Tuple, TableValidator]] = {}
+
+
+def get_validator(table_id: int, fields: List[Any]) -> TableValidator:
+    """Cached validator for a table, recompiled whenever its fields change"""
+    fingerprint = schema_fingerprint(fields)
+    cached = _validators.get(table_id)
+    hit = cached is not None and cached[0] == fingerprint
+    record_cache('validator', hit)
+    if hit:
+        return cached[1]
+    validator = TableValidator(fields)
+    _validators[table_id] = (fingerprint, validator)
+    return validator
+
+
+def invalidate(table_id: Optional[int] = None):
+    """Drop cached validators (all of them when table_id is None)"""
+    if table_id is None:
+        _validators.clear()
+    else:
+        _validators.pop(table_id, None)
@@ -0,0 +1,96 @@
+"""Server-side resolution of relation fields.
+
+Relation fields store the id of a record in options['relation_table']. Instead
+of clients downloading the whole related table, a page of records is expanded
+with one IN (...) lookup per relation, and dropdowns use prefix search.
+"""
+from typing import Any, Dict, Iterable, List, Optional
+
+from database import execute_sql, json_field_sql
+from typed_storage import coerce_value, field_attr, load_data, load_options
+
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 200
+
+
+def relation_targets(fields: Iterable[Any]) -> Dict[str, str]:
+    """Map relation field names to the name of the table they point at"""
+    targets = {}
+    for field in fields:
+        if field_attr(field, 'field_type') == 'relation':
+            relation_table = load_options(field_attr(field, 'options')).get('relation_table')
+            if relation_table:
+                targets[field_attr(field, 'name')] = relation_table
+    return targets
+
+
+def parse_expand(expand: Optional[str]) -> List[str]:
+    return [name.strip() for name in (expand or '').split(',') if name.strip()]
+
+
+def fetch_by_ids(conn, table_name: str, ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+    """Fetch records of a table by id in a single query"""
+    ids = sorted(set(ids))
+    if not ids:
+        return {}
+    table = execute_sql(conn, "SELECT id FROM tables WHERE name = :name AND deleted_at IS NULL",
+                        {'name': table_name}).fetchone()
+    if not table:
+        return {}
+    params = {'table_id': table[0]}
+    placeholders = []
+    for i, record_id in enumerate(ids):
+        params[f'id{i}'] = record_id
+        placeholders.append(f':id{i}')
+    rows = execute_sql(conn, f"SELECT id, data FROM records WHERE table_id = :table_id "
+                             f"AND id IN ({', '.join(placeholders)})", params).fetchall()
+    return {row[0]: {'id': row[0], **load_data(row[1])} for row in rows}
+
+
+def expand_relations(conn, fields: Iterable[Any], records: List[Dict[str, Any]],
+                     expand: List[str]) -> List[Dict[str, Any]]:
+    """Attach the referenced records of the requested relation fields to each record.
+
+    records are record API dicts ({'id', 'data', ...}); each gets an 'expanded'
+    dict mapping field name to the related record (or None if it is missing).
+    """
+    targets = relation_targets(fields)
+    wanted = [name for name in expand if name in targets]
+    if not wanted:
+        return records
+
+    for name in wanted:
+        ids = [coerce_value('relation', r['data'].get(name)) for r in records]
+        related = fetch_by_ids(conn, targets[name], [i for i in ids if i is not None])
+        for record, related_id in zip(records, ids):
+            record.setdefault('expanded', {})[name] = related.get(related_id)
+    return records
+
+
+def _escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_records(conn, table_id: int, field: str, prefix: str,
+                   limit: int = SEARCH_LIMIT) -> List[Dict[str, Any]]:
+    """Records whose field starts with prefix, for relation dropdowns"""
+    limit = max(1, min(int(limit), MAX_SEARCH_LIMIT))
+    value_sql, params = json_field_sql(conn, 'data', field, 'field_path')
+    params.update({'table_id': table_id, 'prefix': _escape_like(prefix) + '%', 'limit': limit})
+    rows = execute_sql(conn, f"SELECT id, data FROM records WHERE table_id = :table_id "
+                             f"AND {value_sql} LIKE :prefix ESCAPE '\\' ORDER BY {value_sql}, id LIMIT :limit",
+                       params).fetchall()
+    results = []
+    for row in rows:
+        data = load_data(row[1])
+        results.append({'id': row[0], 'label': data.get(field), 'data': data})
+    return results
+
+
+def label_field(fields: Iterable[Any]) -> Optional[str]:
+    """Default field to search and display related records by (first text field)"""
+    fields = list(fields)
+    for field in fields:
+        if field_attr(field, 'field_type') == 'text':
+            return field_attr(field, 'name')
+    return field_attr(fields[0], 'name') if fields else None
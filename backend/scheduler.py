@@ -0,0 +1,278 @@
+"""Scheduled canvas execution.
+
+Schedules are stored in the schedules table: a canvas, a cron expression
+(five fields "minute hour day month weekday", local server time, or a macro
+like @hourly), an overlap policy and how many views to keep for the canvas.
+
+Both servers run a Scheduler thread that polls for due schedules. A due
+schedule is claimed with a compare-and-set on next_run_at/running_since, so
+several processes on one database never start the same slot twice, and a
+schedule whose previous run has not finished is
+    skip   - moved on to its next slot (the slot is recorded as skipped), or
+    queue  - left due, so it runs as soon as the previous run finishes; any
+             number of missed slots collapse into that one run.
+Every schedule fires a stable jitter_seconds offset after its cron time,
+derived from its id, so many "*/5 * * * *" schedules do not all start in the
+same second. After a run the canvas keeps only its newest keep_views views.
+"""
+import os
+import threading
+import time
+import traceback
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from canvas_runs import load_canvas, prune_views, save_view
+import change_feed
+from database import execute_sql
+import metrics
+import query_log
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1").lower() not in ("0", "false", "no")
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS") or 2)
+POLL_SECONDS = float(os.getenv("SCHEDULER_POLL_SECONDS") or 1.0)
+# A run that has not finished after this long is assumed dead (e.g. the process was killed)
+STALE_RUN_SECONDS = 3600
+OVERLAP_POLICIES = ('skip', 'queue')
+DEFAULT_JITTER_SECONDS = 30
+DEFAULT_KEEP_VIEWS = 10
+MAX_SEARCH_YEARS = 5
+
+MACROS = {
+    '@yearly': '0 0 1 1 *', '@annually': '0 0 1 1 *', '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0', '@daily': '0 0 * * *', '@midnight': '0 0 * * *', '@hourly': '0 * * * *',
+}
+MONTH_NAMES = {name: i + 1 for i, name in enumerate(
+    ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'])}
+DAY_NAMES = {name: i for i, name in enumerate(['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'])}
+
+
+class ScheduleError(ValueError):
+    """Invalid schedule configuration"""
+
+
+def _parse_field(text: str, low: int, high: int, names: Dict[str, int]) -> Set[int]:
+    def value(item: str) -> int:
+        return names[item] if item in names else int(item)
+
+    values: Set[int] = set()
+    for part in text.lower().split(','):
+        spec, _, step_text = part.partition('/')
+        step = int(step_text) if step_text else 1
+        if spec == '*':
+            start, end = low, high
+        elif '-' in spec:
+            start, end = (value(item) for item in spec.split('-', 1))
+        else:
+            # "5/15" means every 15 starting at 5
+            start = value(spec)
+            end = high if step_text else start
+        if step < 1 or start < low or end > high or start > end:
+            raise ScheduleError(f"Cron field out of range: {text}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronExpression:
+    """Standard five field cron expression"""
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        fields = MACROS.get(expression.strip().lower(), expression).split()
+        if len(fields) != 5:
+            raise ScheduleError(f"Cron expression needs 5 fields: {expression!r}")
+        try:
+            self.minutes = _parse_field(fields[0], 0, 59, {})
+            self.hours = _parse_field(fields[1], 0, 23, {})
+            self.days = _parse_field(fields[2], 1, 31, {})
+            self.months = _parse_field(fields[3], 1, 12, MONTH_NAMES)
+            # 0 and 7 are both Sunday
+            self.weekdays = {d % 7 for d in _parse_field(fields[4], 0, 7, DAY_NAMES)}
+        except (KeyError, ValueError) as e:
+            raise ScheduleError(f"Invalid cron expression {expression!r}: {e}")
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    def _day_matches(self, t: datetime) -> bool:
+        in_month = t.day in self.days
+        in_week = (t.weekday() + 1) % 7 in self.weekdays
+        # Like cron: when both day fields are restricted, either one matching is enough
+        if not self._any_day and not self._any_weekday:
+            return in_month or in_week
+        return in_month and in_week
+
+    def next_after(self, after: datetime) -> datetime:
+        """First matching minute strictly after `after` (naive local time)"""
+        t = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = after + timedelta(days=366 * MAX_SEARCH_YEARS)
+        while t <= limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        raise ScheduleError(f"Cron expression never matches: {self.expression!r}")
+
+
+def jitter_offset(schedule_id: int, jitter_seconds: int) -> int:
+    """Stable per schedule delay in [0, jitter_seconds]"""
+    if not jitter_seconds:
+        return 0
+    return zlib.crc32(str(schedule_id).encode()) % (jitter_seconds + 1)
+
+
+def next_run_at(cron: str, schedule_id: int, jitter_seconds: int, after: Optional[float] = None) -> float:
+    """Epoch seconds of the next run after `after` (default now)"""
+    after = time.time() if after is None else after
+    offset = jitter_offset(schedule_id, jitter_seconds)
+    # The cron time of the current slot is what has to be after `after`, not the jittered start
+    slot = CronExpression(cron).next_after(datetime.fromtimestamp(after - offset))
+    return slot.timestamp() + offset
+
+
+def validate(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalized schedule settings from an API payload"""
+    if not data.get('canvas_id'):
+        raise ScheduleError("canvas_id is required")
+    cron = (data.get('cron') or '').strip()
+    CronExpression(cron)
+    overlap = data.get('overlap') or 'skip'
+    if overlap not in OVERLAP_POLICIES:
+        raise ScheduleError(f"Unknown overlap policy: {overlap}")
+    jitter = data.get('jitter_seconds')
+    jitter = DEFAULT_JITTER_SECONDS if jitter is None else int(jitter)
+    keep = data.get('keep_views')
+    keep = DEFAULT_KEEP_VIEWS if keep is None else int(keep)
+    if jitter < 0 or keep < 0:
+        raise ScheduleError("jitter_seconds and keep_views must be >= 0")
+    return {'canvas_id': int(data['canvas_id']), 'cron': cron, 'overlap': overlap, 'jitter_seconds': jitter,
+            'keep_views': keep, 'enabled': bool(data.get('enabled', True))}
+
+
+def arm(conn, schedule_id: int):
+    """Compute next_run_at of a new or re-enabled schedule; caller commits"""
+    row = execute_sql(conn, "SELECT cron, jitter_seconds FROM schedules WHERE id = :id", {'id': schedule_id}).fetchone()
+    if row is not None:
+        execute_sql(conn, "UPDATE schedules SET next_run_at = :next WHERE id = :id",
+                    {'next': next_run_at(row[0], schedule_id, row[1] or 0), 'id': schedule_id})
+
+
+class Scheduler:
+    def __init__(self, connect: Callable[[], Any], workers: int = SCHEDULER_WORKERS):
+        self.connect = connect  # new connection/session for polling and for each run
+        self.workers = workers
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def start(self):
+        if not SCHEDULER_ENABLED or self._thread is not None:
+            return
+        self._stop.clear()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='schedule')
+        self._thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def _loop(self):
+        while not self._stop.wait(POLL_SECONDS):
+            try:
+                for schedule in self.claim_due():
+                    self._pool.submit(self._run, schedule)
+            except Exception:
+                traceback.print_exc()
+
+    def claim_due(self, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Claim the schedules that are due and may run; skipped slots are recorded here"""
+        now = time.time() if now is None else now
+        conn = self.connect()
+        claimed = []
+        try:
+            rows = execute_sql(conn, "SELECT id, canvas_id, cron, overlap, jitter_seconds, keep_views, next_run_at, "
+                                     "running_since FROM schedules WHERE enabled = :enabled "
+                                     "AND (next_run_at IS NULL OR next_run_at <= :now)",
+                               {'enabled': True, 'now': now}).fetchall()
+            for row in rows:
+                schedule = {'id': row[0], 'canvas_id': row[1], 'cron': row[2], 'overlap': row[3],
+                            'jitter_seconds': row[4] or 0, 'keep_views': row[5], 'due': row[6]}
+                if schedule['due'] is None:
+                    arm(conn, schedule['id'])
+                    continue
+                following = next_run_at(schedule['cron'], schedule['id'], schedule['jitter_seconds'], now)
+                params = {'id': schedule['id'], 'due': schedule['due'], 'next': following, 'now': now,
+                          'stale': now - STALE_RUN_SECONDS}
+                if row[7] is not None and row[7] >= now - STALE_RUN_SECONDS:
+                    if schedule['overlap'] == 'skip':
+                        moved = execute_sql(conn, "UPDATE schedules SET next_run_at = :next, last_status = 'skipped' "
+                                                  "WHERE id = :id AND next_run_at = :due", params).rowcount
+                        if moved:
+                            metrics.SCHEDULE_RUNS.inc('skipped')
+                    # queue: stays due and is claimed once the running one finishes
+                    continue
+                won = execute_sql(conn, "UPDATE schedules SET next_run_at = :next, running_since = :now "
+                                        "WHERE id = :id AND next_run_at = :due "
+                                        "AND (running_since IS NULL OR running_since < :stale)", params).rowcount
+                if won:
+                    claimed.append(schedule)
+            conn.commit()
+        finally:
+            conn.close()
+        return claimed
+
+    def _run(self, schedule: Dict[str, Any]):
+        try:
+            self.run_schedule(schedule)
+        except Exception:
+            traceback.print_exc()
+
+    def run_schedule(self, schedule: Dict[str, Any]) -> Optional[int]:
+        """Execute a claimed schedule's canvas, save the view and apply retention; returns the view id"""
+        from canvas_executor import CanvasExecutor  # not needed until the first run
+        conn = self.connect()
+        started = time.perf_counter()
+        try:
+            canvas = load_canvas(conn, schedule['canvas_id'])
+            if canvas is None:
+                raise ScheduleError(f"Canvas {schedule['canvas_id']} not found")
+            with query_log.scope(schedule=schedule['id'], canvas=schedule['canvas_id']):
+                data = CanvasExecutor(conn).execute(*canvas)
+            name = f"Schedule_{schedule['id']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            view_id = save_view(conn, schedule['canvas_id'], name, data)
+            pruned = prune_views(conn, schedule['canvas_id'], schedule['keep_views'])
+            _finish(conn, schedule['id'], 'ok', None)
+            conn.commit()
+            change_feed.publish('view', 'insert', id=view_id, name=name, canvas_id=schedule['canvas_id'])
+            if pruned:
+                change_feed.publish('view', 'delete', canvas_id=schedule['canvas_id'])
+            metrics.SCHEDULE_RUNS.inc('ok')
+            return view_id
+        except Exception as e:
+            conn.rollback()
+            _finish(conn, schedule['id'], 'error', str(e))
+            conn.commit()
+            metrics.SCHEDULE_RUNS.inc('error')
+            raise
+        finally:
+            metrics.SCHEDULE_DURATION.observe(time.perf_counter() - started)
+            conn.close()
+
+
+def _finish(conn, schedule_id: int, status: str, error: Optional[str]):
+    execute_sql(conn, "UPDATE schedules SET running_since = NULL, last_run_at = :at, last_status = :status, "
+                      "last_error = :error WHERE id = :id",
+                {'at': datetime.now(timezone.utc).isoformat(), 'status': status, 'error': error, 'id': schedule_id})
@@ -22,13 +22,18 @@ class TableCreate(BaseModel):
     name: str
     display_name: str
     description: Optional[str] = None
+    storage_mode: str = "json"
     fields: List[FieldCreate] = []
 
+class TableStorageUpdate(BaseModel):
+    storage_mode: str
+
 class TableResponse(BaseModel):
     id: int
     name: str
     display_name: str
     description: Optional[str]
+    storage_mode: Optional[str] = "json"
     created_at: datetime
     updated_at: Optional[datetime]
     fields: List[FieldResponse] = []
@@ -39,20 +44,35 @@ class TableResponse(BaseModel):
 # Record schemas
 class RecordCreate(BaseModel):
     data: Dict[str, Any]
+    blank: bool = False  # an empty grid row, filled in cell by cell: required fields are not checked yet
 
 class RecordUpdate(BaseModel):
     data: Dict[str, Any]
 
+class BulkRecordCreate(BaseModel):
+    records: List[Dict[str, Any]]
+
+class BulkRecordResponse(BaseModel):
+    inserted: int
+    ids: List[int]
+    errors: List[Dict[str, Any]] = []  # [{"index": row position, "errors": {field: message}}]
+
 class RecordResponse(BaseModel):
     id: int
     table_id: int
     data: Dict[str, Any]
     created_at: datetime
     updated_at: Optional[datetime]
+    expanded: Optional[Dict[str, Any]] = None  # related records requested via ?expand=
     
     class Config:
         from_attributes = True
 
+class RecordSearchResult(BaseModel):
+    id: int
+    label: Any
+    data: Dict[str, Any]
+
 # Canvas schemas
 class CanvasCreate(BaseModel):
     name: str
@@ -65,6 +85,13 @@ class CanvasUpdate(BaseModel):
     description: Optional[str] = None
     nodes: Optional[List[Dict[str, Any]]] = None
     edges: Optional[List[Dict[str, Any]]] = None
+    retention_keep: Optional[int] = None
+    retention_days: Optional[float] = None
+    retention_bytes: Optional[int] = None
+
+class CanvasOps(BaseModel):
+    version: int
+    ops: List[Dict[str, Any]]
 
 class CanvasResponse(BaseModel):
     id: int
@@ -72,6 +99,10 @@ class CanvasResponse(BaseModel):
     description: Optional[str]
     nodes: List[Dict[str, Any]]
     edges: List[Dict[str, Any]]
+    version: int = 1
+    retention_keep: Optional[int] = None
+    retention_days: Optional[float] = None
+    retention_bytes: Optional[int] = None
     created_at: datetime
     updated_at: Optional[datetime]
     
@@ -84,6 +115,8 @@ class ViewResponse(BaseModel):
     name: str
     canvas_id: int
     data: List[Dict[str, Any]]
+    profile: Optional[Dict[str, Any]] = None
+    size_bytes: Optional[int] = None
     created_at: datetime
     
     class Config:
@@ -93,3 +126,43 @@ class ViewResponse(BaseModel):
 class ExecuteCanvasRequest(BaseModel):
     canvas_id: int
     view_name: Optional[str] = None
+
+# Triggers
+class TriggerCreate(BaseModel):
+    canvas_id: int
+    table_name: str
+    events: List[str] = ["insert", "update", "delete"]
+    mode: str = "delta"  # delta: only changed records where the canvas allows it, full: whole canvas
+    window_ms: int = 500
+    max_batch: int = 1000
+    enabled: bool = True
+
+class TriggerResponse(TriggerCreate):
+    id: int
+    last_run_at: Optional[str] = None
+    last_status: Optional[str] = None
+    last_error: Optional[str] = None
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+# Schedules
+class ScheduleCreate(BaseModel):
+    canvas_id: int
+    cron: str  # five field cron expression or @hourly, @daily, ...
+    overlap: str = "skip"  # skip: drop a slot while the previous run is going, queue: run right after it
+    jitter_seconds: int = 30
+    keep_views: int = 10
+    enabled: bool = True
+
+class ScheduleResponse(ScheduleCreate):
+    id: int
+    next_run_at: Optional[float] = None
+    last_run_at: Optional[str] = None
+    last_status: Optional[str] = None
+    last_error: Optional[str] = None
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
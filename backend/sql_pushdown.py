@@ -0,0 +1,421 @@
+"""SQL generation for canvas work that can run inside the database.
+
+A TableScan starts as "all rows of one table" and canvas nodes directly
+downstream of a tableNode are folded into it when SQL can do their job, so
+the database returns the final rows instead of the executor loading every
+record and post-processing it in Python.
+"""
+import ast
+import json
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from aggregation import AggregateSpec
+from computed import ComputedColumn, output_value
+from database import execute_sql, sql_dialect, sqlite_connection
+from expressions import COMPARE_OPS, Expression, ExpressionError, SqlOperand, compare_values
+from ordering import SortKey
+import typed_storage
+
+
+# Text that float() parses (PostgreSQL regex, case-insensitive): decimal or exponent notation with single
+# underscores between digits, or inf/infinity. 'nan' is left out: SQL has no NaN that compares like Python's
+# (PostgreSQL orders it above every number, SQLite stores NULL), so NaN matches no comparison, not even !=
+_DIGITS = '[0-9](_?[0-9])*'
+_NUMERIC_TEXT_RE = (rf'^[[:space:]]*[+-]?((({_DIGITS})(\.({_DIGITS})?)?|\.{_DIGITS})([e][+-]?{_DIGITS})?'
+                    rf'|inf|infinity)[[:space:]]*$')
+# SQLite has no such pattern matching, so there text is parsed by coerce_value itself (see number_sql),
+# and two arrays/objects, which Python compares structurally, by compare_values (see compare_sql)
+SQLITE_NUMBER_FUNCTION = 'canvas_number'
+SQLITE_COMPARE_FUNCTION = 'canvas_compare'
+# JSON types per kind of value compare_values sees
+_JSON_KINDS = {
+    'sqlite': {'number': ('integer', 'real', 'true', 'false'), 'text': ('text',), 'container': ('array', 'object')},
+    'postgresql': {'number': ('number', 'boolean'), 'text': ('string',), 'container': ('array', 'object')},
+}
+_SQL_COMPARE_OPS = {'=': ast.Eq, '<>': ast.NotEq, '<': ast.Lt, '<=': ast.LtE, '>': ast.Gt, '>=': ast.GtE}
+
+
+def _sqlite_number(value: Any) -> Any:
+    number = typed_storage.coerce_value('number', value)
+    return None if number is None or number != number else number  # SQLite has no NaN
+
+
+def _sqlite_compare(op: str, left: str, right: str) -> int:
+    return int(compare_values(COMPARE_OPS[_SQL_COMPARE_OPS[op]], json.loads(left), json.loads(right)))
+
+
+def register_functions(conn):
+    """Make the functions pushed-down SQL calls available on conn (SQLite only, idempotent)"""
+    if sql_dialect(conn) == 'sqlite':
+        raw = sqlite_connection(conn)
+        raw.create_function(SQLITE_NUMBER_FUNCTION, 1, _sqlite_number, deterministic=True)
+        raw.create_function(SQLITE_COMPARE_FUNCTION, 3, _sqlite_compare, deterministic=True)
+
+
+class _Side(NamedTuple):
+    """A comparison operand as SQL: its kinds ('number', 'text', 'container') and a value per kind"""
+    kinds: Tuple[str, ...]
+    number: Optional[str]
+    text: Optional[str]
+    json_type: Optional[str] = None  # SQL of the JSON type when the kind is only known per row
+    literal: Any = None  # the Python value of a text literal
+
+
+class CompiledScan(NamedTuple):
+    """SQL of a TableScan plus what is needed to decode its rows; holds no connection, so plans can cache it"""
+    sql: str
+    params: Dict[str, Any]
+    typed: bool
+    specs: List[Tuple[str, str]]  # typed columns selected after the id
+    aggregate: Optional[AggregateSpec]
+    projection: Optional[frozenset]
+    computed: Tuple[ComputedColumn, ...] = ()  # selected last
+
+    def rows(self, conn) -> List[Dict[str, Any]]:
+        register_functions(conn)
+        fetched = execute_sql(conn, self.sql, self.params).fetchall()
+        if self.aggregate is not None:
+            return [self.aggregate.make_row(row) for row in fetched]
+        if self.typed:
+            rows = [{'id': row[0], **{name: typed_storage.read_value(field_type, value)
+                                      for (name, field_type), value in zip(self.specs, row[1:])}}
+                    for row in fetched]
+        elif self.projection is not None:
+            rows = []
+            for row in fetched:
+                data = typed_storage.load_data(row[1])
+                rows.append({'id': row[0], **{k: v for k, v in data.items() if k in self.projection}})
+        else:
+            rows = [{'id': row[0], **typed_storage.load_data(row[1])} for row in fetched]
+        if self.computed:
+            start = 1 + len(self.specs) if self.typed else 2
+            for row, values in zip(rows, fetched):
+                for column, value in zip(self.computed, values[start:]):
+                    row[column.name] = output_value(column, value)
+        return rows
+
+
+class TableScan:
+    def __init__(self, conn, table):
+        self.conn = conn
+        self.table = table
+        self.dialect = sql_dialect(conn)
+        self.typed = table.storage_mode == typed_storage.STORAGE_TYPED
+        self.specs = typed_storage.field_specs(table.fields) if self.typed else []
+        self.columns = {name for name, _ in self.specs}
+        self.params: Dict[str, Any] = {'table_id': table.id}
+        self.where: List[str] = []
+        self.aggregate: Optional[AggregateSpec] = None
+        self.order_by: List[SortKey] = []
+        self.limit: Optional[int] = None
+        self.offset = 0
+        self.projection: Optional[frozenset] = None  # fields later operators use; None means all
+        self.computed: Dict[str, Tuple[str, ComputedColumn]] = {}  # computed column -> (SQL, column)
+        self.pushed: List[str] = []  # ids of canvas nodes folded into this scan
+
+    def _bind(self, value: Any) -> str:
+        name = f"p{len(self.params)}"
+        self.params[name] = value
+        return f":{name}"
+
+    def has_field(self, name: str) -> bool:
+        return not self.typed or name in self.columns or name in self.computed
+
+    def field_sql(self, name: str, numeric: bool = False) -> str:
+        """SQL expression for a field value: computed columns, typed columns, JSON otherwise"""
+        if name in self.computed:
+            return self.computed[name][0]
+        if self.typed:
+            return typed_storage.quote_ident(name)
+        # In numeric context a JSON value is read the way the Python side reads it
+        # (typed_storage.coerce_value): numbers and booleans as they are, text parsed like float(),
+        # anything else NULL
+        if numeric:
+            json_type, value = self._json_sql(name)
+            kinds = _JSON_KINDS[self.dialect]
+            return (f"(CASE WHEN {json_type} IN {self._sql_list(kinds['number'])} THEN {self._json_number(json_type, value)} "
+                    f"WHEN {json_type} = '{kinds['text'][0]}' THEN {self.number_sql(value)} END)")
+        return self._json_sql(name)[1]
+
+    def _json_sql(self, name: str) -> Tuple[str, str]:
+        """SQL of a JSON field's type and of its value (numbers as numbers in SQLite, text in PostgreSQL)"""
+        if self.dialect == 'postgresql':
+            key = self._bind(name)
+            return f"jsonb_typeof(data::jsonb -> {key})", f"(data::jsonb ->> {key})"
+        path = self._bind('$."' + name + '"')
+        return f"json_type(data, {path})", f"json_extract(data, {path})"
+
+    def _json_number(self, json_type: str, value: str) -> str:
+        """A JSON number or boolean as a number; booleans are 1/0 like Python's True/False"""
+        if self.dialect == 'postgresql':
+            return (f"(CASE WHEN {json_type} = 'boolean' THEN CASE WHEN {value} = 'true' THEN 1 ELSE 0 END "
+                    f"ELSE {value}::double precision END)")
+        return f"(CASE {json_type} WHEN 'true' THEN 1 WHEN 'false' THEN 0 ELSE {value} END)"
+
+    def number_sql(self, text: str) -> str:
+        """Text parsed as a number exactly when float() parses it (coerce_value), NULL otherwise"""
+        if self.dialect == 'postgresql':
+            trimmed = f"regexp_replace({text}, '^[[:space:]]+|[[:space:]]+$', '', 'g')"
+            return (f"(CASE WHEN {text} ~* '{_NUMERIC_TEXT_RE}' "
+                    f"THEN replace({trimmed}, '_', '')::double precision END)")
+        return f"{SQLITE_NUMBER_FUNCTION}({text})"
+
+    @staticmethod
+    def _sql_list(values: Iterable[str]) -> str:
+        return '(' + ', '.join(f"'{v}'" for v in values) + ')'
+
+    def _field_type(self, name: str) -> Optional[str]:
+        return next((typed_storage.field_attr(f, 'field_type') for f in self.table.fields
+                     if typed_storage.field_attr(f, 'name') == name), None)
+
+    def _side(self, operand: SqlOperand) -> _Side:
+        if operand.kind == 'number':
+            return _Side(('number',), operand.value, None)
+        if operand.kind == 'literal':
+            if operand.value is None:
+                raise ExpressionError("null only compares with = and !=")
+            if isinstance(operand.value, str):
+                return _Side(('text',), None, self._bind(operand.value), literal=operand.value)
+            value = int(operand.value) if isinstance(operand.value, bool) else operand.value
+            return _Side(('number',), self._bind(value), None)
+        name = operand.value
+        if name in self.computed:
+            sql, column = self.computed[name]
+            return _Side(('number',), sql, None) if column.type in ('number', 'boolean') else _Side(('text',), None, sql)
+        if self.typed:
+            column = typed_storage.quote_ident(name)
+            if self._field_type(name) in ('number', 'relation'):
+                return _Side(('number',), column, None)
+            return _Side(('text',), None, column)
+        json_type, value = self._json_sql(name)
+        return _Side(('number', 'text', 'container'), self._json_number(json_type, value), value, json_type)
+
+    def _as_number(self, side: _Side) -> str:
+        """A text operand parsed as a number; literals are parsed right away"""
+        if side.literal is not None:
+            number = typed_storage.coerce_value('number', side.literal)
+            return 'NULL' if number is None else self._bind(number)
+        return self.number_sql(side.text)
+
+    def _pair_sql(self, op: str, left: _Side, left_kind: str, right: _Side, right_kind: str) -> str:
+        if left_kind == right_kind == 'container':
+            # Only two JSON fields get here, and only in SQLite (see compare_sql)
+            return f"{SQLITE_COMPARE_FUNCTION}({self._bind(op)}, {left.text}, {right.text})"
+        if 'container' in (left_kind, right_kind):
+            # Python: an array or object only ever differs from a scalar
+            return '(1 = 1)' if op == '<>' else '(1 = 0)'
+        if left_kind == right_kind == 'text':
+            collate = ' COLLATE "C"' if self.dialect == 'postgresql' else ''  # code point order, as in Python
+            return f"({left.text}{collate} {op} {right.text}{collate})"
+        left_sql = left.number if left_kind == 'number' else self._as_number(left)
+        right_sql = right.number if right_kind == 'number' else self._as_number(right)
+        if 'NULL' in (left_sql, right_sql):
+            return '(1 = 0)'
+        return f"({left_sql} {op} {right_sql})"
+
+    def compare_sql(self, op: str, left: SqlOperand, right: SqlOperand) -> str:
+        """SQL for `left op right` with compare_values' result (expressions.py): null never matches,
+        number against text parses the text like float() (no match if it does not parse), text against
+        text compares code points, arrays/objects only differ from scalars and two of them go to
+        compare_values itself (canvas_compare, SQLite only). On JSON tables the kinds are only known
+        per row, so the SQL picks the branch by JSON type."""
+        sides = [self._side(left), self._side(right)]
+        if all(side.json_type is not None for side in sides) and self.dialect != 'sqlite':
+            # Two arrays/objects compare structurally in Python, which only SQLite can call
+            raise ExpressionError("Comparing two JSON fields is done in Python")
+        kinds = _JSON_KINDS[self.dialect]
+        branches = []
+        for left_kind in sides[0].kinds:
+            for right_kind in sides[1].kinds:
+                result = self._pair_sql(op, sides[0], left_kind, sides[1], right_kind)
+                tests = [f"{side.json_type} IN {self._sql_list(kinds[kind])}"
+                         for side, kind in ((sides[0], left_kind), (sides[1], right_kind)) if side.json_type]
+                branches.append((tests, result))
+        if len(branches) == 1 and not branches[0][0]:
+            return branches[0][1]
+        # Missing values and JSON null match no branch: NULL, so the row does not match
+        return '(CASE ' + ' '.join(f"WHEN {' AND '.join(tests)} THEN {result}" for tests, result in branches) + ' END)'
+
+    def sort_sql(self, name: str) -> str:
+        if self.aggregate is not None:
+            # After GROUP BY only output columns exist
+            return typed_storage.quote_ident(name)
+        if self.dialect == 'postgresql' and not self.typed and name not in self.computed:
+            # jsonb ordering keeps numbers numeric instead of comparing their text
+            return f"(data::jsonb -> {self._bind(name)})"
+        return self.field_sql(name)
+
+    def _source_sql(self) -> str:
+        if self.typed:
+            return typed_storage.typed_table_name(self.table.id)
+        return "records"
+
+    def _id_sql(self) -> str:
+        return typed_storage.quote_ident(typed_storage.RECORD_ID_COLUMN) if self.typed else "id"
+
+    def _base_where(self) -> List[str]:
+        return [] if self.typed else ["table_id = :table_id"]
+
+    # Pushdown entry points; each returns False when the node has to run in Python
+
+    def push_filter(self, expression: Expression, node_id: str) -> bool:
+        if self.aggregate is not None or self.limit is not None:
+            return False
+        if not all(self.has_field(name) for name in expression.fields):
+            return False
+        try:
+            condition = expression.to_sql(lambda name, numeric: self.field_sql(name, numeric), self._bind, self.compare_sql)
+        except ExpressionError:
+            return False
+        self.where.append(condition)
+        self.pushed.append(node_id)
+        return True
+
+    def push_sort(self, keys: List[SortKey], node_id: str) -> bool:
+        if not keys or self.limit is not None:
+            return False
+        available = self._output_names()
+        if not all(key.field in available if available is not None else self.has_field(key.field) for key in keys):
+            return False
+        # A later sort takes precedence; the earlier order only breaks ties, as with a stable sort
+        self.order_by = list(keys) + self.order_by
+        self.pushed.append(node_id)
+        return True
+
+    def push_limit(self, limit: int, offset: int, node_id: str) -> bool:
+        if self.limit is not None:
+            return False
+        self.limit, self.offset = limit, offset
+        self.pushed.append(node_id)
+        return True
+
+    def _is_number(self, name: str) -> bool:
+        if name in self.computed:
+            return self.computed[name][1].type == 'number'
+        return self._field_type(name) in ('number', 'relation')
+
+    def push_compute(self, columns: List[ComputedColumn], node_id: str) -> bool:
+        """Select computed columns: arithmetic over number fields, and conditions as 1/0"""
+        if self.aggregate is not None:
+            return False
+        if any(column.name == key.field for column in columns for key in self.order_by):
+            # Sort keys are turned into SQL at the end and would see the computed value
+            return False
+        saved, params = dict(self.computed), dict(self.params)
+        for column in columns:
+            expression = column.expression
+            try:
+                if column.type == 'number' and all(self._is_number(name) for name in expression.fields):
+                    sql = expression.value_sql(lambda name, numeric: self.field_sql(name, numeric), self._bind)
+                elif column.type == 'boolean' and all(self.has_field(name) for name in expression.fields):
+                    condition = expression.to_sql(lambda name, numeric: self.field_sql(name, numeric), self._bind, self.compare_sql)
+                    sql = f"(CASE WHEN {condition} THEN 1 ELSE 0 END)"
+                else:
+                    raise ExpressionError(f"{column.name} is computed in Python")
+            except ExpressionError:
+                self.computed, self.params = saved, params
+                return False
+            self.computed[column.name] = (sql, column)
+        self.pushed.append(node_id)
+        return True
+
+    def push_in(self, name: str, values: Iterable[Any]) -> bool:
+        """Restrict to rows whose field is one of values (NULL included if None is), for lookup joins"""
+        if self.aggregate is not None or self.limit is not None or not (name == 'id' or self.has_field(name)):
+            return False
+        values = list(values)
+        numbers = [v for v in values if isinstance(v, (int, float))]
+        texts = [v for v in values if isinstance(v, str)]
+        conditions = []
+        if name == 'id':
+            # Record ids are integers; anything else can never match
+            if numbers:
+                conditions.append(f"{self._id_sql()} IN ({', '.join(self._bind(v) for v in numbers)})")
+        else:
+            if numbers:
+                conditions.append(f"{self.field_sql(name, numeric=True)} IN ({', '.join(self._bind(v) for v in numbers)})")
+            if texts:
+                conditions.append(f"{self.field_sql(name)} IN ({', '.join(self._bind(v) for v in texts)})")
+            if any(v is None for v in values):
+                conditions.append(f"{self.field_sql(name)} IS NULL")
+        self.where.append('(' + ' OR '.join(conditions) + ')' if conditions else '(1 = 0)')
+        return True
+
+    def project(self, fields: Optional[Iterable[str]]):
+        """Only produce these fields (plus id) when no aggregate decides the output"""
+        self.projection = frozenset(fields) if fields is not None else None
+
+    def _selected_specs(self) -> List[Tuple[str, str]]:
+        if self.projection is None:
+            return self.specs
+        return [(name, field_type) for name, field_type in self.specs if name in self.projection]
+
+    def _output_names(self) -> Optional[set]:
+        if self.aggregate is None:
+            return None
+        return set(self.aggregate.group_by) | {a.alias for a in self.aggregate.aggregates}
+
+    def push_aggregate(self, spec: AggregateSpec, node_id: str) -> bool:
+        if self.aggregate is not None or self.order_by or self.limit is not None:
+            return False
+        fields = list(spec.group_by) + [a.field for a in spec.aggregates if a.field]
+        if not all(self.has_field(name) for name in fields):
+            return False
+        # SQL has no booleans: grouped or min/max conditions would come back as 1/0
+        kept = list(spec.group_by) + [a.field for a in spec.aggregates if a.op in ('min', 'max')]
+        if any(name in self.computed and self.computed[name][1].type == 'boolean' for name in kept):
+            return False
+        self.aggregate = spec
+        self.pushed.append(node_id)
+        return True
+
+    def _aggregate_select(self) -> List[str]:
+        spec = self.aggregate
+        items = [f"{self.field_sql(name)} AS {typed_storage.quote_ident(name)}" for name in spec.group_by]
+        for agg in spec.aggregates:
+            if agg.op == 'count':
+                expr = f"COUNT({self.field_sql(agg.field)})" if agg.field else "COUNT(*)"
+            else:
+                expr = f"{agg.op.upper()}({self.field_sql(agg.field, numeric=agg.op in ('sum', 'avg'))})"
+            items.append(f"{expr} AS {typed_storage.quote_ident(agg.alias)}")
+        return items
+
+    def sql(self) -> str:
+        where = self._base_where() + self.where
+        if self.aggregate is not None:
+            select = self._aggregate_select()
+            group_by = [str(i + 1) for i in range(len(self.aggregate.group_by))]
+        else:
+            if self.typed:
+                select = [self._id_sql()] + [typed_storage.quote_ident(name) for name, _ in self._selected_specs()]
+            else:
+                select = ["id", "data"]
+            select += [f"{sql} AS {typed_storage.quote_ident(name)}" for name, (sql, _) in self.computed.items()]
+            group_by = []
+
+        sql = f"SELECT {', '.join(select)} FROM {self._source_sql()}"
+        if where:
+            sql += f" WHERE {' AND '.join(where)}"
+        if group_by:
+            sql += f" GROUP BY {', '.join(group_by)}"
+        if self.order_by:
+            order = [f"{self.sort_sql(key.field)} {'DESC' if key.descending else 'ASC'} NULLS LAST"
+                     for key in self.order_by]
+            if self.aggregate is None:
+                # Input rows arrive in id order, so ties keep that order like Python's stable sort
+                order.append(self._id_sql())
+            sql += f" ORDER BY {', '.join(order)}"
+        elif self.limit is not None and self.aggregate is None:
+            sql += f" ORDER BY {self._id_sql()}"
+        if self.limit is not None:
+            sql += f" LIMIT {int(self.limit)} OFFSET {int(self.offset)}"
+        return sql
+
+    def compile(self) -> CompiledScan:
+        sql = self.sql()
+        computed = tuple(column for _, column in self.computed.values()) if self.aggregate is None else ()
+        return CompiledScan(sql, dict(self.params), self.typed, self._selected_specs(), self.aggregate,
+                            self.projection if self.aggregate is None else None, computed)
+
+    def rows(self) -> List[Dict[str, Any]]:
+        return self.compile().rows(self.conn)
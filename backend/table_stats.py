@@ -0,0 +1,334 @@
+"""Per-table and per-field statistics (an ANALYZE for records.data).
+
+analyze() reads the records of a table, sampling when it is large, and keeps
+for every declared field the null fraction, a HyperLogLog sketch of distinct
+values, min/max and the most frequent values. The sketches are stored next to
+the summary, so after large inserts refresh() only has to read the new rows
+and merge them in; updates and deletes are only caught up with by a full
+analyze. Both servers report their writes through record_writes(), which
+only counts them; once enough rows changed, the refresh runs on a background
+thread with its own connection (start_refresher), so the write request that
+crosses the threshold does not pay for reading the table.
+
+The canvas planner reads the summaries to estimate row counts; the API
+serves them at /api/tables/{name}/stats for the UI.
+"""
+import base64
+import hashlib
+import json
+import math
+import os
+import threading
+import traceback
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from database import execute_sql, sql_dialect
+import typed_storage
+
+# Tables with more records than this are analyzed from a random sample of about this many
+SAMPLE_ROWS = int(os.getenv("STATS_SAMPLE_ROWS") or 100000)
+# Statistics are refreshed once this many rows (and at least REFRESH_FRACTION of the table) changed
+REFRESH_ROWS = int(os.getenv("STATS_REFRESH_ROWS") or 1000)
+REFRESH_FRACTION = 0.2
+
+HLL_PRECISION = 12  # 4096 registers, ~1.6% standard error
+TOP_VALUES = 10
+TOP_TRACKED = 100  # candidate frequent values kept between refreshes
+FETCH_SIZE = 1000
+
+
+class HyperLogLog:
+    """Distinct count sketch; mergeable, so new rows can be added to stored statistics"""
+
+    def __init__(self, registers: Optional[bytearray] = None, precision: int = HLL_PRECISION):
+        self.precision = precision
+        self.registers = registers if registers is not None else bytearray(1 << precision)
+
+    def add(self, key: str):
+        h = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def dump(self) -> str:
+        return base64.b64encode(bytes(self.registers)).decode()
+
+    @classmethod
+    def load(cls, data: Optional[str]) -> 'HyperLogLog':
+        if not data:
+            return cls()
+        registers = bytearray(base64.b64decode(data))
+        return cls(registers, int(math.log2(len(registers))))
+
+
+def _value_key(value: Any) -> str:
+    """Canonical text of a value; 1 and 1.0 count as the same value like in Python"""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _replaces(candidate: Any, current: Any, lower: bool) -> bool:
+    """Whether candidate is the new min (lower) or max; numbers and texts do not compare, numbers win"""
+    if current is None:
+        return True
+    if _is_number(candidate) != _is_number(current):
+        return _is_number(candidate)
+    return candidate < current if lower else candidate > current
+
+
+class FieldState:
+    """Running statistics of one field over the sampled rows"""
+
+    def __init__(self, state: Optional[Dict[str, Any]] = None):
+        state = state or {}
+        self.nulls = state.get('nulls', 0)
+        self.values = state.get('values', 0)
+        self.hll = HyperLogLog.load(state.get('hll'))
+        self.min = state.get('min')
+        self.max = state.get('max')
+        self.top: Dict[str, int] = dict(state.get('top', []))
+
+    def add(self, value: Any):
+        if value is None:
+            self.nulls += 1
+            return
+        self.values += 1
+        key = _value_key(value)
+        self.hll.add(key)
+        if _is_number(value) or isinstance(value, str):
+            if _replaces(value, self.min, lower=True):
+                self.min = value
+            if _replaces(value, self.max, lower=False):
+                self.max = value
+        self.top[key] = self.top.get(key, 0) + 1
+        if len(self.top) > 2 * TOP_TRACKED:
+            self._prune()
+
+    def _prune(self):
+        kept = sorted(self.top.items(), key=lambda item: -item[1])[:TOP_TRACKED]
+        self.top = dict(kept)
+
+    def dump(self) -> Dict[str, Any]:
+        self._prune()
+        return {'nulls': self.nulls, 'values': self.values, 'hll': self.hll.dump(),
+                'min': self.min, 'max': self.max, 'top': list(self.top.items())}
+
+    def summary(self, sampled: int, fraction: float) -> Dict[str, Any]:
+        distinct = self.hll.count() if self.values else 0
+        if fraction < 1 and self.values and distinct >= 0.9 * self.values:
+            # Nearly every sampled value is unique: assume the rest of the table is too
+            distinct = int(round(distinct / fraction))
+        top = sorted(self.top.items(), key=lambda item: -item[1])[:TOP_VALUES]
+        return {
+            'null_fraction': round(self.nulls / sampled, 4) if sampled else 0.0,
+            'distinct': distinct,
+            'min': self.min,
+            'max': self.max,
+            # Only values seen more than once say something about the distribution
+            'top_values': [{'value': json.loads(key), 'count': int(round(count / fraction))}
+                           for key, count in top if count > 1],
+        }
+
+
+def _field_names(conn, table_id: int) -> List[str]:
+    rows = execute_sql(conn, "SELECT name FROM fields WHERE table_id = :table_id ORDER BY id",
+                       {'table_id': table_id}).fetchall()
+    return [name for name, _ in typed_storage.field_specs({'name': r[0]} for r in rows)]
+
+
+def _row_count(conn, table_id: int) -> int:
+    return execute_sql(conn, "SELECT COUNT(*) FROM records WHERE table_id = :table_id",
+                       {'table_id': table_id}).fetchone()[0]
+
+
+def _sample_sql(conn, fraction: float) -> str:
+    if fraction >= 1:
+        return ""
+    if sql_dialect(conn) == 'postgresql':
+        return " AND random() < :fraction"
+    # Bernoulli sample in a single pass, no sort
+    return " AND (abs(random()) % 1000000) < :fraction * 1000000"
+
+
+def _scan(conn, table_id: int, names: List[str], states: Dict[str, FieldState], after_id: int,
+          fraction: float):
+    """Feed the (sampled) records with id > after_id into states; returns (rows read, last id)"""
+    sql = ("SELECT id, data FROM records WHERE table_id = :table_id AND id > :after_id"
+           + _sample_sql(conn, fraction) + " ORDER BY id")
+    result = execute_sql(conn, sql, {'table_id': table_id, 'after_id': after_id, 'fraction': fraction})
+    sampled, last_id = 0, after_id
+    while True:
+        rows = result.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        for record_id, data in rows:
+            data = typed_storage.load_data(data)
+            for name in names:
+                states[name].add(data.get(name))
+            sampled += 1
+            last_id = record_id
+    if fraction < 1:
+        # Rows after the last sampled one were still read
+        last_id = execute_sql(conn, "SELECT MAX(id) FROM records WHERE table_id = :table_id",
+                              {'table_id': table_id}).fetchone()[0] or last_id
+    return sampled, last_id
+
+
+def _load(conn, table_id: int) -> Optional[Dict[str, Any]]:
+    row = execute_sql(conn, "SELECT row_count, sampled_rows, sample_fraction, last_record_id, state, analyzed_at "
+                            "FROM table_stats WHERE table_id = :table_id", {'table_id': table_id}).fetchone()
+    if row is None:
+        return None
+    return {'row_count': row[0], 'sampled_rows': row[1], 'sample_fraction': row[2], 'last_record_id': row[3],
+            'state': typed_storage.load_data(row[4]), 'analyzed_at': row[5]}
+
+
+def _save(conn, table_id: int, row_count: int, sampled: int, fraction: float, last_id: int,
+          states: Dict[str, FieldState], full: bool):
+    """Store the statistics on conn (the caller commits) and reset the writes they now account for"""
+    summary = {name: state.summary(sampled, fraction) for name, state in states.items()}
+    execute_sql(conn, """
+        INSERT INTO table_stats (table_id, row_count, sampled_rows, sample_fraction, last_record_id,
+                                 summary, state, analyzed_at)
+        VALUES (:table_id, :row_count, :sampled, :fraction, :last_id, :summary, :state, :analyzed_at)
+        ON CONFLICT (table_id) DO UPDATE SET
+            row_count = excluded.row_count, sampled_rows = excluded.sampled_rows,
+            sample_fraction = excluded.sample_fraction, last_record_id = excluded.last_record_id,
+            summary = excluded.summary, state = excluded.state, analyzed_at = excluded.analyzed_at
+    """, {'table_id': table_id, 'row_count': row_count, 'sampled': sampled, 'fraction': fraction, 'last_id': last_id,
+          'summary': json.dumps(summary, default=str),
+          'state': json.dumps({name: state.dump() for name, state in states.items()}, default=str),
+          'analyzed_at': datetime.now(timezone.utc).isoformat()})
+    with _lock:
+        _known_rows[table_id] = row_count
+        if full:
+            _pending.pop(table_id, None)
+        elif table_id in _pending:
+            # A refresh only reads new rows; updates and deletes still count towards a full analyze
+            _pending[table_id][0] = 0
+
+
+def analyze(conn, table_id: int):
+    """Recompute the statistics of a table from scratch; the caller commits"""
+    names = _field_names(conn, table_id)
+    row_count = _row_count(conn, table_id)
+    fraction = min(1.0, SAMPLE_ROWS / row_count) if row_count else 1.0
+    states = {name: FieldState() for name in names}
+    sampled, last_id = _scan(conn, table_id, names, states, 0, fraction)
+    _save(conn, table_id, row_count, sampled, fraction, last_id, states, full=True)
+
+
+def refresh(conn, table_id: int):
+    """Add records inserted since the last analyze to the stored statistics; the caller commits"""
+    stored = _load(conn, table_id)
+    names = _field_names(conn, table_id)
+    if stored is None or set(names) != set(stored['state']):
+        return analyze(conn, table_id)
+    states = {name: FieldState(stored['state'][name]) for name in names}
+    fraction = stored['sample_fraction']
+    sampled, last_id = _scan(conn, table_id, names, states, stored['last_record_id'] or 0, fraction)
+    _save(conn, table_id, _row_count(conn, table_id), stored['sampled_rows'] + sampled, fraction, last_id, states,
+          full=False)
+
+
+def get_stats(conn, table_id: int) -> Optional[Dict[str, Any]]:
+    row = execute_sql(conn, "SELECT row_count, sampled_rows, sample_fraction, summary, analyzed_at "
+                            "FROM table_stats WHERE table_id = :table_id", {'table_id': table_id}).fetchone()
+    if row is None:
+        return None
+    return {'row_count': row[0], 'sampled_rows': row[1], 'sample_fraction': row[2],
+            'fields': typed_storage.load_data(row[3]), 'analyzed_at': row[4],
+            'pending_writes': sum(_pending.get(table_id, ()))}
+
+
+def forget(conn, table_id: int):
+    execute_sql(conn, "DELETE FROM table_stats WHERE table_id = :table_id", {'table_id': table_id})
+    with _lock:
+        _pending.pop(table_id, None)
+        _known_rows.pop(table_id, None)
+
+
+# Write tracking: per process, since statistics are estimates anyway
+
+_lock = threading.Lock()
+_pending: Dict[int, List[int]] = {}  # table_id -> [inserted, updated or deleted]
+_known_rows: Dict[int, int] = {}
+
+
+_wakeup = threading.Condition(_lock)
+_due: Dict[int, bool] = {}  # table_id -> needs a full analyze, waiting for the refresher
+_connect: Optional[Callable[[], Any]] = None
+_refresher: Optional[threading.Thread] = None
+
+
+def start_refresher(connect: Callable[[], Any]):
+    """Run refreshes on a background thread over connections from connect() (called by each server)"""
+    global _connect
+    _connect = connect
+
+
+def record_writes(conn, table_id: int, inserted: int = 0, changed: int = 0):
+    """Note committed writes; schedules a refresh of the table's statistics once enough rows changed.
+
+    Without start_refresher() the refresh runs right away on conn and is committed there.
+    """
+    global _refresher
+    with _lock:
+        pending = _pending.setdefault(table_id, [0, 0])
+        pending[0] += inserted
+        pending[1] += changed
+        threshold = max(REFRESH_ROWS, int(_known_rows.get(table_id, 0) * REFRESH_FRACTION))
+        if pending[0] + pending[1] < threshold:
+            return
+        full = pending[1] >= threshold
+        del _pending[table_id]
+        if _connect is not None:
+            _due[table_id] = _due.get(table_id, False) or full
+            if _refresher is None:
+                _refresher = threading.Thread(target=_refresh_loop, name='stats-refresher', daemon=True)
+                _refresher.start()
+            _wakeup.notify()
+            return
+    # Without a server (scripts, benchmarks) the caller's connection is used
+    if full:
+        analyze(conn, table_id)
+    else:
+        refresh(conn, table_id)
+    conn.commit()
+
+
+def _refresh_loop():
+    while True:
+        with _wakeup:
+            while not _due:
+                _wakeup.wait()
+            table_id, full = _due.popitem()
+        conn = _connect()
+        try:
+            if full:
+                analyze(conn, table_id)
+            else:
+                refresh(conn, table_id)
+            conn.commit()
+        except Exception:
+            traceback.print_exc()
+        finally:
+            conn.close()
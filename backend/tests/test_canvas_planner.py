@@ -0,0 +1,78 @@
+"""Which filters the planner folds into SQL, and its plan cache under concurrent planning"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import canvas_planner  # noqa: E402
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / 'advanced.db'
+
+
+@pytest.fixture
+def conn(path):
+    import advanced_server
+
+    conn = sqlite3.connect(path)
+    advanced_server.create_schema(conn)
+    conn.execute("INSERT INTO tables (name, display_name) VALUES ('stock', 'Stock')")
+    conn.execute("INSERT INTO fields (table_id, name, display_name, field_type) VALUES (1, 'q', 'Q', 'number')")
+    for q in [1, 2, '4', 'abc', None]:
+        conn.execute("INSERT INTO records (table_id, data) VALUES (1, ?)", (json.dumps({'q': q}),))
+    conn.commit()
+    canvas_planner.invalidate()
+    yield conn
+    conn.close()
+
+
+def _canvas(condition):
+    nodes = [{'id': 't', 'type': 'tableNode', 'data': {'tableName': 'stock'}},
+             {'id': 'f', 'type': 'filterNode', 'data': {'condition': condition}},
+             {'id': 's', 'type': 'sortNode', 'data': {'field': 'q'}}]
+    return nodes, [{'source': 't', 'target': 'f'}, {'source': 'f', 'target': 's'}]
+
+
+def _kinds(conn, condition):
+    plan = canvas_planner.plan_canvas(conn, *_canvas(condition))
+    return [op.kind for op in plan.pipelines[0]]
+
+
+def test_comparable_filter_is_folded(conn):
+    assert _kinds(conn, 'q > 1') == ['sql_scan']
+
+
+@pytest.mark.parametrize('condition', ['q % 2 == 0', '(q > 1) == true'])
+def test_unproven_filter_stays_in_python(conn, condition):
+    assert _kinds(conn, condition) == ['sql_scan', 'filter', 'sort']
+
+
+def test_concurrent_planning(conn, path, monkeypatch):
+    """Threads evicting each other's plans from a small cache"""
+    monkeypatch.setattr(canvas_planner, 'PLAN_CACHE_SIZE', 4)
+    errors = []
+
+    def plan(worker):
+        db = sqlite3.connect(path)
+        try:
+            for i in range(100):
+                assert _kinds(db, f"q > {worker * 10 + i % 10}") == ['sql_scan']
+        except Exception as e:
+            errors.append(e)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=plan, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(canvas_planner._cache) <= 4
@@ -0,0 +1,99 @@
+"""Deleting a table or canvas the way main.py does: mark it on an ORM session, then purge it in a job"""
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import canvas_planner  # noqa: E402
+import cascade_delete  # noqa: E402
+from canvas_runs import load_canvas  # noqa: E402
+from database import execute_sql  # noqa: E402
+import jobs  # noqa: E402
+import typed_storage  # noqa: E402
+import view_retention  # noqa: E402
+
+RECORDS = 51
+
+
+@pytest.fixture
+def connect(tmp_path, monkeypatch):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from database import Base
+    import models  # noqa: F401  registers the tables on Base
+
+    monkeypatch.setattr(cascade_delete, 'BATCH_SIZE', 20)
+    monkeypatch.setattr(cascade_delete, 'THROTTLE_MS', 0)
+    engine = create_engine(f"sqlite:///{tmp_path / 'main.db'}")
+    view_retention.use_incremental_vacuum(engine)
+    Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def _wait(job):
+    while job.status == jobs.RUNNING:
+        time.sleep(0.01)
+    return job.to_dict()
+
+
+def _count(db, sql, **params):
+    return execute_sql(db, sql, params).fetchone()[0]
+
+
+def test_purge_typed_table(connect):
+    db = connect()
+    execute_sql(db, "INSERT INTO tables (name, display_name, storage_mode) VALUES ('stock', 'Stock', 'typed')")
+    execute_sql(db, "INSERT INTO fields (table_id, name, display_name, field_type) VALUES (1, 'q', 'Q', 'number')")
+    fields = [{'name': 'q', 'field_type': 'number'}]
+    typed_storage.create_typed_table(db, 1, fields)
+    for i in range(RECORDS):
+        record_id = execute_sql(db, "INSERT INTO records (table_id, data) VALUES (1, :data)",
+                                {'data': '{"q": %d}' % i}).lastrowid
+        typed_storage.upsert_row(db, 1, fields, record_id, {'q': i})
+    db.commit()
+
+    assert cascade_delete.mark_table_deleted(db, 1) == 'stock'
+    db.commit()
+    job = _wait(cascade_delete.start_purge(connect, 'table', 1))
+
+    assert job['status'] == jobs.DONE, job['error']
+    assert job['result']['records'] == RECORDS
+    assert job['result']['auto_vacuum'] == 'incremental'
+    assert _count(db, "SELECT COUNT(*) FROM records") == 0
+    assert _count(db, "SELECT COUNT(*) FROM tables") == 0
+    db.close()
+
+
+def test_purge_canvas(connect):
+    db = connect()
+    execute_sql(db, "INSERT INTO canvases (name, nodes, edges) VALUES ('c', '[]', '[]')")
+    for i in range(RECORDS):
+        execute_sql(db, "INSERT INTO views (name, canvas_id, data) VALUES (:name, 1, '[]')", {'name': f"v{i}"})
+    db.commit()
+
+    assert cascade_delete.mark_canvas_deleted(db, 1)
+    db.commit()
+    job = _wait(cascade_delete.start_purge(connect, 'canvas', 1))
+
+    assert job['status'] == jobs.DONE, job['error']
+    assert job['result']['views'] == RECORDS
+    assert _count(db, "SELECT COUNT(*) FROM views") == 0
+    assert _count(db, "SELECT COUNT(*) FROM canvases") == 0
+    db.close()
+
+
+def test_marked_rows_are_not_looked_up(connect):
+    """Between the mark and the purge, neither a canvas nor a table can be found by id or name"""
+    db = connect()
+    execute_sql(db, "INSERT INTO tables (name, display_name) VALUES ('stock', 'Stock')")
+    execute_sql(db, "INSERT INTO canvases (name, nodes, edges) VALUES ('c', '[]', '[]')")
+    assert cascade_delete.mark_table_deleted(db, 1) == 'stock'
+    assert cascade_delete.mark_canvas_deleted(db, 1)
+
+    assert load_canvas(db, 1) is None
+    assert canvas_planner._load_tables(db, [cascade_delete.tombstone_name('stock', 1)]) == {}
+    db.close()
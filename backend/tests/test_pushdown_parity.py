@@ -0,0 +1,80 @@
+"""Folding a node into SQL must not change its output: pushed-down and Python results on mixed-type JSON data"""
+import json
+import os
+import sqlite3
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from computed import FIELD_TYPES, check_columns, compute_rows, parse_compute_spec  # noqa: E402
+from expressions import parse  # noqa: E402
+from sql_pushdown import TableScan  # noqa: E402
+
+FIELDS = [{'name': 'stock', 'field_type': 'number'}, {'name': 'reserved', 'field_type': 'number'},
+          {'name': 'target', 'field_type': 'number'}, {'name': 'sku', 'field_type': 'text'}]
+
+# Values a JSON table can hold in a number field: numbers, numeric, malformed and other text, booleans,
+# arrays and objects, null, missing
+STOCK = [5, 7, 2.5, 0, -4, '3', '12', ' 7 ', '2.5', '1e3', '-4', 'abc', '', True, False, None, 'missing',
+         '1-2', '1e', '1.2.3', 'inf', '-Infinity', '1_000', '1__0', [1, 2], {'a': 1}]
+# Compared with every STOCK value
+TARGET = [3, '3', '12', 'abc', True, None, 'missing']
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE records (id INTEGER PRIMARY KEY, table_id INTEGER, data TEXT)")
+    for i, (stock, target) in enumerate((stock, target) for stock in STOCK for target in TARGET):
+        data = {'reserved': 1, 'sku': f"s{i}", 'stock': stock, 'target': target, 'extra': stock}
+        conn.execute("INSERT INTO records (table_id, data) VALUES (1, ?)",
+                     (json.dumps({k: v for k, v in data.items() if v != 'missing'}),))
+    yield conn
+    conn.close()
+
+
+def _table():
+    return SimpleNamespace(id=1, storage_mode='json', fields=FIELDS)
+
+
+def _python_rows(conn):
+    return [{'id': row[0], **json.loads(row[1])} for row in conn.execute("SELECT id, data FROM records ORDER BY id")]
+
+
+@pytest.mark.parametrize('source', [
+    'stock > 5', 'stock >= 3', 'stock < 5', 'stock == 3', 'stock != 3', 'stock > 0 and reserved == 1',
+    'not stock > 5', 'stock - reserved > 1', 'stock * 2 == 6', 'stock = null', 'sku == "s3"',
+    # field against field
+    'stock < target', 'stock >= target', 'stock == target', 'stock != target', 'target > stock',
+    'not stock < target', 'stock - reserved < target', 'extra == stock', 'extra < stock', 'extra != stock',
+    # text literals, numeric or not
+    'stock > "5"', 'stock == "3"', 'stock != "abc"', 'stock < "abc"', 'stock >= "1e3"', 'sku < "s3"',
+    '"12" > stock', 'stock == true', 'stock != false',
+])
+def test_filter_parity(conn, source):
+    scan = TableScan(conn, _table())
+    assert scan.push_filter(parse(source), 'filter-1')
+    pushed = [row['id'] for row in scan.rows()]
+    predicate = parse(source).predicate()
+    assert pushed == [row['id'] for row in _python_rows(conn) if predicate(row)]
+
+
+@pytest.mark.parametrize('source', ['stock % 2 == 0', '(stock > 1) == true'])
+def test_filter_kept_in_python(conn, source):
+    """Comparisons SQL cannot do with Python's result are not pushed down"""
+    assert not TableScan(conn, _table()).push_filter(parse(source), 'filter-1')
+
+
+@pytest.mark.parametrize('source', [
+    'available = stock - reserved', 'big = stock > 5', 'ratio = stock / reserved', 'neg = -stock',
+    'ok = stock >= 3 and sku != "s1"', 'unset = stock = null', 'above = stock > target',
+])
+def test_compute_parity(conn, source):
+    columns = check_columns(parse_compute_spec({'columns': source}),
+                            {f['name']: FIELD_TYPES[f['field_type']] for f in FIELDS}, exact=False)
+    scan = TableScan(conn, _table())
+    assert scan.push_compute(columns, 'compute-1')
+    assert scan.rows() == compute_rows(columns, _python_rows(conn))
@@ -0,0 +1,47 @@
+"""analyze()/refresh() reset the write counters they account for and leave the commit to the caller"""
+import json
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import table_stats  # noqa: E402
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    import advanced_server
+
+    monkeypatch.setattr(table_stats, '_connect', None)
+    conn = sqlite3.connect(tmp_path / 'advanced.db')
+    advanced_server.create_schema(conn)
+    conn.execute("INSERT INTO tables (name, display_name) VALUES ('stock', 'Stock')")
+    conn.execute("INSERT INTO fields (table_id, name, display_name, field_type) VALUES (1, 'q', 'Q', 'number')")
+    for q in range(10):
+        conn.execute("INSERT INTO records (table_id, data) VALUES (1, ?)", (json.dumps({'q': q}),))
+    conn.commit()
+    yield conn
+    table_stats.forget(conn, 1)
+    conn.close()
+
+
+def test_analyze_clears_pending_writes(conn):
+    table_stats.record_writes(conn, 1, inserted=3, changed=2)
+    table_stats.analyze(conn, 1)
+    assert table_stats.get_stats(conn, 1)['pending_writes'] == 0
+
+
+def test_refresh_keeps_pending_changes(conn):
+    table_stats.analyze(conn, 1)
+    table_stats.record_writes(conn, 1, inserted=3, changed=2)
+    table_stats.refresh(conn, 1)
+    assert table_stats.get_stats(conn, 1)['pending_writes'] == 2
+
+
+def test_caller_commits(conn):
+    table_stats.analyze(conn, 1)
+    conn.rollback()
+    assert table_stats.get_stats(conn, 1) is None
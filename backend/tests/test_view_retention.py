@@ -0,0 +1,66 @@
+"""compact() releases free pages on both connection kinds: main.py's ORM sessions and advanced_server's sqlite3"""
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import view_retention  # noqa: E402
+
+WIDE_RECORDS = 200
+
+
+def _fill_and_delete(execute, commit):
+    """Leave about a thousand pages on the freelist"""
+    execute("INSERT INTO tables (name, display_name) VALUES ('wide', 'Wide')")
+    for _ in range(WIDE_RECORDS):
+        execute("INSERT INTO records (table_id, data) VALUES (1, '" + 'x' * 20000 + "')")
+    commit()
+    execute("DELETE FROM records")
+    commit()
+
+
+@pytest.fixture
+def session(tmp_path):
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.orm import sessionmaker
+    from database import Base
+    import models  # noqa: F401  registers the tables on Base
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'main.db'}")
+    view_retention.use_incremental_vacuum(engine)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    _fill_and_delete(lambda sql: session.execute(text(sql)), session.commit)
+    yield session
+    session.close()
+    engine.dispose()
+
+
+@pytest.fixture
+def conn(tmp_path):
+    import advanced_server
+
+    conn = sqlite3.connect(tmp_path / 'advanced.db')
+    advanced_server.create_schema(conn)
+    _fill_and_delete(conn.execute, conn.commit)
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize('full_vacuum', [False, True])
+def test_compact_session(session, full_vacuum):
+    result = view_retention.compact(session, full_vacuum=full_vacuum)
+    assert result['auto_vacuum'] == 'incremental'
+    assert result['free_pages'] == 0
+    assert full_vacuum or result['released_pages'] > 0
+
+
+@pytest.mark.parametrize('full_vacuum', [False, True])
+def test_compact_sqlite3(conn, full_vacuum):
+    result = view_retention.compact(conn, full_vacuum=full_vacuum)
+    assert result['auto_vacuum'] == 'incremental'
+    assert result['free_pages'] == 0
+    assert full_vacuum or result['released_pages'] > 0
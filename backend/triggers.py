@@ -0,0 +1,213 @@
+"""Triggers: canvases that run when records of a table change.
+
+Both servers publish() every committed insert/update/delete. Events for a
+trigger are coalesced into a batch: the first event opens a window of
+window_ms, everything arriving until it closes (or until max_batch records
+are collected) runs as one execution. A trigger never runs concurrently with
+itself; events arriving while it runs form the next batch. Executions share
+a bounded worker pool (TRIGGER_WORKERS threads).
+
+Triggers in delta mode run the canvas over the changed records only
+(CanvasExecutor.execute_delta) when its operators allow that, e.g.
+table -> filter -> join -> webhook; canvases with aggregates, sorts or limits
+and batches with deletes run in full. Every execution is saved as a view.
+"""
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from canvas_runs import load_canvas, load_json, save_view
+import change_feed
+from database import execute_sql
+import metrics
+import query_log
+
+TRIGGER_WORKERS = int(os.getenv("TRIGGER_WORKERS") or 2)
+EVENTS = ('insert', 'update', 'delete')
+MODES = ('delta', 'full')
+DEFAULT_WINDOW_MS = 500
+DEFAULT_MAX_BATCH = 1000
+# Subscriptions are re-read at least this often, so triggers created by the other server are picked up
+RELOAD_SECONDS = 5.0
+
+
+class TriggerError(ValueError):
+    """Invalid trigger configuration"""
+
+
+def validate(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalized trigger settings from an API payload"""
+    events = data.get('events') or list(EVENTS)
+    if isinstance(events, str):
+        events = [e.strip() for e in events.split(',') if e.strip()]
+    unknown = [e for e in events if e not in EVENTS]
+    if unknown:
+        raise TriggerError(f"Unknown trigger events: {', '.join(unknown)}")
+    mode = data.get('mode') or 'delta'
+    if mode not in MODES:
+        raise TriggerError(f"Unknown trigger mode: {mode}")
+    if not data.get('canvas_id') or not data.get('table_name'):
+        raise TriggerError("canvas_id and table_name are required")
+    window_ms = int(data.get('window_ms') if data.get('window_ms') is not None else DEFAULT_WINDOW_MS)
+    max_batch = int(data.get('max_batch') or DEFAULT_MAX_BATCH)
+    if window_ms < 0 or max_batch < 1:
+        raise TriggerError("window_ms must be >= 0 and max_batch >= 1")
+    return {'canvas_id': int(data['canvas_id']), 'table_name': data['table_name'], 'events': events,
+            'mode': mode, 'window_ms': window_ms, 'max_batch': max_batch,
+            'enabled': bool(data.get('enabled', True))}
+
+
+class _Batch:
+    def __init__(self):
+        self.record_ids: Set[int] = set()
+        self.events: Set[str] = set()
+        self.timer: Optional[threading.Timer] = None
+        self.running = False
+        self.ready = False  # window closed while the previous batch was still running
+
+
+class TriggerEngine:
+    def __init__(self, connect: Callable[[], Any], workers: int = TRIGGER_WORKERS):
+        self.connect = connect  # new connection/session for loading triggers and running canvases
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._subscriptions: Optional[Dict[str, List[Dict[str, Any]]]] = None
+        self._loaded_at = 0.0
+        self._batches: Dict[int, _Batch] = {}
+
+    def invalidate(self):
+        """Re-read triggers on the next event (call after creating/changing/deleting one)"""
+        with self._lock:
+            self._subscriptions = None
+
+    def _triggers_for(self, table_name: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            if self._subscriptions is not None and time.monotonic() - self._loaded_at < RELOAD_SECONDS:
+                return self._subscriptions.get(table_name, [])
+        conn = self.connect()
+        try:
+            rows = execute_sql(conn, "SELECT id, canvas_id, table_name, events, mode, window_ms, max_batch "
+                                     "FROM triggers WHERE enabled = :enabled", {'enabled': True}).fetchall()
+        finally:
+            conn.close()
+        subscriptions: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            trigger = {'id': row[0], 'canvas_id': row[1], 'table_name': row[2], 'events': load_json(row[3]) or [],
+                       'mode': row[4], 'window_ms': row[5], 'max_batch': row[6]}
+            subscriptions.setdefault(trigger['table_name'], []).append(trigger)
+        with self._lock:
+            self._subscriptions, self._loaded_at = subscriptions, time.monotonic()
+        return subscriptions.get(table_name, [])
+
+    def publish(self, table_name: str, event: str, record_ids: List[int]):
+        """Report committed changes; cheap when no trigger watches the table"""
+        triggers = [t for t in self._triggers_for(table_name) if event in t['events']]
+        if not triggers:
+            return
+        metrics.TRIGGER_EVENTS.inc(event, amount=len(record_ids))
+        with self._lock:
+            for trigger in triggers:
+                batch = self._batches.setdefault(trigger['id'], _Batch())
+                batch.record_ids.update(record_ids)
+                batch.events.add(event)
+                if len(batch.record_ids) >= trigger['max_batch'] or trigger['window_ms'] == 0:
+                    self._close_window(trigger, batch)
+                elif batch.timer is None and not batch.ready:
+                    batch.timer = threading.Timer(trigger['window_ms'] / 1000.0, self._window_elapsed, (trigger,))
+                    batch.timer.daemon = True
+                    batch.timer.start()
+
+    def _window_elapsed(self, trigger: Dict[str, Any]):
+        with self._lock:
+            batch = self._batches.get(trigger['id'])
+            if batch is not None:
+                batch.timer = None
+                self._close_window(trigger, batch)
+
+    def _close_window(self, trigger: Dict[str, Any], batch: _Batch):
+        """Submit the collected batch unless the trigger is still running; called with the lock held"""
+        if batch.timer is not None:
+            batch.timer.cancel()
+            batch.timer = None
+        if batch.running:
+            batch.ready = True
+            return
+        record_ids, events = sorted(batch.record_ids), set(batch.events)
+        batch.record_ids.clear()
+        batch.events.clear()
+        batch.ready = False
+        batch.running = True
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='trigger')
+        self._pool.submit(self._run, trigger, record_ids, events)
+
+    def _run(self, trigger: Dict[str, Any], record_ids: List[int], events: Set[str]):
+        try:
+            self.run_trigger(trigger, record_ids, events)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            with self._lock:
+                batch = self._batches[trigger['id']]
+                batch.running = False
+                if batch.ready:
+                    self._close_window(trigger, batch)
+                elif not batch.record_ids and batch.timer is None:
+                    del self._batches[trigger['id']]
+
+    def run_trigger(self, trigger: Dict[str, Any], record_ids: List[int], events: Set[str]) -> Optional[int]:
+        """Execute the trigger's canvas for one batch and save the result as a view; returns the view id"""
+        from canvas_executor import CanvasExecutor  # not needed until the first run
+        conn = self.connect()
+        mode = 'full'
+        started = time.perf_counter()
+        try:
+            canvas = load_canvas(conn, trigger['canvas_id'])
+            if canvas is None:
+                raise TriggerError(f"Canvas {trigger['canvas_id']} not found")
+            nodes, edges, version = canvas
+            executor = CanvasExecutor(conn)
+            with query_log.scope(trigger=trigger['id'], canvas=trigger['canvas_id']):
+                data = None
+                if trigger['mode'] == 'delta' and 'delete' not in events and record_ids:
+                    data = executor.execute_delta(nodes, edges, trigger['table_name'], record_ids, version)
+                    mode = 'delta' if data is not None else 'full'
+                if data is None:
+                    data = executor.execute(nodes, edges, version)
+
+            name = f"Trigger_{trigger['id']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            view_id = save_view(conn, trigger['canvas_id'], name, data)
+            _record_run(conn, trigger['id'], 'ok', None)
+            conn.commit()
+            change_feed.publish('view', 'insert', id=view_id, name=name, canvas_id=trigger['canvas_id'])
+            metrics.TRIGGER_RUNS.inc(mode, 'ok')
+            return view_id
+        except Exception as e:
+            conn.rollback()
+            _record_run(conn, trigger['id'], 'error', str(e))
+            conn.commit()
+            metrics.TRIGGER_RUNS.inc(mode, 'error')
+            raise
+        finally:
+            metrics.TRIGGER_DURATION.observe(time.perf_counter() - started)
+            conn.close()
+
+    def shutdown(self):
+        with self._lock:
+            for batch in self._batches.values():
+                if batch.timer is not None:
+                    batch.timer.cancel()
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+
+def _record_run(conn, trigger_id: int, status: str, error: Optional[str]):
+    execute_sql(conn, "UPDATE triggers SET last_run_at = :at, last_status = :status, last_error = :error "
+                      "WHERE id = :id",
+                {'at': datetime.now(timezone.utc).isoformat(), 'status': status, 'error': error, 'id': trigger_id})
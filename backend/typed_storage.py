@@ -0,0 +1,217 @@
+"""Typed side tables for tables that opt into storage_mode = 'typed'.
+
+records.data stays the source of truth. A typed table additionally gets a
+mirror "typed_<table_id>" with one real SQL column per Field, so reads skip
+JSON parsing and numbers compare as numbers. Only declared fields are kept in
+the mirror, coerced to the column type, which is why it serves canvas scans
+(filters, sorts, aggregates, see sql_pushdown.py) and the record API keeps
+reading records.data, returning the same records in both modes.
+
+All helpers take either an ORM session (main.py) or a sqlite3 connection
+(advanced_server.py) and leave committing to the caller.
+"""
+import json
+import sqlite3
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from database import execute_sql, sql_dialect
+
+STORAGE_JSON = 'json'
+STORAGE_TYPED = 'typed'
+STORAGE_MODES = (STORAGE_JSON, STORAGE_TYPED)
+
+RECORD_ID_COLUMN = '_record_id'
+BACKFILL_BATCH_SIZE = 1000
+
+# (name, field_type) pairs describing the columns of a typed table
+FieldSpec = List[Tuple[str, str]]
+
+
+def typed_table_name(table_id: int) -> str:
+    return f"typed_{int(table_id)}"
+
+
+def quote_ident(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def field_attr(field: Any, key: str, default: Any = None) -> Any:
+    """Read an attribute from a Field model, a field dict or a sqlite3 row"""
+    if hasattr(field, 'keys'):
+        return field[key] if key in field.keys() else default
+    return getattr(field, key, default)
+
+
+def field_specs(fields: Iterable[Any]) -> FieldSpec:
+    """Build column specs from Field models or field rows, skipping duplicate names"""
+    specs, seen = [], set()
+    for field in fields:
+        name, field_type = field_attr(field, 'name'), field_attr(field, 'field_type')
+        if name and name not in seen and name != RECORD_ID_COLUMN:
+            seen.add(name)
+            specs.append((name, field_type or 'text'))
+    return specs
+
+
+def _column_type(field_type: str, dialect: str) -> str:
+    if field_type == 'number':
+        return 'REAL' if dialect == 'sqlite' else 'DOUBLE PRECISION'
+    if field_type == 'relation':
+        return 'INTEGER'
+    return 'TEXT'
+
+
+def coerce_value(field_type: str, value: Any) -> Any:
+    """Convert a JSON value to what the typed column stores (None if it does not fit)"""
+    if value is None or value == '':
+        return None
+    if field_type == 'number':
+        if isinstance(value, bool):
+            return int(value)
+        if isinstance(value, (int, float)):
+            return value
+        try:
+            number = float(str(value).strip())
+        except ValueError:
+            return None
+        return int(number) if number.is_integer() else number
+    if field_type == 'relation':
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+
+def read_value(field_type: str, value: Any) -> Any:
+    if field_type == 'number' and isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def load_data(data: Any) -> Dict[str, Any]:
+    """records.data as a dict (sqlite3 returns JSON text, the ORM already decodes it)"""
+    if isinstance(data, dict):
+        return data
+    return json.loads(data) if data else {}
+
+
+def load_options(options: Any) -> Dict[str, Any]:
+    """Field options as a dict (advanced_server stores them as JSON text)"""
+    if isinstance(options, str):
+        try:
+            options = json.loads(options)
+        except ValueError:
+            return {}
+    return options if isinstance(options, dict) else {}
+
+
+def create_typed_table(conn, table_id: int, fields: FieldSpec):
+    """(Re)create the typed mirror for a table and backfill it from records"""
+    drop_typed_table(conn, table_id)
+    dialect = sql_dialect(conn)
+    columns = ', '.join(
+        f"{quote_ident(name)} {_column_type(field_type, dialect)}" for name, field_type in fields
+    )
+    execute_sql(conn, f"CREATE TABLE {typed_table_name(table_id)} "
+                      f"({quote_ident(RECORD_ID_COLUMN)} INTEGER PRIMARY KEY"
+                      f"{', ' + columns if columns else ''})")
+    backfill(conn, table_id, fields)
+
+
+def drop_typed_table(conn, table_id: int):
+    execute_sql(conn, f"DROP TABLE IF EXISTS {typed_table_name(table_id)}")
+
+
+def _mirror_columns(conn, table_id: int) -> Optional[Dict[str, str]]:
+    """Column name -> SQL type of the existing mirror, None if there is none"""
+    name = typed_table_name(table_id)
+    if sql_dialect(conn) == 'sqlite':
+        rows = [(row[1], row[2]) for row in execute_sql(conn, f"PRAGMA table_info({name})").fetchall()]
+    else:
+        rows = execute_sql(conn, "SELECT column_name, data_type FROM information_schema.columns "
+                                 "WHERE table_name = :name", {'name': name}).fetchall()
+    if not rows:
+        return None
+    return {column: column_type.upper() for column, column_type in rows if column != RECORD_ID_COLUMN}
+
+
+def sync_schema(conn, table_id: int, fields: FieldSpec) -> List[str]:
+    """Bring the mirror in line with the table's current Field list; returns the added columns.
+
+    Added and removed fields are single ALTER TABLE statements, so the rows of an
+    added column stay NULL until backfill() (run in chunks by field_migrations.py)
+    copies them from records. A changed column type or a missing mirror rebuilds it.
+    """
+    dialect = sql_dialect(conn)
+    existing = _mirror_columns(conn, table_id)
+    wanted = {name: _column_type(field_type, dialect) for name, field_type in fields}
+    # DROP COLUMN needs SQLite 3.35
+    can_drop = dialect != 'sqlite' or sqlite3.sqlite_version_info >= (3, 35)
+    if existing is None or any(existing[name] != wanted[name] for name in wanted if name in existing) or \
+            (not can_drop and set(existing) - set(wanted)):
+        create_typed_table(conn, table_id, fields)
+        return []
+    table = typed_table_name(table_id)
+    for name in existing:
+        if name not in wanted:
+            execute_sql(conn, f"ALTER TABLE {table} DROP COLUMN {quote_ident(name)}")
+    added = [name for name in wanted if name not in existing]
+    for name in added:
+        execute_sql(conn, f"ALTER TABLE {table} ADD COLUMN {quote_ident(name)} {wanted[name]}")
+    return added
+
+
+def rename_column(conn, table_id: int, old: str, new: str):
+    execute_sql(conn, f"ALTER TABLE {typed_table_name(table_id)} RENAME COLUMN {quote_ident(old)} TO {quote_ident(new)}")
+
+
+def backfill(conn, table_id: int, fields: FieldSpec, after_id: int = 0, upto_id: Optional[int] = None):
+    """Copy existing records (optionally only ids in (after_id, upto_id]) into the mirror in id-ordered batches"""
+    last_id = after_id
+    upto = '' if upto_id is None else ' AND id <= :upto_id'
+    while True:
+        rows = execute_sql(conn, f"SELECT id, data FROM records WHERE table_id = :table_id AND id > :last_id{upto} "
+                                 f"ORDER BY id LIMIT :limit",
+                           {'table_id': table_id, 'last_id': last_id, 'upto_id': upto_id,
+                            'limit': BACKFILL_BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            upsert_row(conn, table_id, fields, row[0], load_data(row[1]))
+        last_id = rows[-1][0]
+
+
+def upsert_row(conn, table_id: int, fields: FieldSpec, record_id: int, data: Dict[str, Any]):
+    params = {'record_id': record_id}
+    names = [quote_ident(RECORD_ID_COLUMN)]
+    values = [':record_id']
+    for i, (name, field_type) in enumerate(fields):
+        params[f'v{i}'] = coerce_value(field_type, data.get(name))
+        names.append(quote_ident(name))
+        values.append(f':v{i}')
+    updates = ', '.join(f"{name} = excluded.{name}" for name in names[1:])
+    conflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+    execute_sql(conn, f"INSERT INTO {typed_table_name(table_id)} ({', '.join(names)}) "
+                      f"VALUES ({', '.join(values)}) "
+                      f"ON CONFLICT ({quote_ident(RECORD_ID_COLUMN)}) {conflict}", params)
+
+
+def update_row(conn, table_id: int, fields: FieldSpec, record_id: int, data: Dict[str, Any]):
+    """Write only the mirror columns present in data (for merge patches)"""
+    columns = [(i, name, field_type) for i, (name, field_type) in enumerate(fields) if name in data]
+    if not columns:
+        return
+    params = {'record_id': record_id}
+    for i, name, field_type in columns:
+        params[f'v{i}'] = coerce_value(field_type, data[name])
+    execute_sql(conn, f"UPDATE {typed_table_name(table_id)} "
+                      f"SET {', '.join(f'{quote_ident(name)} = :v{i}' for i, name, _ in columns)} "
+                      f"WHERE {quote_ident(RECORD_ID_COLUMN)} = :record_id", params)
+
+
+def delete_row(conn, table_id: int, record_id: int):
+    execute_sql(conn, f"DELETE FROM {typed_table_name(table_id)} WHERE {quote_ident(RECORD_ID_COLUMN)} = :record_id",
+                {'record_id': record_id})
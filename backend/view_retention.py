@@ -0,0 +1,192 @@
+"""View retention and compaction.
+
+Every canvas execution stores a view, so the views table only grows. A
+canvas' retention policy bounds it: keep the newest `keep` views, drop views
+older than `days`, and keep the newest views up to `bytes` of result data.
+Each limit comes from the canvas (retention_keep / retention_days /
+retention_bytes; 0 = no limit) or, when NULL there, from the environment:
+    VIEW_RETENTION_KEEP   (default 0)
+    VIEW_RETENTION_DAYS   (default 0)
+    VIEW_RETENTION_BYTES  (default 0)
+The server defaults keep everything, so retention is opt-in (per canvas or
+via the environment) and an upgrade never deletes existing views. The newest
+view of a canvas is always kept. Views of deleted canvases are removed too.
+
+A ViewCompactor thread in each server applies the policies every
+VIEW_COMPACT_SECONDS (default 300), deleting in small batches so writers are
+not blocked for long, and then returns freed pages to the OS with
+PRAGMA incremental_vacuum. That needs auto_vacuum=INCREMENTAL, which new
+SQLite databases get from enable_incremental_vacuum(); existing databases are
+converted once with compact(full_vacuum=True), i.e. POST /api/views/compact?full_vacuum=1.
+"""
+import os
+import threading
+import traceback
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import change_feed
+from database import execute_sql, sql_dialect, sqlite_connection
+import metrics
+
+RETENTION_KEEP = int(os.getenv("VIEW_RETENTION_KEEP") or 0)
+RETENTION_DAYS = float(os.getenv("VIEW_RETENTION_DAYS") or 0)
+RETENTION_BYTES = int(os.getenv("VIEW_RETENTION_BYTES") or 0)
+COMPACT_SECONDS = float(os.getenv("VIEW_COMPACT_SECONDS") or 300)
+VACUUM_PAGES = 2000  # pages released per incremental_vacuum step
+DELETE_BATCH = 200
+INCREMENTAL = 2  # PRAGMA auto_vacuum value
+
+
+def enable_incremental_vacuum(conn):
+    """auto_vacuum=INCREMENTAL for a new SQLite database; it only takes effect before the first table is created"""
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+
+def use_incremental_vacuum(engine):
+    """enable_incremental_vacuum() on every connection of a SQLAlchemy engine (main.py)"""
+    if engine.dialect.name != 'sqlite':
+        return
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'connect')
+    def _connect(dbapi_connection, connection_record):
+        enable_incremental_vacuum(dbapi_connection)
+
+
+def _policies(conn) -> Dict[int, Dict[str, float]]:
+    rows = execute_sql(conn, "SELECT id, retention_keep, retention_days, retention_bytes FROM canvases").fetchall()
+    return {row[0]: {'keep': RETENTION_KEEP if row[1] is None else row[1],
+                     'days': RETENTION_DAYS if row[2] is None else row[2],
+                     'bytes': RETENTION_BYTES if row[3] is None else row[3]} for row in rows}
+
+
+def _timestamp_text(value: Any) -> str:
+    # created_at is CURRENT_TIMESTAMP text in SQLite and a datetime in other databases
+    return value.strftime('%Y-%m-%d %H:%M:%S') if isinstance(value, datetime) else str(value or '')
+
+
+def expired_views(rows: List[Any], policy: Dict[str, float], now: datetime) -> List[int]:
+    """Ids to delete out of a canvas' (id, created_at, size_bytes) rows, newest first"""
+    cutoff = _timestamp_text(now - timedelta(days=policy['days'])) if policy['days'] else None
+    expired = []
+    total = 0
+    for i, (view_id, created_at, size) in enumerate(rows):
+        total += size or 0
+        if i == 0:
+            continue
+        if ((policy['keep'] and i >= policy['keep'])
+                or (cutoff and _timestamp_text(created_at) < cutoff)
+                or (policy['bytes'] and total > policy['bytes'])):
+            expired.append(view_id)
+    return expired
+
+
+def _backfill_sizes(conn) -> int:
+    """Sizes of views stored before size_bytes existed"""
+    filled = 0
+    while True:
+        count = execute_sql(conn, """
+            UPDATE views SET size_bytes = length(CAST(data AS TEXT)) + COALESCE(length(CAST(profile AS TEXT)), 0)
+            WHERE id IN (SELECT id FROM views WHERE size_bytes IS NULL LIMIT :batch)
+        """, {'batch': DELETE_BATCH}).rowcount
+        conn.commit()
+        filled += count
+        if count < DELETE_BATCH:
+            return filled
+
+
+def _delete(conn, ids: List[int]) -> int:
+    deleted = 0
+    for start in range(0, len(ids), DELETE_BATCH):
+        batch = ids[start:start + DELETE_BATCH]
+        params = {f'id{i}': view_id for i, view_id in enumerate(batch)}
+        deleted += execute_sql(conn, f"DELETE FROM views WHERE id IN ({', '.join(':' + name for name in params)})",
+                               params).rowcount
+        conn.commit()
+        change_feed.publish('view', 'delete', ids=batch)
+    return deleted
+
+
+def release_pages(conn, full: bool = False) -> Dict[str, Any]:
+    """Return free pages to the OS (SQLite with auto_vacuum=INCREMENTAL; full=True converts the database first)"""
+    if sql_dialect(conn) != 'sqlite':
+        return {}
+    conn.commit()
+    # SQLAlchemy closes the result of a row-less PRAGMA such as incremental_vacuum before it is
+    # stepped, so the pragmas go to the driver connection directly
+    raw = sqlite_connection(conn)
+    if full:
+        raw.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        raw.execute("VACUUM")
+    mode = raw.execute("PRAGMA auto_vacuum").fetchone()[0]
+    free = raw.execute("PRAGMA freelist_count").fetchone()[0]
+    released = 0
+    if mode == INCREMENTAL:
+        while free > 0:
+            # Each page released is one step of the pragma, so the rows have to be fetched
+            raw.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})").fetchall()
+            remaining = raw.execute("PRAGMA freelist_count").fetchone()[0]
+            released += free - remaining
+            if remaining >= free:
+                break
+            free = remaining
+        raw.commit()
+    return {'auto_vacuum': 'incremental' if mode == INCREMENTAL else 'none', 'released_pages': released,
+            'free_pages': free}
+
+
+def compact(conn, full_vacuum: bool = False, now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Apply every canvas' retention policy, drop orphaned views and release free pages"""
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    sized = _backfill_sizes(conn)
+    policies = _policies(conn)
+    canvas_ids = [row[0] for row in execute_sql(conn, "SELECT DISTINCT canvas_id FROM views").fetchall()]
+    expired: List[int] = []
+    orphans = 0
+    for canvas_id in canvas_ids:
+        if canvas_id not in policies:
+            orphans += execute_sql(conn, "DELETE FROM views WHERE canvas_id = :canvas_id" if canvas_id is not None
+                                   else "DELETE FROM views WHERE canvas_id IS NULL", {'canvas_id': canvas_id}).rowcount
+            conn.commit()
+            change_feed.publish('view', 'delete', canvas_id=canvas_id)
+            continue
+        # Served from ix_views_retention, so the (large) data column is never read
+        rows = execute_sql(conn, "SELECT id, created_at, size_bytes FROM views WHERE canvas_id = :canvas_id "
+                                 "ORDER BY id DESC", {'canvas_id': canvas_id}).fetchall()
+        expired.extend(expired_views(rows, policies[canvas_id], now))
+    deleted = _delete(conn, expired)
+    metrics.VIEWS_DELETED.inc('retention', amount=deleted)
+    metrics.VIEWS_DELETED.inc('orphan', amount=orphans)
+    return {'deleted': deleted, 'orphans_deleted': orphans, 'sizes_backfilled': sized, **release_pages(conn, full_vacuum)}
+
+
+class ViewCompactor:
+    def __init__(self, connect: Callable[[], Any], interval: float = COMPACT_SECONDS):
+        self.connect = connect
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='view-compactor', daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            conn = self.connect()
+            try:
+                compact(conn)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                conn.close()
@@ -3,9 +3,11 @@ import { Database, Workflow, Eye } from 'lucide-react'
 import TablesPage from './pages/TablesPage'
 import CanvasPage from './pages/CanvasPage'
 import ViewsPage from './pages/ViewsPage'
+import { useChangeFeed } from './lib/changes'
 
 function App() {
   const location = useLocation()
+  useChangeFeed()
 
   const navigation = [
     { name: 'Tables', href: '/', icon: Database },
@@ -1,10 +1,22 @@
 import { useState } from 'react'
 import { Plus, Trash2, Edit2, X } from 'lucide-react'
-import { Table, Record as TableRecord, Field } from '../types'
+import { Table, Record as TableRecord, Field, RecordSearchResult } from '../types'
 import { Button } from './ui/Button'
 import { FieldConfigModal } from './FieldConfigModal'
+import { recordsApi, MERGE_PATCH } from '../lib/api'
 import axios from 'axios'
 
+const getRelationTable = (field: Field): string | undefined => {
+  if (field.field_type !== 'relation') return undefined
+  const options = typeof field.options === 'string' ? JSON.parse(field.options) : field.options
+  return options?.relation_table || field.relation_table
+}
+
+const relatedLabel = (related: { [key: string]: any }) => {
+  const label = Object.entries(related).find(([key, value]) => key !== 'id' && typeof value === 'string')
+  return label ? label[1] : `#${related.id}`
+}
+
 interface EditableTableProps {
   table: Table
   tables: Table[]
@@ -19,10 +31,27 @@ export function EditableTable({ table, tables, records, onUpdate }: EditableTabl
   const [newFieldName, setNewFieldName] = useState('')
   const [editingField, setEditingField] = useState<number | null>(null)
   const [editFieldName, setEditFieldName] = useState('')
+  const [relationOptions, setRelationOptions] = useState<RecordSearchResult[]>([])
+
+  const searchRelation = async (field: Field, query: string) => {
+    const relationTable = getRelationTable(field)
+    if (!relationTable) return
+    try {
+      // Prefix search on the server instead of downloading the related table
+      const response = await recordsApi.search(relationTable, query)
+      setRelationOptions(response.data)
+    } catch (err) {
+      console.error('Error searching related records:', err)
+    }
+  }
 
   const handleCellClick = (record: TableRecord, field: Field) => {
     setEditingCell({ recordId: record.id, fieldName: field.name })
     setEditValue(record.data[field.name] || '')
+    if (field.field_type === 'relation') {
+      setRelationOptions([])
+      searchRelation(field, '')
+    }
   }
 
   const handleCellSave = async (recordId: number, fieldName: string) => {
@@ -30,11 +59,10 @@ export function EditableTable({ table, tables, records, onUpdate }: EditableTabl
       const record = records.find(r => r.id === recordId)
       if (!record) return
 
-      const updatedData = { ...record.data, [fieldName]: editValue }
-      
+      // Only the edited cell is sent, so concurrent edits of other cells are kept
       await axios.patch(`http://localhost:8000/api/t/${encodeURIComponent(table.name)}/records/${recordId}`, {
-        data: updatedData
-      })
+        data: { [fieldName]: editValue }
+      }, { headers: { 'Content-Type': MERGE_PATCH } })
       
       setEditingCell(null)
       onUpdate()
@@ -103,16 +131,12 @@ export function EditableTable({ table, tables, records, onUpdate }: EditableTabl
         return
       }
 
-      const emptyData: Record<string, any> = {}
-      table.fields.forEach(field => {
-        emptyData[field.name] = ''
-      })
-
-      console.log('Adding record with data:', emptyData)
       console.log('Table name:', table.name)
       
+      // No values: the server fills in field defaults, and blank skips the required check until cells are edited
       const response = await axios.post(`http://localhost:8000/api/t/${encodeURIComponent(table.name)}`, {
-        data: emptyData
+        data: {},
+        blank: true
       })
 
       console.log('Record added successfully:', response.data)
@@ -228,10 +252,15 @@ export function EditableTable({ table, tables, records, onUpdate }: EditableTabl
                       }}
                     >
                       {isEditing ? (
+                        <>
                         <input
                           type={field.field_type === 'number' ? 'number' : 'text'}
                           value={editValue}
-                          onChange={(e) => setEditValue(e.target.value)}
+                          list={field.field_type === 'relation' ? `relation-options-${field.id}` : undefined}
+                          onChange={(e) => {
+                            setEditValue(e.target.value)
+                            if (field.field_type === 'relation') searchRelation(field, e.target.value)
+                          }}
                           onKeyDown={(e) => {
                             if (e.key === 'Enter') handleCellSave(record.id, field.name)
                             if (e.key === 'Escape') setEditingCell(null)
@@ -240,9 +269,19 @@ export function EditableTable({ table, tables, records, onUpdate }: EditableTabl
                           className="w-full px-1 py-0.5 border border-blue-500 rounded focus:outline-none focus:ring-2 focus:ring-blue-500"
                           autoFocus
                         />
+                        {field.field_type === 'relation' && (
+                          <datalist id={`relation-options-${field.id}`}>
+                            {relationOptions.map(option => (
+                              <option key={option.id} value={option.id}>{String(option.label ?? '')}</option>
+                            ))}
+                          </datalist>
+                        )}
+                        </>
                       ) : (
                         <span className="block truncate">
-                          {record.data[field.name] || ''}
+                          {record.expanded?.[field.name]
+                            ? relatedLabel(record.expanded[field.name]!)
+                            : record.data[field.name] || ''}
                         </span>
                       )}
                     </td>
@@ -0,0 +1,38 @@
+import { Handle, Position } from 'reactflow'
+import { Calculator } from 'lucide-react'
+import { Card, CardContent, CardHeader, CardTitle } from '../ui/Card'
+
+interface ComputeNodeData {
+  columns: string
+  label: string
+}
+
+export default function ComputeNode({ data }: { data: ComputeNodeData }) {
+  const lines = (data.columns || '').split('\n').filter(line => line.trim())
+
+  return (
+    <Card className="min-w-[200px] shadow-lg">
+      <Handle type="target" position={Position.Left} className="w-3 h-3" />
+      <Handle type="source" position={Position.Right} className="w-3 h-3" />
+      
+      <CardHeader className="pb-2">
+        <CardTitle className="text-sm flex items-center">
+          <Calculator className="mr-2 h-4 w-4 text-orange-500" />
+          Compute
+        </CardTitle>
+      </CardHeader>
+      
+      <CardContent className="pt-0">
+        <div className="space-y-2">
+          <div className="text-xs text-muted-foreground">Columns:</div>
+          <div className="font-mono text-sm bg-muted/50 p-2 rounded">
+            {lines.length > 0 ? lines.map((line, i) => <div key={i}>{line}</div>) : 'No columns'}
+          </div>
+          {data.label && (
+            <div className="text-xs text-muted-foreground">{data.label}</div>
+          )}
+        </div>
+      </CardContent>
+    </Card>
+  )
+}
@@ -1,7 +1,8 @@
 import axios from 'axios';
-import { Table, Record, Canvas, View, CreateTableRequest, CreateRecordRequest, UpdateRecordRequest } from '../types';
+import { Table, TableStats, Record, RecordSearchResult, Canvas, CanvasOp, CanvasPlan, View, CompactResult, Trigger, Schedule, Job, ImportProgress, ExportParams, CreateTableRequest, CreateRecordRequest, UpdateRecordRequest } from '../types';
 
-const API_BASE_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
+export const MERGE_PATCH = 'application/merge-patch+json';
+export const API_BASE_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 
 const api = axios.create({
   baseURL: API_BASE_URL,
@@ -15,17 +16,33 @@ export const tablesApi = {
   getAll: () => api.get<Table[]>('/api/tables'),
   getByName: (name: string) => api.get<Table>(`/api/tables/${name}`),
   create: (data: CreateTableRequest) => api.post<Table>('/api/tables', data),
+  getStats: (name: string, refresh?: boolean) =>
+    api.get<TableStats>(`/api/tables/${name}/stats`, { params: refresh ? { refresh: 1 } : undefined }),
 };
 
 // Records API
 export const recordsApi = {
-  getAll: (tableName: string) => api.get<Record[]>(`/api/t/${tableName}`),
+  getAll: (tableName: string, params?: { expand?: string; limit?: number; offset?: number }) =>
+    api.get<Record[]>(`/api/t/${tableName}`, { params }),
+  search: (tableName: string, q: string, field?: string) =>
+    api.get<RecordSearchResult[]>(`/api/t/${tableName}/search`, { params: { q, field } }),
   create: (tableName: string, data: CreateRecordRequest) => 
     api.post<Record>(`/api/t/${tableName}`, data),
   update: (tableName: string, id: number, data: UpdateRecordRequest) => 
     api.patch<Record>(`/api/t/${tableName}/${id}`, data),
+  // Merge patch: only the given fields change, null clears one
+  patch: (tableName: string, id: number, data: UpdateRecordRequest) =>
+    api.patch<Record>(`/api/t/${tableName}/${id}`, data, { headers: { 'Content-Type': MERGE_PATCH } }),
   delete: (tableName: string, id: number) => 
     api.delete(`/api/t/${tableName}/${id}`),
+  import: (tableName: string, file: File, params?: { format?: 'csv' | 'ndjson'; mapping?: string; chunk_size?: number }) => {
+    const form = new FormData();
+    form.append('file', file);
+    return api.post<Job<ImportProgress>>(`/api/t/${tableName}/import`, form,
+      { params, headers: { 'Content-Type': 'multipart/form-data' } });
+  },
+  exportUrl: (tableName: string, params?: ExportParams) =>
+    api.getUri({ url: `/api/t/${tableName}/export`, params }),
 };
 
 // Canvas API
@@ -35,12 +52,44 @@ export const canvasApi = {
   create: (data: Partial<Canvas>) => api.post<Canvas>('/api/canvases', data),
   update: (id: number, data: Partial<Canvas>) => 
     api.patch<Canvas>(`/api/canvases/${id}`, data),
-  execute: (canvasId: number, viewName?: string) => 
-    api.post<View>('/api/canvases/execute', { canvas_id: canvasId, view_name: viewName }),
+  saveOps: (id: number, version: number, ops: CanvasOp[]) =>
+    api.patch<{ id: number; version: number; error?: string }>(`/api/canvases/${id}/ops`, { version, ops }),
+  execute: (canvasId: number, viewName?: string, profile?: boolean) => 
+    api.post<View>('/api/canvases/execute', { canvas_id: canvasId, view_name: viewName },
+      { params: profile ? { profile: 1 } : undefined }),
+  explain: (canvasId: number) => 
+    api.post<CanvasPlan>(`/api/canvases/${canvasId}/explain`),
 };
 
 // Views API
 export const viewsApi = {
   getAll: () => api.get<View[]>('/api/views'),
   getById: (id: number) => api.get<View>(`/api/view/${id}`),
+  exportUrl: (id: number, params?: ExportParams) =>
+    api.getUri({ url: `/api/view/${id}/export`, params }),
+  compact: (fullVacuum?: boolean) =>
+    api.post<CompactResult>('/api/views/compact', undefined, { params: fullVacuum ? { full_vacuum: 1 } : undefined }),
+};
+
+// Triggers API
+export const triggersApi = {
+  getAll: () => api.get<Trigger[]>('/api/triggers'),
+  create: (data: Omit<Trigger, 'id' | 'created_at' | 'last_run_at' | 'last_status' | 'last_error'>) =>
+    api.post<Trigger>('/api/triggers', data),
+  delete: (id: number) => api.delete(`/api/triggers/${id}`),
+};
+
+// Schedules API
+export const schedulesApi = {
+  getAll: () => api.get<Schedule[]>('/api/schedules'),
+  create: (data: Pick<Schedule, 'canvas_id' | 'cron'> & Partial<Pick<Schedule, 'overlap' | 'jitter_seconds' | 'keep_views' | 'enabled'>>) =>
+    api.post<Schedule>('/api/schedules', data),
+  delete: (id: number) => api.delete(`/api/schedules/${id}`),
+};
+
+// Jobs API
+export const jobsApi = {
+  getAll: () => api.get<Job[]>('/api/jobs'),
+  getById: (id: string) => api.get<Job>(`/api/jobs/${id}`),
+  cancel: (id: string) => api.delete<Job>(`/api/jobs/${id}`),
 };
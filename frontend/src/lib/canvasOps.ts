@@ -0,0 +1,39 @@
+import { CanvasOp } from '../types';
+
+type Element = { id: string };
+
+// Top-level keys that differ; null removes a key, as the server applies updates
+function changedKeys(before: { [key: string]: any }, after: { [key: string]: any }) {
+  const changes: { [key: string]: any } = {};
+  for (const key of new Set([...Object.keys(before), ...Object.keys(after)])) {
+    if (JSON.stringify(before[key]) !== JSON.stringify(after[key])) changes[key] = after[key] ?? null;
+  }
+  return changes;
+}
+
+function diff(kind: 'node' | 'edge', before: Element[], after: Element[]): CanvasOp[] {
+  const ops: CanvasOp[] = [];
+  const previous = new Map(before.map(element => [element.id, element] as const));
+  const current = new Set(after.map(element => element.id));
+  for (const element of before) {
+    if (!current.has(element.id)) ops.push({ op: kind === 'node' ? 'remove_node' : 'remove_edge', id: element.id });
+  }
+  for (const element of after) {
+    const old = previous.get(element.id);
+    if (!old) {
+      ops.push(kind === 'node' ? { op: 'add_node', node: element } : { op: 'add_edge', edge: element });
+      continue;
+    }
+    const changes = changedKeys(old, element);
+    if (Object.keys(changes).length > 0) {
+      ops.push({ op: kind === 'node' ? 'update_node' : 'update_edge', id: element.id, changes });
+    }
+  }
+  return ops;
+}
+
+// Operations turning the last saved graph into the current one, for canvasApi.saveOps
+export function diffCanvas(saved: { nodes: Element[]; edges: Element[] },
+                           current: { nodes: Element[]; edges: Element[] }): CanvasOp[] {
+  return [...diff('node', saved.nodes, current.nodes), ...diff('edge', saved.edges, current.edges)];
+}
@@ -0,0 +1,82 @@
+import { useEffect } from 'react';
+import { QueryClient, useQueryClient } from '@tanstack/react-query';
+import { API_BASE_URL } from './api';
+import { ChangeEvent, Record as TableRecord, View } from '../types';
+
+// Applies one change to the cached lists, refetching only what a delta cannot update
+function applyChange(queryClient: QueryClient, event: ChangeEvent) {
+  if (event.type === 'record' && event.table) {
+    const key = ['records', event.table];
+    const cached = queryClient.getQueryData<TableRecord[]>(key);
+    if (!cached) return;
+    const ids = new Set(event.ids ?? []);
+    if (event.action === 'delete') {
+      queryClient.setQueryData<TableRecord[]>(key, cached.filter(record => !ids.has(record.id)));
+      return;
+    }
+    if (!event.records) {
+      queryClient.invalidateQueries({ queryKey: key });
+      return;
+    }
+    const byId = new Map(event.records.map(record => [record.id, record] as const));
+    const next: TableRecord[] = [];
+    for (const record of cached) {
+      const changed = byId.get(record.id);
+      if (!changed) {
+        next.push(record);
+        continue;
+      }
+      byId.delete(record.id);
+      // Expanded relations stay valid only while the relation values are the same
+      const expanded = record.expanded;
+      if (expanded && Object.keys(expanded).some(field => changed.data[field] !== record.data[field])) {
+        queryClient.invalidateQueries({ queryKey: key });
+        return;
+      }
+      next.push({ ...record, ...changed, expanded });
+    }
+    if (byId.size > 0 && cached.some(record => record.expanded)) {
+      // New records would need their relations expanded by the server
+      queryClient.invalidateQueries({ queryKey: key });
+      return;
+    }
+    queryClient.setQueryData<TableRecord[]>(key, [...next, ...byId.values()]);
+  } else if (event.type === 'table') {
+    queryClient.invalidateQueries({ queryKey: ['tables'] });
+  } else if (event.type === 'canvas') {
+    queryClient.invalidateQueries({ queryKey: ['canvases'] });
+    if (event.id !== undefined) queryClient.invalidateQueries({ queryKey: ['canvas', event.id] });
+  } else if (event.type === 'view') {
+    const cached = queryClient.getQueryData<View[]>(['views']);
+    if (cached && event.action === 'delete' && event.ids) {
+      const ids = new Set(event.ids);
+      queryClient.setQueryData<View[]>(['views'], cached.filter(view => !ids.has(view.id)));
+    } else {
+      queryClient.invalidateQueries({ queryKey: ['views'] });
+    }
+  }
+}
+
+// Keeps the query cache current from GET /api/changes instead of refetching lists on focus.
+// Without the feed (older server, connection lost) pages fall back to refetching on focus.
+export function useChangeFeed() {
+  const queryClient = useQueryClient();
+
+  useEffect(() => {
+    const source = new EventSource(`${API_BASE_URL}/api/changes`);
+    const setLive = (live: boolean) =>
+      queryClient.setDefaultOptions({ queries: { ...queryClient.getDefaultOptions().queries, refetchOnWindowFocus: !live } });
+
+    source.onopen = () => setLive(true);
+    source.onerror = () => setLive(false);
+    source.addEventListener('change', message => {
+      applyChange(queryClient, JSON.parse((message as MessageEvent).data));
+    });
+    // Events were missed (server restart, long disconnect): everything may be stale
+    source.addEventListener('reset', () => queryClient.invalidateQueries());
+    return () => {
+      source.close();
+      setLive(false);
+    };
+  }, [queryClient]);
+}
@@ -1,4 +1,4 @@
-import React, { useState, useCallback, useMemo } from 'react'
+import React, { useState, useCallback, useMemo, useRef } from 'react'
 import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query'
 import ReactFlow, {
   Node,
@@ -13,9 +13,10 @@ import ReactFlow, {
   NodeTypes,
 } from 'reactflow'
 import 'reactflow/dist/style.css'
-import { Play, Plus, Save, Database, Filter, GitMerge, Webhook } from 'lucide-react'
+import { Play, Plus, Save, Database, Filter, GitMerge, Webhook, Calculator } from 'lucide-react'
 
 import { canvasApi, tablesApi } from '../lib/api'
+import { diffCanvas } from '../lib/canvasOps'
 import { Button } from '../components/ui/Button'
 import { Card, CardContent, CardHeader, CardTitle } from '../components/ui/Card'
 import { Input } from '../components/ui/Input'
@@ -23,12 +24,14 @@ import TableNode from '../components/nodes/TableNode'
 import FilterNode from '../components/nodes/FilterNode'
 import JoinNode from '../components/nodes/JoinNode'
 import WebhookNode from '../components/nodes/WebhookNode'
+import ComputeNode from '../components/nodes/ComputeNode'
 
 const nodeTypes: NodeTypes = {
   tableNode: TableNode,
   filterNode: FilterNode,
   joinNode: JoinNode,
   webhookNode: WebhookNode,
+  computeNode: ComputeNode,
 }
 
 const initialNodes: Node[] = []
@@ -63,18 +66,33 @@ export default function CanvasPage() {
     enabled: !!selectedCanvas,
   })
 
+  // The graph as the server has it, so a save sends only the operations since then
+  const saved = useRef<{ version: number; nodes: Node[]; edges: Edge[] } | null>(null)
+
   // Update nodes and edges when canvas loads
   React.useEffect(() => {
     if (currentCanvas) {
       setNodes(currentCanvas.nodes || [])
       setEdges(currentCanvas.edges || [])
+      saved.current = { version: currentCanvas.version ?? 1, nodes: currentCanvas.nodes || [], edges: currentCanvas.edges || [] }
     }
   }, [currentCanvas, setNodes, setEdges])
 
   // Save canvas mutation
   const saveCanvasMutation = useMutation({
     mutationFn: (data: { id?: number; name: string; nodes: Node[]; edges: Edge[] }) => {
-      if (data.id) {
+      if (data.id && saved.current) {
+        const ops = diffCanvas(saved.current, data)
+        return canvasApi.saveOps(data.id, saved.current.version, ops).then(response => {
+          // advanced_server reports errors with HTTP 200 and {error, version}; fail like main.py's 409 / 4xx
+          if (response.data.error) {
+            const status = response.data.version !== undefined ? 409 : 400
+            throw Object.assign(new Error(response.data.error), { response: { status, data: response.data } })
+          }
+          saved.current = { version: response.data.version, nodes: data.nodes, edges: data.edges }
+          return response
+        })
+      } else if (data.id) {
         return canvasApi.update(data.id, { nodes: data.nodes, edges: data.edges })
       } else {
         return canvasApi.create({ name: data.name, nodes: data.nodes, edges: data.edges })
@@ -83,6 +101,15 @@ export default function CanvasPage() {
     onSuccess: () => {
       queryClient.invalidateQueries({ queryKey: ['canvases'] })
     },
+    onError: (error: any, data) => {
+      if (error?.response?.status === 409 && data.id) {
+        // Saved elsewhere in the meantime: load the current version
+        alert('This canvas was changed by another save. Reloading it, please redo your last changes.')
+        queryClient.invalidateQueries({ queryKey: ['canvas', data.id] })
+      } else {
+        alert(`Saving the canvas failed: ${error.response?.data?.detail ?? error.response?.data?.error ?? error.message}`)
+      }
+    },
   })
 
   // Execute canvas mutation
@@ -94,6 +121,10 @@ export default function CanvasPage() {
       setShowExecuteModal(false)
       alert('Canvas executed successfully! Check the Views page to see results.')
     },
+    onError: (error: any) => {
+      // 400 carries the planning error, e.g. a computeNode column using an unknown field
+      alert(`Canvas execution failed: ${error.response?.data?.detail ?? error.message}`)
+    },
   })
 
   const onConnect = useCallback(
@@ -124,6 +155,8 @@ export default function CanvasPage() {
         return { condition: '', label: 'Filter Data' }
       case 'joinNode':
         return { joinTable: '', joinField: '', targetField: '', label: 'Join Tables' }
+      case 'computeNode':
+        return { columns: '', label: 'Computed Columns' }
       case 'webhookNode':
         return { webhookUrl: '', label: 'Send to Webhook' }
       default:
@@ -140,6 +173,7 @@ export default function CanvasPage() {
   }
 
   const saveCanvas = () => {
+    if (selectedCanvas && saved.current && diffCanvas(saved.current, { nodes, edges }).length === 0) return
     const name = currentCanvas?.name || `Canvas_${Date.now()}`
     saveCanvasMutation.mutate({
       id: selectedCanvas || undefined,
@@ -245,6 +279,14 @@ export default function CanvasPage() {
                 <GitMerge className="mr-2 h-4 w-4" />
                 Join
               </Button>
+              <Button
+                variant="outline"
+                className="w-full justify-start"
+                onClick={() => addNode('computeNode')}
+              >
+                <Calculator className="mr-2 h-4 w-4" />
+                Compute
+              </Button>
               <Button
                 variant="outline"
                 className="w-full justify-start"
@@ -380,6 +422,30 @@ function NodePropertiesPanel({
           </>
         )}
 
+        {node.type === 'computeNode' && (
+          <>
+            <div>
+              <label className="block text-sm font-medium mb-1">Columns</label>
+              <textarea
+                value={data.columns || ''}
+                onChange={(e) => handleUpdate('columns', e.target.value)}
+                placeholder={'available = stock - reserved\nprice_total = price_rub * qty'}
+                rows={4}
+                className="w-full border rounded px-3 py-2 font-mono text-sm"
+              />
+              <div className="text-xs text-muted-foreground mt-1">One column per line: name = expression</div>
+            </div>
+            <div>
+              <label className="block text-sm font-medium mb-1">Label</label>
+              <Input
+                value={data.label || ''}
+                onChange={(e) => handleUpdate('label', e.target.value)}
+                placeholder="Node label"
+              />
+            </div>
+          </>
+        )}
+
         {node.type === 'joinNode' && (
           <>
             <div>
@@ -36,7 +36,15 @@ export default function TablesPage() {
   // Fetch records for selected table
   const { data: records = [], isLoading: recordsLoading } = useQuery({
     queryKey: ['records', selectedTable?.name],
-    queryFn: () => selectedTable ? recordsApi.getAll(selectedTable.name).then(res => res.data) : [],
+    queryFn: () => {
+      if (!selectedTable) return []
+      // Resolve relation columns server-side instead of loading the related tables
+      const expand = selectedTable.fields
+        .filter(field => field.field_type === 'relation')
+        .map(field => field.name)
+        .join(',')
+      return recordsApi.getAll(selectedTable.name, { expand: expand || undefined }).then(res => res.data)
+    },
     enabled: !!selectedTable,
   })
 
@@ -329,7 +337,10 @@ function EditRecordModal({
   const [formData, setFormData] = useState<any>(record.data)
 
   const updateRecordMutation = useMutation({
-    mutationFn: (data: any) => recordsApi.update(table.name, record.id, { data }),
+    mutationFn: (data: any) => {
+      const changed = Object.fromEntries(Object.entries(data).filter(([name, value]) => value !== record.data[name]))
+      return recordsApi.patch(table.name, record.id, { data: changed })
+    },
     onSuccess,
   })
 
@@ -22,12 +22,38 @@ export interface Table {
   fields: Field[];
 }
 
+export interface FieldStats {
+  null_fraction: number;
+  distinct: number;
+  min: any;
+  max: any;
+  top_values: { value: any; count: number }[];
+}
+
+export interface TableStats {
+  table: string;
+  row_count: number;
+  sampled_rows: number;
+  sample_fraction: number;
+  analyzed_at: string;
+  pending_writes: number;
+  fields: { [field: string]: FieldStats };
+}
+
 export interface Record {
   id: number;
   table_id: number;
   data: Record<string, any>;
   created_at: string;
   updated_at?: string;
+  // Related records resolved server-side via ?expand=
+  expanded?: { [field: string]: ({ id: number } & { [key: string]: any }) | null };
+}
+
+export interface RecordSearchResult {
+  id: number;
+  label: any;
+  data: { [key: string]: any };
 }
 
 export interface Canvas {
@@ -36,18 +62,149 @@ export interface Canvas {
   description?: string;
   nodes: any[];
   edges: any[];
+  // Bumped by every save of nodes/edges; incremental saves must start from the current one
+  version?: number;
+  // View retention, null = server default, 0 = unlimited
+  retention_keep?: number | null;
+  retention_days?: number | null;
+  retention_bytes?: number | null;
   created_at: string;
   updated_at?: string;
 }
 
+// One step of an incremental canvas save (PATCH /api/canvases/{id}/ops)
+export type CanvasOp =
+  | { op: 'add_node'; node: any }
+  | { op: 'add_edge'; edge: any }
+  | { op: 'update_node' | 'update_edge'; id: string; changes: { [key: string]: any } }
+  | { op: 'remove_node' | 'remove_edge'; id: string };
+
 export interface View {
   id: number;
   name: string;
   canvas_id: number;
   data: Record<string, any>[];
+  profile?: CanvasProfile | null;
+  size_bytes?: number | null;
   created_at: string;
 }
 
+export interface CompactResult {
+  deleted: number;
+  orphans_deleted: number;
+  sizes_backfilled: number;
+  auto_vacuum?: 'incremental' | 'none';
+  released_pages?: number;
+  free_pages?: number;
+}
+
+export interface NodeProfile {
+  id: string;
+  type: string;
+  wall_ms: number;
+  rows_in: number | null;
+  rows_out: number | null;
+  alloc_bytes: number;
+  peak_alloc_bytes: number | null;
+  sql_queries: number;
+  sql_ms: number;
+  cache: Record<string, { hits: number; misses: number }>;
+  pushed: string[];
+}
+
+export interface CanvasProfile {
+  total_ms: number;
+  nodes: NodeProfile[];
+}
+
+export interface PlanOperator {
+  operator: string;
+  nodes: string[];
+  sql?: string;
+  estimated_rows?: number;
+  shared?: boolean;
+  [key: string]: any;
+}
+
+export interface CanvasPlan {
+  canvas_id: number;
+  plan: {
+    pipelines: PlanOperator[][];
+    rewrites: string[];
+    cached: boolean;
+  };
+}
+
+export interface Trigger {
+  id: number;
+  canvas_id: number;
+  table_name: string;
+  events: ('insert' | 'update' | 'delete')[];
+  mode: 'delta' | 'full';
+  window_ms: number;
+  max_batch: number;
+  enabled: boolean;
+  last_run_at?: string;
+  last_status?: string;
+  last_error?: string;
+  created_at: string;
+}
+
+export interface Schedule {
+  id: number;
+  canvas_id: number;
+  cron: string;
+  overlap: 'skip' | 'queue';
+  jitter_seconds: number;
+  keep_views: number;
+  enabled: boolean;
+  next_run_at?: number;
+  last_run_at?: string;
+  last_status?: string;
+  last_error?: string;
+  created_at: string;
+}
+
+export interface Job<Progress = { [key: string]: any }> {
+  id: string;
+  kind: string;
+  status: 'running' | 'done' | 'failed' | 'cancelled';
+  info: { [key: string]: any };
+  progress: Progress;
+  result?: Progress;
+  error?: string;
+  started_at: number;
+  finished_at?: number;
+}
+
+export interface ImportProgress {
+  rows: number;
+  inserted: number;
+  failed: number;
+  errors: Array<{ row: number; errors: { [field: string]: string } }>;
+  unmapped_columns: string[];
+  bytes_read: number;
+}
+
+export interface ExportParams {
+  format?: 'csv' | 'ndjson' | 'parquet' | 'arrow';
+  fields?: string;
+  batch_size?: number;
+}
+
+export interface ChangeEvent {
+  seq: number;
+  type: 'record' | 'table' | 'canvas' | 'view';
+  action: 'insert' | 'update' | 'delete';
+  table?: string;
+  id?: number;
+  ids?: number[];
+  name?: string;
+  canvas_id?: number;
+  // Changed records, present when there are few of them
+  records?: Record[];
+}
+
 export interface CreateTableRequest {
   name: string;
   display_name: string;
@@ -57,6 +214,8 @@ export interface CreateTableRequest {
 
 export interface CreateRecordRequest {
   data: Record<string, any>;
+  // An empty grid row, filled in cell by cell: required fields are not checked yet
+  blank?: boolean;
 }
 
 export interface UpdateRecordRequest {